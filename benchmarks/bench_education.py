@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Benchmark of the education field extraction against the previous implementation (kept below:
+patterns recompiled on every call, and each parser called up to three times per degree).
+
+The education partition of each given PDF is cut into sections by both education sub parsers,
+as EduParser does. The workload of a CV is then what EduParser asks of the field parsers:
+EduFieldParser on the string of every section, and the year, degree and institution parsers
+on the first two lines and on every line, as education_identifier_parser does. The memo of
+education_fields is cleared before each CV. Both implementations must give the same records.
+
+Usage, from the repository root:
+    python benchmarks/bench_education.py data/test/*.pdf
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from CVCodingTool.src.field_parser import EduFieldParser, education_fields
+from CVCodingTool.src.partition_parser import CVParser
+from CVCodingTool.src.section_sub_parser import education_identifier_parser, section_paragraph_parser
+
+
+def degree_parser_reference(string):
+    if re.findall(r'Post-doc|POSTDOC|Postdoc', string, re.IGNORECASE):
+        return ["Post-doc"]
+    elif re.findall(r'P[Hh]\.?D', string) and re.findall(r'M\.[SA]|Master|MASTER', string):
+        return ["Ph.D.", "Masters"]
+    elif re.findall(r'Ph[.]?[ ]*D|DOCTOR|doctor|Doctor|J\.D', string):
+        return ["Ph.D."]
+    elif re.findall(r'M\.[SA]|Master|MASTER', string) and re.findall(r'Bachelor|B\.[SA]', string):
+        return ["Masters", "Bachelor"]
+    elif re.findall(r'M[.]A|M[.]S|Master|master|MASTER', string):
+        return ["Masters"]
+    elif re.findall(r'B[.]A|B[.]S|Bachelor|bachelor|BACHELOR', string):
+        return ["Bachelor"]
+    elif re.findall(r'scholar', string, re.IGNORECASE):
+        return ["Scholar"]
+    elif re.findall(r'BS|BA|B\.|Bsc', string):
+        return ["Bachelor"]
+    elif re.findall(r'MS|MA|MPH|M\.[A-Z]|Msc|MR', string):
+        return ["Masters"]
+    return None
+
+
+def institution_parser_reference(string):
+    institution_hierarchy = [r'Universi|UNIVERSI', r'College|COLLEGE', r'Institut|INSTITUT', r'Center|CENTER',
+                             r'UC', r'School|SCHOOL', r'Polytech|polytech|POLYTECH', r'Academy|academy']
+    for institution_type in institution_hierarchy:
+        if re.findall(institution_type, string):
+            text_list = re.split(r'[,.;:()]|(?:\s+\-\s+)', string)
+            for pos, val in enumerate(text_list):
+                if len(val) >= 56:
+                    continue
+                if re.findall(r'university of california$', val, re.IGNORECASE) \
+                        and pos != len(text_list) - 1:
+                    val += ',' + text_list[pos + 1]
+                    return [re.sub(r'^[^a-zA-Z]*|[0-9]| *$', '', val)]
+                if re.findall(institution_type, val):
+                    return [re.sub(r'^[^a-zA-Z]*|[0-9]| *$', '', val)]
+    return None
+
+
+def year_parser_reference(string):
+    text = re.sub(r'present|progress', 'NOW', string, flags=re.IGNORECASE)
+    text_list = re.findall(r'NOW|(?:19|20)[0-9]{2}.{,8}[-|to]{1,3}.{,8}NOW|'
+                           r'(?:19|20)[0-9]{2}.{,8}-{1,3}.{,8}(?:19|20)[0-9]{2}|(?:19|20)[0-9]{2}', text)
+    if text_list:
+        year_list = []
+        for val in text_list:
+            if 'NOW' in val:
+                year_list.append('NOW')
+                continue
+            elif re.findall(r'-', val):
+                year_list.append(re.findall(r'(?:19|20)[0-9]{2}', val)[1])
+                continue
+            elif re.findall(r'(?:19|20)[0-9]{2}', val):
+                year_list.append(val)
+        return year_list
+    else:
+        return None
+
+
+def transform_reference(record_dict):
+    result_mapping = {"degree": degree_parser_reference,
+                      "year": year_parser_reference,
+                      "institution": institution_parser_reference}
+    check_id = "degree"
+    needed_id = ["year", "institution"]
+    string = record_dict['string']
+    val_dict = dict.fromkeys(result_mapping.keys())
+    section_dict = []
+
+    check_result = result_mapping[check_id](string)
+    if check_result:
+        for i in range(len(check_result)):
+            for ke, func in result_mapping.items():
+                if not func(string):
+                    val_dict[ke] = None
+                else:
+                    if len(func(string)) >= len(check_result):
+                        val_dict[ke] = func(string)[i]
+                    else:
+                        val_dict[ke] = func(string)[0]
+            if any([val_dict[idx] for idx in needed_id]):
+                section_dict.append(val_dict.copy())
+    return [{**record_dict, **val} for val in section_dict]
+
+
+def education_workload(file_pdf, partition_string):
+    """
+    :return: (section strings, lines) of the education partition of the CV.
+    """
+    cv_parser = CVParser(os.path.dirname(file_pdf), os.path.basename(file_pdf), layout_cache=False)
+    texts = cv_parser.get_partition_texts(partition_string)
+    if not texts:
+        return [], []
+    strings = []
+    for sub_parser in (section_paragraph_parser, education_identifier_parser):
+        strings += [', '.join(texts.text[val[0]:val[1]]) for val in sub_parser(texts) or []]
+    return strings, [val for val in texts.text if val]
+
+
+def run_reference(strings, lines):
+    records = [transform_reference({'string': string}) for string in strings]
+    first = ' '.join(lines[:2])
+    parsed = [[parser(first)] + [parser(line) for line in lines]
+              for parser in (year_parser_reference, degree_parser_reference, institution_parser_reference)]
+    return records, parsed
+
+
+def run_current(strings, lines):
+    education_fields.cache_clear()
+    records = [EduFieldParser({'string': string}).record_dict for string in strings]
+    first = ' '.join(lines[:2])
+    parsed = [[parser(first)] + [parser(line) for line in lines]
+              for parser in (EduFieldParser.year_parser, EduFieldParser.degree_parser,
+                             EduFieldParser.institution_parser)]
+    return records, parsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pdfs', nargs='+')
+    parser.add_argument('-n', action='store', dest='number', type=int, default=20)
+    parsed = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), '..', 'config.json')) as f:
+        partition_string = json.load(f)['education']['string']
+    workloads = [education_workload(file_pdf, partition_string) for file_pdf in parsed.pdfs]
+    workloads = [val for val in workloads if val[0] or val[1]]
+    strings = sum(len(val[0]) for val in workloads)
+    lines = sum(len(val[1]) for val in workloads)
+
+    mismatches = sum(run_reference(*val) != run_current(*val) for val in workloads)
+    reference = min(timeit.repeat(lambda: [run_reference(*val) for val in workloads], number=1,
+                                  repeat=parsed.number))
+    current = min(timeit.repeat(lambda: [run_current(*val) for val in workloads], number=1, repeat=parsed.number))
+    print('%d CVs, %d section strings, %d lines' % (len(workloads), strings, lines))
+    print('reference: %.2fms, %.0f strings/s' % (reference * 1e3, (strings + lines) / reference))
+    print('current:   %.2fms, %.0f strings/s' % (current * 1e3, (strings + lines) / current))
+    print('%.1fx, %d/%d CVs with mismatches' % (reference / current, mismatches, len(workloads)))
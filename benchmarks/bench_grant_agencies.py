@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Benchmark of the grant agency matching against the previous loop (re.findall of every pattern
+of the mapping in turn, until one is found).
+
+The agency table is grant_mapping followed by random agencies (a name of three to six words
+and an upper-case abbreviation) up to each size. Grant strings mix names and abbreviations of
+the table, partial names, amounts and years. Both must pick the same agency for every string.
+
+Usage, from the repository root:
+    python benchmarks/bench_grant_agencies.py [-n 500] [--sizes 37,100,300,500]
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from CVCodingTool.src.agency_matcher import AgencyMatcher
+from CVCodingTool.src.environments import grant_mapping
+
+WORDS = ['National', 'Institute', 'Foundation', 'Research', 'Council', 'Science', 'Health', 'Energy', 'Office',
+         'Agency', 'Department', 'Medical', 'Trust', 'Fund', 'Society', 'American', 'California', 'Ocean',
+         'Advanced', 'Naval', 'Defense', 'Cancer', 'Brain', 'Children', 'Environment', 'Technology']
+
+
+def first_reference(mapping, text):
+    for key, val in mapping.items():
+        if re.findall(val, text):
+            return key
+    return None
+
+
+def agency_table(size, seed):
+    rng = random.Random(seed)
+    mapping = dict(grant_mapping)
+    while len(mapping) < size:
+        name = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 6)))
+        key = ''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(3, 6)))
+        if key not in mapping:
+            mapping[key] = '%s|%s' % (re.escape(name), key)
+    return mapping
+
+
+def grant_strings(mapping, count, seed):
+    rng = random.Random(seed)
+    pieces = [val for pattern in mapping.values() for val in pattern.replace('[,]?', ',').replace('\\', '').split('|')]
+    strings = []
+    for _ in range(count):
+        parts = [rng.choice(pieces) if rng.random() < 0.3 else ' '.join(rng.choice(WORDS) for _ in range(3))
+                 for _ in range(rng.randint(1, 4))]
+        parts.append('$%d,000, %d-%d' % (rng.randint(10, 999), rng.randint(1995, 2012), rng.randint(2013, 2020)))
+        strings.append(', '.join(parts))
+    return strings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', action='store', dest='number', type=int, default=500, help='grant strings per size')
+    parser.add_argument('--sizes', action='store', dest='sizes', default='37,100,300,500')
+    parsed = parser.parse_args()
+
+    for size in [int(val) for val in parsed.sizes.split(',')]:
+        mapping = agency_table(size, size)
+        strings = grant_strings(mapping, parsed.number, size)
+        build = min(timeit.repeat(lambda: AgencyMatcher(mapping), number=1, repeat=3))
+        matcher = AgencyMatcher(mapping)
+        mismatches = sum(first_reference(mapping, val) != matcher.first(val) for val in strings)
+        reference = min(timeit.repeat(lambda: [first_reference(mapping, val) for val in strings], number=1, repeat=3))
+        current = min(timeit.repeat(lambda: [matcher.first(val) for val in strings], number=1, repeat=3))
+        print('%d agencies: build %.1fms, reference %.1fus, current %.1fus per string, %.1fx, %d/%d mismatches' %
+              (len(mapping), build * 1e3, reference / len(strings) * 1e6, current / len(strings) * 1e6,
+               reference / current, mismatches, len(strings)))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of CVParser.header_checker.
+
+The calls made while parsing each given PDF are recorded, then replayed against the previous
+implementation (patterns recompiled on every call, no memo) and the current one (compiled
+patterns, memoized per text, cache cleared before each CV). The same is done over every text
+line of the CV, the worst case when the partition is searched through all font groups. Both
+implementations must agree on every call.
+
+Usage, from the repository root:
+    python benchmarks/bench_header_checker.py data/test/*.pdf
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from CVCodingTool.src.partition_parser import CVParser, HEADER_LIST, is_header
+
+
+def header_checker_reference(header):
+    if re.findall(r'(?:[A-Za-z] ){4,}', header):
+        header = re.sub(r' ', '', header)
+    if re.findall(HEADER_LIST, re.sub(r' ', '', header), re.IGNORECASE) \
+            and len(re.split(r'\s+', header)) <= 8 \
+            and len(re.findall(r"^[A-Z]", header)) > 0:
+        return True
+    else:
+        return False
+
+
+def record_calls(file_pdf):
+    calls = []
+    header_checker = CVParser.header_checker
+
+    def recording(self, header):
+        calls.append(header)
+        return header_checker(self, header)
+
+    CVParser.header_checker = recording
+    try:
+        cv_parser = CVParser(os.path.dirname(file_pdf), os.path.basename(file_pdf), layout_cache=False)
+    finally:
+        CVParser.header_checker = header_checker
+    return calls, [text.text for text in cv_parser.texts if text.text]
+
+
+def replay_current(calls):
+    is_header.cache_clear()
+    for header in calls:
+        is_header(header)
+
+
+def replay_reference(calls):
+    for header in calls:
+        header_checker_reference(header)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pdfs', nargs='+')
+    parser.add_argument('-n', action='store', dest='number', type=int, default=20)
+    parsed = parser.parse_args()
+
+    total_reference, total_current = 0.0, 0.0
+    for file_pdf in parsed.pdfs:
+        recorded, lines = record_calls(file_pdf)
+        for label, calls in (('parse', recorded), ('all lines', lines)):
+            mismatches = sum(is_header(val) != header_checker_reference(val) for val in calls)
+            reference = min(timeit.repeat(lambda: replay_reference(calls), number=1, repeat=parsed.number))
+            current = min(timeit.repeat(lambda: replay_current(calls), number=1, repeat=parsed.number))
+            total_reference += reference
+            total_current += current
+            print('%s, %s: %d calls (%d distinct), reference %.2fms, current %.2fms, %.1fx, %d mismatches' %
+                  (os.path.basename(file_pdf), label, len(calls), len(set(calls)), reference * 1e3, current * 1e3,
+                   reference / current if current else 0, mismatches))
+    print('total: reference %.2fms, current %.2fms, %.1fx' % (total_reference * 1e3, total_current * 1e3,
+                                                              total_reference / total_current if total_current else 0))
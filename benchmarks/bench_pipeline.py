@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the parsing pipeline, stage by stage, on a synthetic CV corpus.
+
+The corpus is generated as pdftohtml -xml output (so no PDF tool is needed): CVs with the
+given number of sections, of which education, publications and grants, and the given number
+of degrees, publications (with titles of --pub-words words, wrapped over several lines with a
+hanging indent) and grants. PDFs can be given instead, converted with the backend of
+config.json.
+
+Every CV goes through the steps of CVParser and Manager one at a time, each timed alone:
+file_preprocess, text_preprocess, build_groups, get_partition, section_sub_parsers (the sub
+parsers of every partition on its texts), records_<partition> (get_partition_records: the
+section parser, its field parsers and the rows) and output (the rows written by OutputWriter).
+Network lookups are served from an empty offline response cache, so the publication records
+measure the CPU work only, unless --mock runs them against the mock server of config.json,
+started in the process with a fresh response cache.
+
+For each stage, the throughput (CVs per second of the stage), latency percentiles and, from a
+second pass under tracemalloc, the peak memory allocated by the stage are reported, with the
+peak RSS of the process. --json writes them to a file, and --compare prints the ratios to the
+file of an earlier version.
+
+Usage, from the repository root:
+    python benchmarks/bench_pipeline.py [-n 50] [--sections 6] [--publications 20] [--pub-words 12]
+        [--mock] [--json bench.json] [--compare bench_old.json] [pdfs ...]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from CVCodingTool.src.converters import PdfConverter, configure_converter, get_converter
+from CVCodingTool.src.layout_cache import configure_layout_cache
+from CVCodingTool.src.mock_server import mock_profile, start_mock_server
+from CVCodingTool.src.network import configure_network
+from CVCodingTool.src.output_writer import OutputWriter
+from CVCodingTool.src.partition_parser import CVParser
+from CVCodingTool.src.quota import configure_quota_ledger
+from CVCodingTool.src.response_cache import configure_response_cache
+from CVCodingTool.src.section_sub_parser import education_identifier_parser, section_left_parser, \
+    section_paragraph_parser
+from CVCodingTool.src.similarity import configure_similarity
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PARTITIONS = ['education', 'publication', 'grant']
+# The sub parsers of each section parser, in the order it tries them.
+SUB_PARSERS = {'education': [section_paragraph_parser, education_identifier_parser],
+               'publication': [section_left_parser, section_paragraph_parser],
+               'grant': [section_left_parser, section_paragraph_parser]}
+STAGES = ['file_preprocess', 'text_preprocess', 'build_groups', 'get_partition', 'section_sub_parsers'] + \
+         ['records_%s' % val for val in PARTITIONS] + ['output']
+
+PAGE_HEIGHT, PAGE_WIDTH, MARGIN, INDENT = 1188, 918, 108, 126
+HEADERS = {'education': 'EDUCATION', 'publication': 'PUBLICATIONS', 'grant': 'GRANTS AND FELLOWSHIPS'}
+OTHER_HEADERS = ['RESEARCH EXPERIENCE', 'AWARDS', 'PRESENTATIONS', 'TEACHING EXPERIENCE', 'SKILLS',
+                 'PROFESSIONAL SERVICE', 'REFERENCES', 'CONFERENCE TALKS']
+DEGREES = ['Ph.D. in Chemistry', 'M.S. in Physics', 'B.S. in Biology', 'Master of Science in Engineering',
+           'Bachelor of Arts in Economics', 'Doctor of Philosophy in Neuroscience', 'B.A. in Mathematics']
+INSTITUTIONS = ['University of California, Berkeley', 'Stanford University', 'Peking University',
+                'Massachusetts Institute of Technology', 'Imperial College London', 'University of Michigan']
+AGENCIES = ['National Science Foundation', 'National Institutes of Health', 'NIH', 'NSF', 'USDA',
+            'Rita Allen Foundation', 'W.M. Keck Foundation', 'National Cancer Institute', 'Howard Hughes Fund']
+JOURNALS = ['Nature', 'Science', 'Cell', 'Journal of Virology', 'Physical Review Letters', 'PLoS ONE',
+            'Journal of Biological Chemistry', 'Proceedings of the National Academy of Sciences']
+WORDS = ['protein', 'dynamics', 'structure', 'cell', 'signaling', 'network', 'analysis', 'role', 'small', 'large',
+         'model', 'folding', 'thermal', 'transport', 'graphene', 'catalytic', 'activity', 'gold', 'nanoparticles',
+         'of', 'in', 'the', 'and', 'a', 'for', 'with', 'regulation', 'expression', 'imaging', 'quantum', 'learning']
+SURNAMES = ['Smith', 'Zhang', 'Garcia', 'Kim', 'Chen', 'Patel', 'Rossi', 'Nguyen', 'Cohen', 'Tanaka']
+
+
+class XmlConverter(PdfConverter):
+    """
+    Reads pdftohtml -xml output from a file instead of running pdftohtml, with the same
+    cleaning and tag stripping as the pdftohtml backend.
+    """
+
+    def convert(self, file_xml):
+        from lxml import etree
+
+        with open(file_xml, 'rb') as f:
+            root = etree.fromstring(self.clean(f.read()), parser=etree.XMLParser(ns_clean=True, recover=True))
+        return self.finish(root)
+
+
+class Layout:
+    def __init__(self):
+        """
+        Texts laid out top to bottom on pages as pdftohtml reports them: font 0 for the body,
+        font 1 (bold) for the headers and font 2 for the name.
+        """
+        self.pages = [[]]
+        self.top = MARGIN
+
+    def line(self, text, left=MARGIN, font=0, height=17, gap=0, bold=False):
+        if self.top + height > PAGE_HEIGHT - MARGIN:
+            self.pages.append([])
+            self.top = MARGIN
+        width = min(int(len(text) * (8.5 if font else 6.5)), PAGE_WIDTH - left - MARGIN // 2)
+        body = '<b>%s</b>' % escape(text) if bold else escape(text)
+        self.pages[-1].append('<text top="%d" left="%d" width="%d" height="%d" font="%d">%s</text>'
+                              % (self.top, left, width, height, font, body))
+        self.top += height + gap
+
+    def xml(self):
+        fonts = ['<fontspec id="0" size="12" family="Times" color="#000000"/>',
+                 '<fontspec id="1" size="14" family="Times" color="#000000"/>',
+                 '<fontspec id="2" size="18" family="Times" color="#000000"/>']
+        pages = []
+        for number, texts in enumerate(self.pages, start=1):
+            pages.append('<page number="%d" position="absolute" top="0" left="0" height="%d" width="%d">\n%s\n%s\n'
+                         '</page>' % (number, PAGE_HEIGHT, PAGE_WIDTH, '\n'.join(fonts if number == 1 else []),
+                                      '\n'.join(texts)))
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE pdf2xml SYSTEM "pdf2xml.dtd">\n'
+                '<pdf2xml producer="poppler" version="0.62.0">\n%s\n</pdf2xml>\n' % '\n'.join(pages)).encode()
+
+
+def synthetic_cv(rng, first_name, last_name, sections, degrees, publications, pub_words, grants, items):
+    """
+    :return: pdftohtml -xml output of a CV.
+    """
+    layout = Layout()
+    layout.line('%s %s' % (first_name, last_name), font=2, height=24, gap=6)
+    layout.line('Department of Chemistry, University of California, Berkeley, CA 94720', gap=16)
+    names = PARTITIONS + rng.sample(OTHER_HEADERS, min(max(sections - len(PARTITIONS), 0), len(OTHER_HEADERS)))
+    rng.shuffle(names)
+    for name in names:
+        layout.line(HEADERS.get(name, name), font=1, height=19, gap=8, bold=True)
+        if name == 'education':
+            for _ in range(degrees):
+                start = rng.randint(1995, 2015)
+                layout.line('%s, %s' % (rng.choice(DEGREES), rng.choice(INSTITUTIONS)))
+                layout.line('%d - %d' % (start, start + rng.randint(2, 6)), left=INDENT, gap=8)
+        elif name == 'publication':
+            for pos in range(publications):
+                authors = ', '.join('%s %s' % (rng.choice(SURNAMES), rng.choice('ABCDEFGHJKLM'))
+                                    for _ in range(rng.randint(1, 6)))
+                title = ' '.join(rng.choice(WORDS) for _ in range(pub_words)).capitalize()
+                page = rng.randint(1, 2000)
+                citation = '%d. %s (%d). %s. %s, %d(%d), %d-%d.' % (
+                    pos + 1, authors, rng.randint(2000, 2020), title, rng.choice(JOURNALS), rng.randint(1, 300),
+                    rng.randint(1, 12), page, page + rng.randint(2, 20))
+                lines = textwrap.wrap(citation, 95)
+                for number, text in enumerate(lines):
+                    layout.line(text, left=MARGIN if number == 0 else INDENT, gap=8 if number == len(lines) - 1 else 0)
+        elif name == 'grant':
+            for _ in range(grants):
+                start = rng.randint(2005, 2018)
+                layout.line('%s %s Award, $%d,000, %d-%d' % (rng.choice(AGENCIES), rng.choice(WORDS).capitalize(),
+                                                             rng.randint(10, 900), start, start + rng.randint(1, 5)),
+                            gap=6)
+        else:
+            for pos in range(items):
+                layout.line('%s %s at %s, %d' % (rng.choice(WORDS).capitalize(), rng.choice(WORDS),
+                                                 rng.choice(INSTITUTIONS), rng.randint(2000, 2020)), gap=6)
+        layout.top += 12
+    return layout.xml()
+
+
+def synthetic_corpus(directory, number, seed, **shape):
+    """
+    :return: Paths of number synthetic CVs written to directory, named as the CVs of a
+             recruitment (campus_year_recruitment_applicant_first_last).
+    """
+    rng = random.Random(seed)
+    paths = []
+    for pos in range(number):
+        first_name, last_name = 'First%d' % pos, rng.choice(SURNAMES)
+        path = os.path.join(directory, '6_15_286_%d_%s_%s.xml' % (20000 + pos, first_name, last_name))
+        with open(path, 'wb') as f:
+            f.write(synthetic_cv(rng, first_name, last_name, **shape))
+        paths.append(path)
+    return paths
+
+
+class StageTimer:
+    def __init__(self):
+        self.times = dict((stage, []) for stage in STAGES)
+
+    def __call__(self, stage, func, *args):
+        begin = time.perf_counter()
+        result = func(*args)
+        self.times[stage].append(time.perf_counter() - begin)
+        return result
+
+
+class StagePeak:
+    def __init__(self):
+        """
+        Peak memory allocated while a stage runs, traced from the start of the stage.
+        """
+        self.peaks = dict((stage, 0) for stage in STAGES)
+
+    def __call__(self, stage, func, *args):
+        tracemalloc.start()
+        try:
+            return func(*args)
+        finally:
+            self.peaks[stage] = max(self.peaks[stage], tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+
+def sub_parse(cv, partitions):
+    for partition in partitions:
+        for string in partition['string'].split('|'):
+            texts = cv.get_partition_texts(string)
+            if texts:
+                for parser in SUB_PARSERS[partition['name']]:
+                    parser(texts)
+
+
+def write_rows(writer, rows):
+    for name, val in rows.items():
+        writer.write(None, None, name, val)
+
+
+def run_cv(path, converter, partitions, writer, measure):
+    """
+    The steps of CVParser.__init__ and Manager.parse_file on one file, each through measure.
+
+    :return: Number of rows of each partition.
+    """
+    cv = CVParser.__new__(CVParser)
+    cv.filepath, cv.filename = os.path.split(path)
+    cv.converter, cv.layout_cache = converter, None
+    cv.tree = measure('file_preprocess', cv.file_preprocess)
+    cv.texts = measure('text_preprocess', cv.text_preprocess)
+    measure('build_groups', cv.build_groups)
+    cv.partition = measure('get_partition', cv.get_partition)
+    measure('section_sub_parsers', sub_parse, cv, partitions)
+    rows = {}
+    for partition in partitions:
+        rows[partition['name']] = measure('records_%s' % partition['name'], cv.get_partition_records, partition)
+    measure('output', write_rows, writer, rows)
+    return dict((name, len(val)) for name, val in rows.items())
+
+
+def run_pass(paths, converter, config, partitions, directory, measure, mock):
+    """
+    Parse every file through measure, with a fresh response cache and output files.
+
+    :return: (rows per partition, time of every file parsed, failed files).
+    """
+    os.makedirs(directory)
+    cache_config = {**config['cache'], 'path': os.path.join(directory, 'responses.sqlite')}
+    configure_response_cache(cache_config, offline=not mock)
+    configure_network(config.get('network'))
+    output_config = config.get('output', {})
+    outputs = dict((val['name'], (os.path.join(directory, '%s.csv' % val['name']), None,
+                                  os.path.join(directory, '%s.parquet' % val['name']))) for val in partitions)
+    writer = OutputWriter(partitions, outputs, None, output_config.get('formats', ['csv']),
+                          output_config.get('dedup'), output_config.get('max_keys', 1000000),
+                          output_config.get('row_group_size', 10000))
+    # Rows are written from this thread, so the output stage can be timed; the writer thread
+    # only waits for close.
+    writer.start()
+    rows, totals, failed = dict((val['name'], 0) for val in partitions), [], []
+    for path in paths:
+        begin = time.perf_counter()
+        try:
+            for name, count in run_cv(path, converter, partitions, writer, measure).items():
+                rows[name] += count
+        except Exception as e:
+            failed.append('%s: %r' % (os.path.basename(path), e))
+            continue
+        totals.append(time.perf_counter() - begin)
+    writer.close()
+    return rows, totals, failed
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+def stage_report(times, peak):
+    if not times:
+        return {'count': 0, 'peak_kb': peak // 1024 if peak is not None else None}
+    total = sum(times)
+    return {'count': len(times), 'total_s': round(total, 6), 'per_s': round(len(times) / total, 2) if total else None,
+            'mean_ms': round(total / len(times) * 1e3, 3), 'p50_ms': round(percentile(times, 50) * 1e3, 3),
+            'p90_ms': round(percentile(times, 90) * 1e3, 3), 'p99_ms': round(percentile(times, 99) * 1e3, 3),
+            'max_ms': round(max(times) * 1e3, 3), 'peak_kb': peak // 1024 if peak is not None else None}
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    print('%s, %d CVs, %s' % (report['revision'], report['files'], json.dumps(report['corpus'], sort_keys=True)))
+    print('%-20s %8s %9s %9s %9s %9s %10s' % ('stage', 'CVs/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'peak KB'))
+    for stage, val in report['stages'].items():
+        if not val['count']:
+            continue
+        line = '%-20s %8.1f %9.2f %9.2f %9.2f %9.2f %10s' % (stage, val['per_s'] or 0, val['p50_ms'], val['p90_ms'],
+                                                           val['p99_ms'], val['max_ms'],
+                                                           '-' if val['peak_kb'] is None else val['peak_kb'])
+        old = (baseline or {}).get('stages', {}).get(stage)
+        if old and old.get('count'):
+            line += '   p50 %.2fx' % (val['p50_ms'] / old['p50_ms'] if old['p50_ms'] else 0)
+            if val['peak_kb'] and old.get('peak_kb'):
+                line += ', peak %.2fx' % (val['peak_kb'] / old['peak_kb'])
+            line += ' of %s' % baseline.get('revision')
+        print(line)
+    total = report['total']
+    if total['count']:
+        print('total: %.1f CVs/s, p50 %.2fms, p99 %.2fms' % (total['per_s'] or 0, total['p50_ms'], total['p99_ms']))
+    print('rows %s, peak RSS %s KB, %d failed' % (json.dumps(report['rows'], sort_keys=True), report['peak_rss_kb'],
+                                                 len(report['failed'])))
+    if report.get('mock_stats'):
+        print('mock server: %s' % json.dumps(report['mock_stats'], sort_keys=True))
+    for val in report['failed'][:5]:
+        print('    %s' % val)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pdfs', nargs='*', help='PDFs to parse instead of the synthetic corpus')
+    parser.add_argument('-n', action='store', dest='number', type=int, default=50, help='synthetic CVs')
+    parser.add_argument('--sections', action='store', dest='sections', type=int, default=6)
+    parser.add_argument('--degrees', action='store', dest='degrees', type=int, default=3)
+    parser.add_argument('--publications', action='store', dest='publications', type=int, default=20)
+    parser.add_argument('--pub-words', action='store', dest='pub_words', type=int, default=12)
+    parser.add_argument('--grants', action='store', dest='grants', type=int, default=5)
+    parser.add_argument('--items', action='store', dest='items', type=int, default=5,
+                        help='lines of the other sections')
+    parser.add_argument('--seed', action='store', dest='seed', type=int, default=0)
+    parser.add_argument('-p', action='store', dest='partition', default=','.join(PARTITIONS))
+    parser.add_argument('--mock', action='store_true', dest='mock',
+                        help='serve the network lookups from the mock server of config.json')
+    parser.add_argument('--latency', action='store', dest='latency', type=float,
+                        help='latency of the mock server (default: config.json)')
+    parser.add_argument('--no-memory', action='store_false', dest='memory',
+                        help='skip the tracemalloc pass')
+    parser.add_argument('--json', action='store', dest='json', help='write the report to this file')
+    parser.add_argument('--compare', action='store', dest='compare', help='report of an earlier version')
+    parser.set_defaults(mock=False, memory=True)
+    parsed = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'config.json')) as f:
+        config = json.load(f)
+    partitions = [config[val] for val in parsed.partition.split(',')]
+    workspace = tempfile.mkdtemp(prefix='bench_pipeline_')
+    server = None
+    try:
+        if parsed.mock:
+            mock_config = {**config.get('mock_server', {}), 'port': 0}
+            if parsed.latency is not None:
+                mock_config['latency'] = parsed.latency
+            server = start_mock_server(mock_config)
+            config['mock_server'] = {**mock_config, 'port': server.server_address[1]}
+            config = mock_profile(config)
+        configure_converter(config.get('conversion'))
+        configure_layout_cache(None)
+        configure_similarity(config.get('similarity'))
+        configure_quota_ledger(None)
+
+        shape = {'sections': parsed.sections, 'degrees': parsed.degrees, 'publications': parsed.publications,
+                 'pub_words': parsed.pub_words, 'grants': parsed.grants, 'items': parsed.items}
+        if parsed.pdfs:
+            paths, converter, corpus = parsed.pdfs, None, {'pdfs': len(parsed.pdfs)}
+        else:
+            os.makedirs(os.path.join(workspace, 'corpus'))
+            paths = synthetic_corpus(os.path.join(workspace, 'corpus'), parsed.number, parsed.seed, **shape)
+            converter, corpus = XmlConverter(), {**shape, 'seed': parsed.seed}
+        converter = converter or get_converter()
+
+        # One file first, so lazy imports and process-wide tables are not charged to the first CV.
+        run_pass(paths[:1], converter, config, partitions, os.path.join(workspace, 'warmup'),
+                 lambda stage, func, *args: func(*args), parsed.mock)
+        timer = StageTimer()
+        rows, totals, failed = run_pass(paths, converter, config, partitions, os.path.join(workspace, 'timed'),
+                                        timer, parsed.mock)
+        peaks = StagePeak()
+        if parsed.memory:
+            run_pass(paths, converter, config, partitions, os.path.join(workspace, 'memory'), peaks, parsed.mock)
+        else:
+            peaks.peaks = dict.fromkeys(STAGES)
+
+        stages = dict((stage, stage_report(timer.times[stage], peaks.peaks[stage])) for stage in STAGES)
+        total = stage_report(totals, max(peaks.peaks.values()) if parsed.memory else None)
+        report = {'revision': revision(), 'python': platform.python_version(), 'mock': parsed.mock,
+                  'files': len(paths), 'corpus': corpus, 'partitions': [val['name'] for val in partitions],
+                  'stages': stages, 'total': total, 'rows': rows, 'failed': failed, 'peak_rss_kb': peak_rss_kb()}
+        if server:
+            report['mock_stats'] = server.stats
+    finally:
+        if server:
+            server.shutdown()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    baseline = None
+    if parsed.compare:
+        with open(parsed.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if parsed.json:
+        with open(parsed.json, 'w') as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Benchmark of section_paragraph_parser and section_left_parser against their previous pure
+Python implementations (kept below, with collections.Counter standing in for nltk.FreqDist,
+whose most_common it inherits).
+
+Random publication lists of growing length are generated: lines on several pages, gaps of a
+few typical sizes, two or three left margins and numbered entries. Both implementations must
+give the same sections on every list.
+
+Usage, from the repository root:
+    python benchmarks/bench_section_parsers.py [-n 200] [--sizes 20,100,500,2000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+from collections import Counter
+from functools import wraps
+from itertools import chain
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from CVCodingTool.src.section_sub_parser import section_paragraph_parser, section_left_parser
+from CVCodingTool.src.text_store import TextStore
+
+
+def section_reducer_reference(f):
+    @wraps(f)
+    def inner_func(texts):
+        sections = f(texts)
+        if not sections:
+            return sections
+        new_sections = []
+        for section in sections:
+            if section[1] - section[0] > 5:
+                new_section = f(texts[section[0]:section[1]])
+                if not new_section:
+                    new_sections.append(section)
+                else:
+                    new_sections += [[va + section[0] for va in val] for val in new_section]
+            else:
+                new_sections.append(section)
+        return new_sections
+
+    return inner_func
+
+
+@section_reducer_reference
+def section_paragraph_parser_reference(texts):
+    if len(texts) == 1:
+        return [[0, 1]]
+
+    top_attrs = [int(text.get('top')) for text in texts]
+    top_diff = [x[0] - x[1] for x in zip(top_attrs[1:], top_attrs[:-1])]
+    page_break_ids = [pos + 1 for pos, val in enumerate(top_diff) if val < -100 if int(texts[pos].get('width')) < 500]
+    top_most_list = Counter(x for x in chain(top_diff, [x - 1 for x in top_diff],
+                                             [x + 1 for x in top_diff])).most_common()
+    counter = 0
+    top_most = top_most_list[counter][0]
+    while counter < len(top_most_list) - 1 and (top_most <= 5 or top_most >= 55):
+        counter += 1
+        top_most = top_most_list[counter][0]
+
+    partition = []
+    for pos, diff in enumerate(top_diff):
+        if 55 >= diff > top_most + 4:
+            partition.append(pos + 1)
+    if not partition:
+        for pos, diff in enumerate(top_diff):
+            if 6 <= diff:
+                partition.append(pos + 1)
+    partition.append(len(texts))
+    partition += page_break_ids
+    partition = sorted(partition)
+
+    sections = []
+    for pos, val in enumerate(partition):
+        if pos == 0:
+            begin_index = 0
+        else:
+            begin_index = partition[pos - 1]
+        end_index = val
+        sections.append([begin_index, end_index])
+
+    return sections
+
+
+@section_reducer_reference
+def section_left_parser_reference(texts):
+    star_indicator = [pos for pos, val in enumerate(texts) if
+                      re.findall(r'^\* |^[0-9]+[.\)] |^\"[A-Za-z]|^\([0-9]+\)', val.text)]
+    if len(star_indicator) / len(texts) > 0.25:
+        partition = star_indicator
+    else:
+        left_attrs = [int(text.get('left')) for text in texts]
+        left_freq = Counter(left_attrs)
+        partition = []
+        if len(left_freq) > 1:
+            left_most = dict(left_freq.most_common(2))
+            left_identifier = min(left_most.keys())
+            right_identifier = max(left_most.keys())
+            if sum(left_most.values()) / len(texts) > 0.65 \
+                    and 0.2 < left_most[left_identifier] / left_most[right_identifier] < 2.4 \
+                    and not [val for val in left_freq.keys()
+                             if left_freq[val] > left_freq[left_identifier] if val < left_identifier]:
+                for pos, val in enumerate(texts):
+                    if int(val.get('left')) == left_identifier:
+                        partition.append(pos)
+            else:
+                return None
+        else:
+            return None
+    sections = []
+    for pos, val in enumerate(partition):
+        begin_index = val
+        if pos == len(partition) - 1:
+            end_index = len(texts)
+        else:
+            end_index = partition[pos + 1]
+        sections.append([begin_index, end_index])
+    if len(sections) == 1:
+        return None
+    return sections
+
+
+def publication_list(size, seed):
+    """
+    :return: A TextStore of size lines laid out like a publication list.
+    """
+    rng = random.Random(seed)
+    text, top, left, width = [], [], [], []
+    y = rng.randint(60, 120)
+    margins = rng.sample([72, 90, 108, 126], rng.randint(2, 3))
+    numbered = rng.random() < 0.3
+    entry = 0
+    for pos in range(size):
+        first_line = rng.random() < 0.4
+        if first_line:
+            entry += 1
+        y += rng.choice([14, 14, 15, 28, 30]) if first_line else rng.choice([13, 14, 14])
+        if y > 1100:
+            y = rng.randint(60, 120)
+        text.append(('%d. ' % entry if numbered and first_line else '') + 'Author A, Title %d, Journal' % pos)
+        top.append(y)
+        left.append(margins[0] if first_line else rng.choice(margins))
+        width.append(rng.choice([300, 450, 520, 600]))
+    return TextStore(text, top, left, width, [12] * size, [0] * size, ['0'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', action='store', dest='number', type=int, default=200,
+                        help='random lists checked per size')
+    parser.add_argument('--sizes', action='store', dest='sizes', default='20,100,500,2000')
+    parsed = parser.parse_args()
+
+    pairs = [('section_paragraph_parser', section_paragraph_parser_reference, section_paragraph_parser),
+             ('section_left_parser', section_left_parser_reference, section_left_parser)]
+    for size in [int(val) for val in parsed.sizes.split(',')]:
+        stores = [publication_list(size, seed) for seed in range(parsed.number)]
+        for name, reference, current in pairs:
+            mismatches = sum(reference(texts) != current(texts) for texts in stores)
+            reference_time = min(timeit.repeat(lambda: [reference(texts) for texts in stores], number=1, repeat=3))
+            current_time = min(timeit.repeat(lambda: [current(texts) for texts in stores], number=1, repeat=3))
+            print('%s, %d lines: reference %.3fms, current %.3fms per list, %.1fx, %d/%d mismatches' %
+                  (name, size, reference_time / len(stores) * 1e3, current_time / len(stores) * 1e3,
+                   reference_time / current_time, mismatches, len(stores)))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Startup benchmark of the parser processes.
+
+Each measure runs in a fresh interpreter, as a worker of the pool starts:
+- help: wall time of "main.py --help", which should not load the parsing stack.
+- import: wall time of importing each module alone.
+- first file: time from interpreter start to the rows of the first PDF, through
+  Manager.parse_file, split into imports, setup and parsing. Lookups are served offline from
+  the response cache and the layout cache is off, unless --layout-cache.
+
+The median and the minimum of -n runs are reported.
+
+Usage, from the repository root:
+    python benchmarks/bench_startup.py data/test/some_cv.pdf -p education
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+MODULES = ['CVCodingTool.main', 'CVCodingTool.src.network', 'CVCodingTool.src.converters',
+           'CVCodingTool.src.field_parser', 'CVCodingTool.src.partition_parser', 'numpy', 'pandas', 'requests',
+           'lxml.etree', 'fuzzywuzzy.fuzz']
+
+FIRST_FILE = """
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, os.path.abspath('..'))
+from CVCodingTool.main import Manager
+with open('config.json') as f:
+    config = json.load(f)
+if not %(layout_cache)r:
+    config['layout_cache'] = {}
+manager = Manager(config, %(partitions)r, 'development', None, offline=True)
+imported = time.perf_counter()
+manager.setup()
+ready = time.perf_counter()
+contents, errors = manager.parse_file(%(root)r, %(file)r)
+done = time.perf_counter()
+print(json.dumps({'imports': imported - start, 'setup': ready - imported, 'parse': done - ready,
+                  'first_file': done - start, 'rows': sum(len(val) for val in contents.values()),
+                  'errors': sorted(errors)}))
+"""
+
+
+def wall_time(args):
+    begin = time.perf_counter()
+    subprocess.check_call(args, cwd=ROOT, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - begin
+
+
+def report(label, values, unit=1e3):
+    print('%-42s median %8.1fms  min %8.1fms' % (label, statistics.median(values) * unit, min(values) * unit))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pdf', nargs='?', help='PDF for the first-file latency')
+    parser.add_argument('-p', action='store', dest='partitions', default='education')
+    parser.add_argument('-n', action='store', dest='number', type=int, default=10)
+    parser.add_argument('--layout-cache', action='store_true', dest='layout_cache')
+    parsed = parser.parse_args()
+
+    python = sys.executable
+    report('main.py --help', [wall_time([python, 'main.py', '--help']) for _ in range(parsed.number)])
+    report('python (empty)', [wall_time([python, '-c', 'pass']) for _ in range(parsed.number)])
+    for module in MODULES:
+        code = 'import os, sys; sys.path.insert(0, os.path.abspath("..")); import %s' % module
+        try:
+            report('import %s' % module, [wall_time([python, '-c', code]) for _ in range(parsed.number)])
+        except subprocess.CalledProcessError:
+            print('import %s: failed' % module)
+
+    if parsed.pdf:
+        file_pdf = os.path.abspath(parsed.pdf)
+        code = FIRST_FILE % {'layout_cache': parsed.layout_cache, 'partitions': parsed.partitions,
+                             'root': os.path.dirname(file_pdf), 'file': os.path.basename(file_pdf)}
+        runs = [json.loads(subprocess.check_output([python, '-c', code], cwd=ROOT).decode().splitlines()[-1])
+                for _ in range(parsed.number)]
+        for key in ('imports', 'setup', 'parse', 'first_file'):
+            report('first file: %s' % key, [run[key] for run in runs])
+        print('first file: %d rows, errors in %s' % (runs[-1]['rows'], runs[-1]['errors'] or 'none'))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Parity check of the rows written by OutputWriter against the pandas writer they replace,
+pd.DataFrame.from_dict(records).drop_duplicates().to_csv(header=False, index=False).
+
+Random partitions of records are generated with mixed-type columns: ints, floats, bools,
+strings, None and NaN, alone and mixed within one column, with repeated records. Every record
+has every key, as the records of the section parsers do (pandas tells a missing key from None
+in object columns when dropping duplicates, partition_rows does not). The csv text of
+partition_rows must be the same as the one pandas writes, column by column in header order.
+Any difference is reported, and the exit status is 1 if there is one.
+
+Usage, from the repository root:
+    python benchmarks/parity_output_writer.py [-n 2000] [--seed 0]
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from CVCodingTool.src.output_writer import partition_rows
+
+KINDS = {'int': lambda rng: rng.randint(1990, 2020),
+         'float': lambda rng: rng.choice([0.5, 12.25, 98.0, 1e-3]),
+         'bool': lambda rng: rng.random() < 0.5,
+         'str': lambda rng: rng.choice(['Nature', 'Ph.D.', 'a, "quoted" b', '10.1038/nature12', '']),
+         'none': lambda rng: None,
+         'nan': lambda rng: float('nan')}
+# Kinds a column draws its values from, e.g. the filter_flag column (bool) or a year with gaps.
+COLUMN_KINDS = [('int',), ('float',), ('bool',), ('str',), ('int', 'none'), ('int', 'float'), ('bool', 'none'),
+                ('bool', 'int'), ('bool', 'int', 'none'), ('int', 'str'), ('float', 'str', 'none'), ('int', 'nan'),
+                ('bool', 'str'), ('none',)]
+
+
+def random_records(rng, columns):
+    kinds = dict((column, rng.choice(COLUMN_KINDS)) for column in columns)
+    records = []
+    for _ in range(rng.randint(1, 8)):
+        if records and rng.random() < 0.2:
+            records.append(dict(rng.choice(records)))
+            continue
+        records.append(dict((column, KINDS[rng.choice(kinds[column])](rng)) for column in columns))
+    return records
+
+
+def pandas_text(records, columns):
+    frame = pd.DataFrame.from_dict(records).drop_duplicates()
+    return frame.reindex(columns=columns).to_csv(header=False, index=False, lineterminator='\n')
+
+
+def writer_text(records, columns):
+    stream = io.StringIO()
+    csv.writer(stream, lineterminator='\n').writerows(partition_rows(records, columns))
+    return stream.getvalue()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', action='store', dest='number', type=int, default=2000,
+                        help='random partitions checked')
+    parser.add_argument('--seed', action='store', dest='seed', type=int, default=0)
+    parsed = parser.parse_args()
+
+    rng = random.Random(parsed.seed)
+    bad = []
+    for _ in range(parsed.number):
+        columns = ['c%d' % val for val in range(rng.randint(1, 6))]
+        records = random_records(rng, columns)
+        expected, written = pandas_text(records, columns), writer_text(records, columns)
+        if expected != written:
+            bad.append((records, expected, written))
+    print('partition_rows against pandas: %d/%d partitions differ' % (len(bad), parsed.number))
+    for records, expected, written in bad[:5]:
+        print('records %r\n  pandas %r\n  writer %r' % (records, expected, written))
+    sys.exit(1 if bad else 0)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Parity check and benchmark of a similarity backend against fuzzywuzzy.
+
+ratio, partial_ratio and token_set_ratio, and their batch versions, are compared on random
+pairs shaped like the calls of the publication field parsers: citation strings against
+titles, lower-cased or not, with punctuation, accents, repeated tokens, and the edge cases
+(None, empty and equal strings). The string columns of parsed publication csv files can be
+added with --csv. Any score further than --tolerance from fuzzywuzzy's is reported, and the
+exit status is 1 if there is one.
+
+Usage, from the repository root:
+    python benchmarks/parity_similarity.py [-n 20000] [--backend rapidfuzz] [--csv results/parsed/publication_*.csv]
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from CVCodingTool.src.similarity import FuzzyWuzzyBackend, backend_map
+
+WORDS = ['the', 'of', 'and', 'in', 'a', 'protein', 'cell', 'signaling', 'analysis', 'structure', 'role', 'small',
+         'Nature', 'Science', 'J.', 'Biol.', 'Chem.', 'Smith,', 'Zhang', 'Müller', 'Ångström', 'naïve', 'ß-catenin',
+         '2015', '(2012)', '12:345-356', 'doi:10.1038/nature12', 'Poxviral', 'VP11:', 'A', 'Big', 'Small', '&', '-']
+COLUMNS = ['string', 'string_refined', 'first_title', 'second_title', 'first_full_citation', 'TI', 'AU', 'T2']
+
+
+def random_string(rng, low, high):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(low, high))]
+    string = ' '.join(words)
+    return string.lower() if rng.random() < 0.4 else string
+
+
+def random_pairs(count, seed):
+    rng = random.Random(seed)
+    pairs = [(None, 'a'), ('a', None), ('', ''), ('', 'a'), ('a', ''), ('abc', 'abc'), ('!!', '??'), ('A b', 'b a')]
+    while len(pairs) < count:
+        first, second = random_string(rng, 1, 12), random_string(rng, 1, 40)
+        if rng.random() < 0.3:
+            second = second + ' ' + first[rng.randint(0, len(first) // 2):]
+        pairs.append((first, second) if rng.random() < 0.5 else (second, first))
+    return pairs
+
+
+def csv_pairs(paths, count, seed):
+    strings = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                strings += [row[val] for val in COLUMNS if row.get(val)]
+    rng = random.Random(seed)
+    return [(rng.choice(strings), rng.choice(strings)) for _ in range(count)] if strings else []
+
+
+def compare(name, reference, current, pairs, tolerance):
+    expected = [reference(*val) for val in pairs]
+    scores = [current(*val) for val in pairs]
+    bad = [(pair, val, score) for pair, val, score in zip(pairs, expected, scores) if abs(val - score) > tolerance]
+    return report(name, reference, current, pairs, bad, expected, scores)
+
+
+def compare_many(name, reference, current_many, pairs, tolerance, group=20):
+    """
+    Batch calls: each group of pairs sharing the same query scored at once.
+    """
+    groups = [(pairs[pos][0], [val[1] for val in pairs[pos:pos + group]]) for pos in range(0, len(pairs), group)]
+    expected = [reference(query, choice) for query, choices in groups for choice in choices]
+    scores = [score for query, choices in groups for score in current_many(query, choices)]
+    flat = [(query, choice) for query, choices in groups for choice in choices]
+    bad = [(pair, val, score) for pair, val, score in zip(flat, expected, scores) if abs(val - score) > tolerance]
+    reference_time = min(timeit.repeat(lambda: [reference(query, choice) for query, choices in groups
+                                                for choice in choices], number=1, repeat=3))
+    current_time = min(timeit.repeat(lambda: [current_many(query, choices) for query, choices in groups],
+                                     number=1, repeat=3))
+    print_line(name, len(flat), bad, expected, scores, reference_time, current_time)
+    return bad
+
+
+def report(name, reference, current, pairs, bad, expected, scores):
+    reference_time = min(timeit.repeat(lambda: [reference(*val) for val in pairs], number=1, repeat=3))
+    current_time = min(timeit.repeat(lambda: [current(*val) for val in pairs], number=1, repeat=3))
+    print_line(name, len(pairs), bad, expected, scores, reference_time, current_time)
+    return bad
+
+
+def print_line(name, count, bad, expected, scores, reference_time, current_time):
+    largest = max([abs(val - score) for val, score in zip(expected, scores)] or [0])
+    print('%-24s %6d pairs, %4d beyond tolerance, largest difference %3d, fuzzywuzzy %.1fus, backend %.1fus, %.1fx'
+          % (name, count, len(bad), largest, reference_time / count * 1e6, current_time / count * 1e6,
+             reference_time / current_time if current_time else 0))
+    for pair, val, score in bad[:3]:
+        print('    %r: fuzzywuzzy %d, backend %d' % (pair, val, score))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', action='store', dest='number', type=int, default=20000)
+    parser.add_argument('--backend', action='store', dest='backend', default='rapidfuzz')
+    parser.add_argument('--tolerance', action='store', dest='tolerance', type=int, default=0)
+    parser.add_argument('--csv', action='store', dest='csv', nargs='*', default=[])
+    parsed = parser.parse_args()
+
+    reference, current = FuzzyWuzzyBackend(), backend_map[parsed.backend]()
+    pairs = random_pairs(parsed.number, 0) + csv_pairs(parsed.csv, parsed.number, 1)
+    bad = []
+    for method in ('ratio', 'partial_ratio', 'token_set_ratio'):
+        bad += compare(method, getattr(reference, method), getattr(current, method), pairs, parsed.tolerance)
+        bad += compare_many(method + '_many', getattr(reference, method), getattr(current, method + '_many'),
+                            pairs, parsed.tolerance)
+    sys.exit(1 if bad else 0)
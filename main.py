@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 import argparse
-import codecs
 import json
 import logging
 import multiprocessing
@@ -8,74 +7,326 @@ import os
 import re
 import shutil
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
+from itertools import chain
+from multiprocessing.util import Finalize
 
 sys.path.insert(0, os.path.abspath(".."))
-from CVCodingTool.src.partition_parser import CVParser
+# The parsing stack (NumPy, the parsers, the layout cache and the output writer) is imported
+# where it is first used, so --help and the main process of a pool start without it.
+from CVCodingTool.src.agency_matcher import configure_agency_matcher
+from CVCodingTool.src.converters import configure_converter
+from CVCodingTool.src.manifest import FAILED, configure_manifest, file_digest, in_shard, parse_shard
+from CVCodingTool.src.network import configure_network, log_network_stats
+from CVCodingTool.src.quota import configure_quota_ledger
+from CVCodingTool.src.response_cache import configure_response_cache
+from CVCodingTool.src.similarity import configure_similarity
+from CVCodingTool.src.supervisor import configure_supervisor
+
+_worker_manager = None
 
 
 class Manager:
-    def __init__(self, config, partition, dev, directory):
+    def __init__(self, config, partitions, dev, directory, offline=False, workers=1, run=None, shard=None,
+                 supervised=False):
+        """
+        :param partitions: Partition name, or comma-separated partition names. Every PDF is
+                           parsed once and each partition is written to its own csv. Not needed
+                           to index.
+        :param workers: Number of worker processes. With more than one, the PDFs of the tree are
+                        handed out to a single pool in chunks ("chunksize"), as workers free up.
+        :param run: Name of a resumable run. Its progress is kept in the run manifest and its
+                    csv files are appended to, so a restart picks up where the last one stopped.
+        :param shard: "i/n" to parse only the i-th of n hash ranges of the PDFs.
+        :param supervised: Convert and partition every PDF in a child process killed when it runs out
+                           of the time or memory set in the "supervisor" block of config.json.
+        """
         self.config = config
-        self.partition = self.config[partition]
+        self.partition_names = partitions
+        self.partitions = [self.config[val] for val in re.split(r',', partitions)] if partitions else []
         self.directory = directory
+        self.dev_name = dev
         self.dev = self.config[dev]
+        self.offline = offline
+        self.workers = workers
+        self.chunksize = self.config.get('scheduler', {}).get('chunksize', 1)
+        self.pipeline = self.config.get('scheduler', {}).get('pipeline', 1)
+        self.run_name = run
+        self.shard_name = shard
+        self.shard = parse_shard(shard) if shard else None
+        # Processes of the run sharing the network limits: the workers of each shard.
+        self.processes = workers * (self.shard[1] if self.shard else 1)
+        self.output = None
+        self.supervised = supervised
+        self.response_cache, self.quota_ledger, self.manifest, self.supervisor = None, None, None, None
+
+    def setup(self):
+        """
+        Configure the process-wide services. Called in the main process and in every worker.
+        """
+        from CVCodingTool.src.layout_cache import configure_layout_cache
+        from CVCodingTool.src.partition_parser import init_layout_worker
+
+        self.response_cache = configure_response_cache(self.config.get('cache'), self.offline)
+        configure_network(self.config.get('network'), self.processes)
+        configure_converter(self.config.get('conversion'))
+        configure_layout_cache(self.config.get('layout_cache'))
+        configure_similarity(self.config.get('similarity'))
+        configure_agency_matcher(self.config.get('grant'))
+        self.quota_ledger = configure_quota_ledger(self.config.get('quota'))
+        self.supervisor = configure_supervisor(self.config.get('supervisor'), self.supervised, init_layout_worker,
+                                               (self.config.get('conversion'), self.config.get('layout_cache')))
+
+    def log_stats(self):
+        if self.response_cache:
+            self.response_cache.log_stats()
+        log_network_stats()
+        if self.quota_ledger:
+            self.quota_ledger.log_stats()
 
     def run(self):
         dirs = self.directory or self.dev['dir']
-        identifier = '%s_%s_%s' % (self.partition['name'], datetime.today().strftime('%Y%m%d%H%M%S'),
+        timestamp = datetime.today().strftime('%Y%m%d%H%M%S')
+        identifier = '%s_%s_%s' % ('_'.join(val['name'] for val in self.partitions), timestamp,
                                    os.path.split(dirs)[1])
-        logging.basicConfig(format='%(message)s', filename='results/log/%s.log' % identifier, level=logging.DEBUG)
-        if self.dev['destination'] == 'file':
-            sys.stdout = codecs.open("results/parsed/%s.csv" % identifier, 'w+', "utf-8")
+        log_path = 'results/log/%s.log' % identifier
+        logging.basicConfig(format='%(message)s', filename=log_path, level=logging.DEBUG)
+        self.setup()
+        self.manifest = configure_manifest(self.config.get('manifest'), self.run_name)
+        suffix = '_%dof%d' % self.shard if self.shard else ''
+        outputs = {}
+        for partition in self.partitions:
+            if self.dev['destination'] != 'file':
+                outputs[partition['name']] = (None, None, None)
+            elif self.manifest:
+                # The csv of a run is appended to, after dropping the rows of a file whose write was
+                # interrupted before it was recorded. The Parquet file is rebuilt from it at the end.
+                base = "results/parsed/%s_%s%s" % (partition['name'], self.run_name, suffix)
+                outputs[partition['name']] = (base + '.csv', self.manifest.committed(base + '.csv'),
+                                              base + '.parquet')
+            else:
+                base = "results/parsed/%s_%s_%s%s" % (partition['name'], timestamp, os.path.split(dirs)[1], suffix)
+                outputs[partition['name']] = (base + '.csv', None, base + '.parquet')
+        from CVCodingTool.src.output_writer import OutputWriter
+
+        output_config = self.config.get('output', {})
+        self.output = OutputWriter(self.partitions, outputs, self.manifest, output_config.get('formats', ['csv']),
+                                   output_config.get('dedup'), output_config.get('max_keys', 1000000),
+                                   output_config.get('row_group_size', 10000))
+        # The workers come from a fork server, started before the writer thread: a fork of this
+        # process, even to replace a dead worker, could copy a lock held by that thread.
+        pool = None
+        if self.workers > 1:
+            pool = multiprocessing.get_context('forkserver').Pool(
+                self.workers, initializer=init_worker,
+                initargs=(self.config, self.partition_names, self.dev_name, self.directory, self.offline,
+                          self.supervised, self.workers, self.shard_name, log_path))
+        self.output.start()
+
+        tasks = self.schedule(dirs)
+        if pool:
+            chunks = [tasks[pos:pos + self.chunksize] for pos in range(0, len(tasks), self.chunksize)]
+            results = chain.from_iterable(pool.imap_unordered(parse_worker, chunks))
+        else:
+            results = self.parse_tasks(tasks)
+
+        for root, file, digest, contents, errors, supervision in results:
+            self.writer(dirs, root, file, digest, contents, errors, supervision)
+
+        if pool:
+            pool.close()
+            pool.join()
+        self.output.close()
+        self.log_stats()
+        if self.manifest:
+            logging.info('manifest %s: %s' % (self.run_name, self.manifest.summary()))
+
+    @staticmethod
+    def enumerate(dirs):
+        """
+        :return: Every pdf of the tree as (root, file), in walk order.
+        """
+        return [(root, file) for root, _, files in os.walk(dirs) for file in sorted(files)
+                if re.search(r'^(?!\.).*(?:\.pdf)$', file)]
+
+    def schedule(self, dirs):
+        """
+        :return: The pdfs to parse as (root, file, partition names, content hash), leaving out
+                 the other shards and, in a resumed run, the partitions already done.
+        """
+        names = [partition['name'] for partition in self.partitions]
+        files = self.enumerate(dirs)
+        if not self.manifest and not self.shard:
+            return [(root, file, names, None) for root, file in files]
+        tasks = []
+        for (root, file), digest in zip(files, self.digests(dirs, files)):
+            if self.shard and not in_shard(digest, *self.shard):
+                continue
+            pending = self.manifest.pending(os.path.relpath(os.path.join(root, file), dirs), digest, names) \
+                if self.manifest else names
+            if pending:
+                tasks.append((root, file, pending, digest))
+        return tasks
+
+    def digests(self, dirs, files=None):
+        """
+        :return: The content hash of every pdf of the tree (or of files), cached in the run
+                 manifest when there is one.
+        """
+        paths = [os.path.join(root, file) for root, file in (self.enumerate(dirs) if files is None else files)]
+        if self.manifest:
+            return self.manifest.digests(paths)
+        return [file_digest(val) for val in paths]
+
+    def index(self):
+        """
+        Hash every pdf of the tree into the run manifest, so that the shards of a run started
+        afterwards find their hashes there instead of each hashing the whole tree.
+        """
+        dirs = self.directory or self.dev['dir']
+        self.manifest = configure_manifest(self.config.get('manifest'), self.run_name)
+        if not self.manifest:
+            raise ValueError('--index needs a named run (--run) and a manifest path in config.json')
+        print('%d pdfs hashed' % len(self.digests(dirs)))
+
+    def parse_tasks(self, tasks):
+        """
+        Parse the tasks, "pipeline" ("scheduler" block of config.json) of them at a time on
+        threads, so that the network lookups of several CVs share the executor and the rate
+        limits instead of one CV draining them before the next starts.
+
+        :return: The results of parse, in the order the tasks finish.
+        """
+        if self.pipeline <= 1:
+            for task in tasks:
+                yield self.parse(*task)
+            return
+        with ThreadPoolExecutor(max_workers=self.pipeline) as executor:
+            pending = set()
+            for task in tasks:
+                pending.add(executor.submit(self.parse, *task))
+                if len(pending) >= self.pipeline:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+    def parse(self, root, file, names=None, digest=None):
+        """
+        Parse one pdf for the given partitions (all by default). Under the supervisor, only the
+        conversion and partitioning of the pdf run in its child, within its limits; the sections
+        are parsed and enriched over the network here, without a time limit.
+
+        :return: (root, file, digest, rows per partition name, error message per partition name,
+                 supervision) where supervision is None when unsupervised, otherwise
+                 (elapsed seconds, peak resident bytes, whether the child was killed or crashed).
+        """
+        from CVCodingTool.src.partition_parser import parse_layout
+
+        if not self.supervisor:
+            return (root, file, digest) + self.parse_file(root, file, names, digest) + (None,)
+        ok, value, elapsed, peak = self.supervisor.run(parse_layout, root, file, digest)
+        if ok:
+            return (root, file, digest) + self.parse_file(root, file, names, digest, value) + \
+                ((elapsed, peak, False),)
+        names = names or [partition['name'] for partition in self.partitions]
+        return root, file, digest, {}, dict((name, '%s, %s' % (file, value)) for name in names), \
+            (elapsed, peak, True)
 
-        print(self.partition['header'])
+    def parse_file(self, root, file, names=None, digest=None, layout=None):
+        """
+        :param digest: Content hash of the pdf if the scheduler computed it, reused by the layout cache.
+        :param layout: Result of parse_layout for the pdf, if already computed.
+        :return: (rows per partition name, error message per partition name)
+        """
+        from CVCodingTool.src.partition_parser import CVParser
 
-        for root, _, files in os.walk(dirs):
-            if files:
-                for file in files:
-                    if re.search(r'^(?!\.).*(?:\.pdf)$', file):
-                        self.writer(root, file)
+        cv_parser = CVParser(root, file, digest=digest, layout=layout)
+        contents, errors = {}, {}
+        for partition in self.partitions:
+            if names is not None and partition['name'] not in names:
+                continue
+            try:
+                contents[partition['name']] = cv_parser.get_partition_records(partition)
+            except Exception as e:
+                errors[partition['name']] = '%s, %s' % (file, e)
+        return contents, errors
 
-        # Drop duplicates
-        # table = pd.read_csv("results/parsed/%s.csv" % identifier)
-        # table = table.drop_duplicates(subset='string_refined')
-        # table.to_csv("results/parsed/%s.csv" % identifier, index=False)
+    def writer(self, dirs, root, file, digest, contents, errors, supervision=None):
+        path = os.path.relpath(os.path.join(root, file), dirs)
+        for name, rows in contents.items():
+            self.output.put(path, digest, name, rows)
+        for name, error in errors.items():
+            logging.error(error)
+            if self.manifest:
+                self.manifest.record(path, name, digest, FAILED, error=error)
+        if supervision:
+            elapsed, peak = supervision[:2]
+            logging.info('%s: %.2fs, %dMB resident' % (file, elapsed, peak >> 20))
+        if errors and not self.dev['fail_no_copy']:
+            shutil.copyfile(os.path.join(root, file), os.path.join('results/failed', file))
 
-    def writer(self, root, file):
-        writer_kwargs = {"header": False, "index": False}
-        try:
-            sys.stdout.write(CVParser(root, file).get_partition_contents(self.partition).to_csv(**writer_kwargs))
-        except Exception as e:
-            logging.error('%s, %s' % (file, e))
-            if not self.dev['fail_no_copy']:
-                shutil.copyfile(os.path.join(root, file), os.path.join('results/failed', file))
+
+def init_worker(config, partitions, dev, directory, offline, supervised, workers, shard, log_path):
+    global _worker_manager
+    logging.basicConfig(format='%(message)s', filename=log_path, level=logging.DEBUG)
+    _worker_manager = Manager(config, partitions, dev, directory, offline, workers, shard=shard,
+                              supervised=supervised)
+    _worker_manager.setup()
+    Finalize(None, _worker_manager.log_stats, exitpriority=10)
+
+
+def parse_worker(tasks):
+    return list(_worker_manager.parse_tasks(tasks))
 
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('-p', action='store', dest='partition')
+    parser.add_argument('-p', action='store', dest='partition',
+                        help='partition to extract, or several separated by commas (education,publication,grant), '
+                             'not needed with --index')
     parser.add_argument('-d', action='store', dest='dev')
     parser.add_argument('--dir', action='store', dest='directory')
-    parser.add_argument('-r', action='store_true', dest='recursive')
-    parser.set_defaults(recursive=False)
+    parser.add_argument('-r', action='store_true', dest='recursive',
+                        help='parse the pdfs of the tree in parallel over a pool of worker processes')
+    parser.add_argument('-w', '--workers', action='store', dest='workers', type=int,
+                        help='number of worker processes with -r (default: scheduler.workers, or all cores)')
+    parser.add_argument('--run', action='store', dest='run',
+                        help='name of a resumable run: finished pdfs are skipped and failed ones retried on restart')
+    parser.add_argument('--shard', action='store', dest='shard',
+                        help='i/n: parse only the i-th (0-based) of n shards of the pdfs, split by content hash')
+    parser.add_argument('--index', action='store_true', dest='index',
+                        help='only hash the pdfs of the tree into the run manifest, ahead of sharded runs')
+    parser.add_argument('--supervised', action='store_true', dest='supervised',
+                        help='convert each pdf in a child process under the time and memory limits of config.json')
+    parser.add_argument('--offline', action='store_true', dest='offline',
+                        help='serve network lookups only from the response cache')
+    parser.add_argument('--mock', action='store_true', dest='mock',
+                        help='send network lookups to the local mock server of config.json (src/mock_server.py)')
+    parser.set_defaults(recursive=False, offline=False, supervised=False, mock=False, index=False)
     parsed = parser.parse_args()
+    if not parsed.partition and not parsed.index:
+        parser.error('-p is required, except with --index')
 
     with open('config.json', 'r') as f:
         config = json.load(f)
+    if parsed.mock:
+        from CVCodingTool.src.mock_server import mock_profile
 
-
-    def mp_runner(directory):
-        Manager(config, parsed.partition, parsed.dev, directory).run()
-
+        config = mock_profile(config)
 
     if parsed.recursive:
-        for _, subdirs, _ in os.walk(parsed.directory):
-            subdirs = [os.path.join(parsed.directory, val) for val in subdirs]
-            pool = multiprocessing.Pool(10)
-            pool.map(mp_runner, subdirs)
+        workers = parsed.workers or config.get('scheduler', {}).get('workers') or multiprocessing.cpu_count()
+    else:
+        workers = 1
+    manager = Manager(config, parsed.partition, parsed.dev, parsed.directory, parsed.offline, workers, parsed.run,
+                      parsed.shard, parsed.supervised)
+    if parsed.index:
+        manager.index()
     else:
-        mp_runner(parsed.directory)
+        manager.run()
 
 # TODO: network rerun script
@@ -1,15 +1,18 @@
 #!/usr/bin/env bash
 
-bash scripts/API.sh -s 1 -e 61 -p publication &!
-bash scripts/API.sh -s 61 -e 121 -p publication &!
-bash scripts/API.sh -s 121 -e 181 -p publication &!
-bash scripts/API.sh -s 181 -e 241 -p publication &!
-bash scripts/API.sh -s 241 -e 301 -p publication &!
-bash scripts/API.sh -s 301 -e 361 -p publication &!
-bash scripts/API.sh -s 361 -e 421 -p publication &!
-bash scripts/API.sh -s 421 -e 471 -p publication &!
-bash scripts/API.sh -s 471 -e 521 -p publication &!
-bash scripts/API.sh -s 521 -e 568 -p publication &!
-
-awk 'FNR > 1' grant*.csv > bigfile.csv
-sed -in '1i ....' bigfile.csv
\ No newline at end of file
+data_split=/home/research/ucrecruit/stem_cv/split
+shards=10
+
+# Hash the PDFs once into the run manifest, rather than in each of the shards.
+python main.py -d server --dir ${data_split} --run publication --index
+
+# Each shard takes its own hash range of the PDFs and is recorded in the run manifest under the
+# run name, so rerunning the same command after a crash only parses what is left.
+for (( shard=0; shard<shards; shard++ ))
+do
+    python main.py -p publication -d server --dir ${data_split} --run publication --shard ${shard}/${shards} &
+done
+wait
+
+awk 'FNR > 1' results/parsed/publication_publication_*of${shards}.csv > bigfile.csv
+sed -in '1i ....' bigfile.csv
@@ -6,3 +6,10 @@ API_KEY_ZHEN = '89171982ff6716537b5d499ca2c196af'
 # Scopus Author and Affiliation Search API -> 400K
 # Author Retrieval API -> 60K
 # Noted that all these quotas are calculated each rolling seven days, not a calendar week.
+
+API_KEYS = {'API_KEY_KIM': API_KEY_KIM,
+            'API_KEY_ZHEN': API_KEY_ZHEN}
+
+# Weekly quota per key of the endpoints used by the field parsers.
+API_QUOTA = {'scopus_search': 600000,
+             'scopus_author': 60000}
@@ -0,0 +1,195 @@
+import csv
+import os
+import re
+import threading
+from itertools import product
+
+from CVCodingTool.src.environments import grant_mapping
+
+AGENCY_DATABASE = 'resources/grants/Agency Reporting Tools and Format.csv'
+
+_agency_matcher = None
+_agency_columns = None
+_agency_matcher_lock = threading.Lock()
+
+
+def expand_pattern(pattern, limit=256):
+    """
+    The literal strings a simple agency pattern matches: alternatives separated by |, escaped
+    characters, character sets without ranges ([,]) and ? after a character or a set.
+
+    :return: The set of literals, or None if the pattern uses anything else (., groups,
+             repeats, anchors...) or expands to more than limit literals.
+    """
+    alternatives, atoms = [], []
+    pos = 0
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == '|':
+            alternatives.append(atoms)
+            atoms = []
+        elif char == '\\':
+            pos += 1
+            if pos == len(pattern) or pattern[pos].isalnum():
+                return None
+            atoms.append([pattern[pos]])
+        elif char == '[':
+            end = pattern.find(']', pos + 2)
+            chars = pattern[pos + 1:end]
+            if end < 0 or chars.startswith('^') or '-' in chars or '\\' in chars or '[' in chars:
+                return None
+            atoms.append(sorted(set(chars)))
+            pos = end
+        elif char == '?':
+            if not atoms or '' in atoms[-1]:
+                return None
+            atoms[-1] = atoms[-1] + ['']
+        elif char in '.^$*+{}()':
+            return None
+        else:
+            atoms.append([char])
+        pos += 1
+    alternatives.append(atoms)
+
+    literals = set()
+    for atoms in alternatives:
+        count = 1
+        for val in atoms:
+            count *= len(val)
+        if len(literals) + count > limit:
+            return None
+        literals.update(''.join(val) for val in product(*atoms))
+    if '' in literals:
+        return None
+    return literals
+
+
+def trie_pattern(literals):
+    """
+    A regular expression matching the same literals, factored as a trie so that matching costs
+    the length of the match rather than the number of literals. At every character only one
+    branch can go on, and a literal that is the prefix of another is made optional, so the
+    longest literal starting at a position is the one matched.
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:%s)' % '|'.join(branches)
+        return '(?:%s)?' % body if '' in node else body
+
+    return build(trie)
+
+
+class AgencyMatcher:
+    def __init__(self, mapping):
+        """
+        Every agency of a mapping (agency key to regular expression) found in a string, with a
+        single scan of the string whatever the number of agencies.
+
+        The patterns are expanded to the literals they match, and all the literals are compiled
+        into one trie-shaped regular expression inside a lookahead, so it is tried once at each
+        position of the string and reports the longest literal starting there. The shorter ones
+        starting at the same position are its prefixes, so each literal carries the agencies of
+        all its prefixes (its prefix closure). Patterns that cannot be expanded (W.M. Keck, where
+        . is any character) are searched on their own.
+
+        :param mapping: Agency key to pattern. Its order is the order of preference.
+        """
+        self.keys = list(mapping.keys())
+        self.rank = dict((key, pos) for pos, key in enumerate(self.keys))
+        literal_keys = {}
+        self.fallback = []
+        for key, pattern in mapping.items():
+            literals = expand_pattern(pattern)
+            if literals is None:
+                self.fallback.append((key, re.compile(pattern)))
+                continue
+            for literal in literals:
+                literal_keys.setdefault(literal, set()).add(key)
+
+        self.closure = {}
+        for literal in literal_keys:
+            keys = set()
+            for end in range(1, len(literal) + 1):
+                keys.update(literal_keys.get(literal[:end], ()))
+            self.closure[literal] = keys
+        self.pattern = re.compile('(?=(%s))' % trie_pattern(literal_keys)) if literal_keys else None
+
+    def agencies(self, string):
+        """
+        :return: The keys of all the agencies found in string, in mapping order.
+        """
+        keys = set()
+        if self.pattern:
+            for match in self.pattern.finditer(string):
+                keys.update(self.closure[match.group(1)])
+        keys.update(key for key, pattern in self.fallback if pattern.search(string))
+        return sorted(keys, key=self.rank.get)
+
+    def first(self, string):
+        """
+        :return: The first agency of the mapping found in string, None if there is none.
+        """
+        keys = self.agencies(string)
+        return keys[0] if keys else None
+
+
+def load_agencies(path, mapping, columns=None):
+    """
+    Agencies of the agency reporting table that mapping does not match yet: their name, and
+    their abbreviation when the name ends with one in parentheses, become a literal pattern
+    keyed by the abbreviation, or by the initials of the capitalized words of the name.
+
+    :param columns: Header of the grant rows. If given, the agencies whose key is not a column
+                    are left out, as their matches could not be written.
+    :return: A copy of mapping with the new agencies appended.
+    """
+    matcher = AgencyMatcher(mapping)
+    mapping = dict(mapping)
+    with open(path, encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            sponsor = (row.get('Sponsor') or '').strip()
+            if not sponsor:
+                continue
+            name, abbreviation = re.match(r'(.*?)\s*(?:\(([^()]+)\))?$', sponsor).groups()
+            if matcher.first(name) or abbreviation and matcher.first(abbreviation):
+                continue
+            key = abbreviation or ''.join(re.findall(r'\b[A-Z]', name))
+            if not key or key in mapping or columns is not None and key not in columns:
+                continue
+            mapping[key] = '|'.join(re.escape(val) for val in [name, abbreviation] if val)
+    return mapping
+
+
+def configure_agency_matcher(grant_config):
+    """
+    Restrict the agencies loaded from AGENCY_DATABASE to the columns of the "header" of the
+    "grant" block of config.json. The matcher is built again on next use.
+    """
+    global _agency_matcher, _agency_columns
+    with _agency_matcher_lock:
+        _agency_columns = set(grant_config['header'].split(',')) if grant_config else None
+        _agency_matcher = None
+
+
+def get_agency_matcher():
+    """
+    Return the process-wide matcher of grant_mapping and of the agencies of AGENCY_DATABASE,
+    built on first use.
+    """
+    global _agency_matcher
+    with _agency_matcher_lock:
+        if _agency_matcher is None:
+            mapping = grant_mapping
+            if os.path.exists(AGENCY_DATABASE):
+                mapping = load_agencies(AGENCY_DATABASE, mapping, _agency_columns)
+            _agency_matcher = AgencyMatcher(mapping)
+    return _agency_matcher
@@ -0,0 +1,155 @@
+import os
+import subprocess
+
+from CVCodingTool.src.tools import temp_workspace
+
+_converter = None
+
+
+class PdfConverter:
+    """
+    Interface of the PDF to XML step of CVParser.
+
+    convert returns an lxml tree in the pdftohtml -xml layout: <page> elements with top="0",
+    holding <text> elements with top, left, width, height and font attributes, and with the
+    <b>, <i> and <a> tags already stripped. Any file a backend has to write goes to a private
+    workspace under workspace_root that is removed once the file is converted.
+    """
+
+    def __init__(self, workspace_root=None):
+        self.workspace_root = workspace_root
+
+    def convert(self, file_pdf):
+        raise NotImplementedError
+
+    @staticmethod
+    def clean(data):
+        """
+        Remove no-break spaces and '&amp;' entities, as the old sed pass did.
+        """
+        return data.replace(b'\xc2\xa0', b'').replace(b'&amp;', b'')
+
+    @staticmethod
+    def finish(root):
+        from lxml import etree
+
+        tree = etree.ElementTree(root)
+        etree.strip_tags(tree, *['b', 'i', 'a'])
+        return tree
+
+
+class PdfToHtmlConverter(PdfConverter):
+    def __init__(self, workspace_root=None, chunk_size=65536):
+        """
+        Run pdftohtml with its output on a pipe (-stdout, images ignored with -i) and feed it
+        chunk by chunk into an lxml parser, so nothing is written next to the PDF. The process
+        runs inside a per-file workspace, so anything it still drops on disk is cleaned up.
+        """
+        PdfConverter.__init__(self, workspace_root)
+        self.chunk_size = chunk_size
+
+    def command(self, file_pdf):
+        return ['pdftohtml', '-xml', '-stdout', '-i', '-q', file_pdf]
+
+    def convert(self, file_pdf):
+        with temp_workspace(self.workspace_root) as workspace:
+            return self.convert_in(os.path.abspath(file_pdf), workspace)
+
+    def convert_in(self, file_pdf, workspace):
+        from lxml import etree
+
+        proc = subprocess.Popen(self.command(file_pdf), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                cwd=workspace)
+        parser = etree.XMLParser(ns_clean=True, recover=True)
+        chunks = []
+        tail = b''
+        try:
+            while True:
+                chunk = proc.stdout.read(self.chunk_size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                # Keep the last bytes back so a '&amp;' split across two chunks is still removed.
+                data = self.clean(tail + chunk)
+                data, tail = data[:-4], data[-4:]
+                parser.feed(data)
+            parser.feed(self.clean(tail))
+            root = parser.close()
+        except etree.XMLSyntaxError:
+            root = None
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+        if root is None:
+            parser = etree.XMLParser(ns_clean=True, recover=True, encoding='ISO-8859-1')
+            root = etree.fromstring(self.clean(b''.join(chunks)), parser=parser)
+        return self.finish(root)
+
+
+class PdfMinerConverter(PdfConverter):
+    def __init__(self, workspace_root=None, zoom=1.5):
+        """
+        Pure-Python backend based on pdfminer.six (optional dependency). Text lines are laid
+        out as pdftohtml would: coordinates in pixels at pdftohtml's default 1.5 zoom, measured
+        from the top of the page, and one font id per (font name, size).
+        """
+        PdfConverter.__init__(self, workspace_root)
+        self.zoom = zoom
+
+    def convert(self, file_pdf):
+        try:
+            from pdfminer.high_level import extract_pages
+            from pdfminer.layout import LTChar, LTTextContainer, LTTextLine
+        except ImportError:
+            raise ImportError('The pdfminer backend needs pdfminer.six: pip install pdfminer.six')
+        from lxml import etree
+
+        root = etree.Element('pdf2xml')
+        fonts = {}
+        for number, layout in enumerate(extract_pages(file_pdf), start=1):
+            page = etree.SubElement(root, 'page', number=str(number), position='absolute', top='0', left='0',
+                                    height=str(int(layout.height * self.zoom)),
+                                    width=str(int(layout.width * self.zoom)))
+            page.text = '\n'
+            lines = [line for box in layout if isinstance(box, LTTextContainer)
+                     for line in box if isinstance(line, LTTextLine)]
+            for line in lines:
+                chars = [char for char in line if isinstance(char, LTChar)]
+                if not chars:
+                    continue
+                font_key = (chars[0].fontname, round(chars[0].size))
+                if font_key not in fonts:
+                    fonts[font_key] = str(len(fonts))
+                    etree.SubElement(page, 'fontspec', id=fonts[font_key], size=str(font_key[1]),
+                                     family=font_key[0], color='#000000')
+                text = etree.SubElement(page, 'text',
+                                        top=str(max(1, int((layout.height - line.y1) * self.zoom))),
+                                        left=str(int(line.x0 * self.zoom)),
+                                        width=str(int(line.width * self.zoom)),
+                                        height=str(int(line.height * self.zoom)),
+                                        font=fonts[font_key])
+                text.text = line.get_text().rstrip('\n').replace('\xa0', '')
+        return self.finish(root)
+
+
+converter_map = {"pdftohtml": PdfToHtmlConverter,
+                 "pdfminer": PdfMinerConverter}
+
+
+def configure_converter(conversion_config):
+    """
+    Select the process-wide PDF converter from the "conversion" block of config.json.
+    "workspace" is the root of the per-file scratch directories (empty for the system default).
+    """
+    global _converter
+    conversion_config = conversion_config or {}
+    _converter = converter_map[conversion_config.get('backend') or 'pdftohtml'](conversion_config.get('workspace'))
+    return _converter
+
+
+def get_converter():
+    global _converter
+    if _converter is None:
+        _converter = PdfToHtmlConverter()
+    return _converter
@@ -1,14 +1,21 @@
 import hashlib
+import json
 import os
 import re
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import quote
 
-import pandas as pd
-import requests
-from fuzzywuzzy import fuzz
-
+from CVCodingTool.src.agency_matcher import get_agency_matcher
 from CVCodingTool.src.API import API_KEY_KIM
 from CVCodingTool.src.environments import crossref_first_mapping, crossref_second_mapping, doi_mapping, \
-    scopus_mapping, journal_mapping, author_mapping, grant_mapping
+    scopus_mapping, journal_mapping, author_mapping
+from CVCodingTool.src.journal_index import get_journal_index
+from CVCodingTool.src.network import request, network_option
+from CVCodingTool.src.quota import get_quota_ledger, QUOTA_EXHAUSTED_CODE
+from CVCodingTool.src.response_cache import get_response_cache, CachedResponse, CACHE_MISS_CODE
+from CVCodingTool.src.similarity import get_similarity
 from CVCodingTool.src.tools import unicode_wrapper
 
 
@@ -31,34 +38,46 @@ class FieldParser:
 
 
 class FieldNetworkParser(FieldParser):
-    def __init__(self, dic, field_map, identifier, url, headers, response_code_id):
+    endpoint = None
+
+    def __init__(self, dic, field_map, identifier, url, headers, response_code_id, query=None):
         self.url = url
         self.headers = headers
         self.resp = None
         self.response_code_id = response_code_id
+        self.query = query or url
         FieldParser.__init__(self, dic, list(field_map.keys()) + [response_code_id], identifier)
 
     def transform_helper(self):
         if not self.dic.get(self.identifier):
             return
 
-        count = 0
-        while True:
-            try:
-                self.resp = requests.get(self.url, headers=self.headers, timeout=20)
+        cache = get_response_cache()
+        if cache:
+            self.resp = cache.get(self.endpoint, self.query)
+            if self.resp is not None:
                 self.record_dict[self.response_code_id] = self.resp.status_code
-            except:
-                self.record_dict[self.response_code_id] = 700
-
-            if self.record_dict[self.response_code_id] == 700 and count < 5:
-                count += 1
-                continue
-            elif self.record_dict[self.response_code_id] == 200:
-                break
-            else:
+                if self.resp.status_code == 200:
+                    self.transform()
+                return
+            if cache.offline:
+                self.record_dict[self.response_code_id] = CACHE_MISS_CODE
                 return
 
-        self.transform()
+        try:
+            self.resp = request(self.endpoint, self.url, self.headers, ledger=get_quota_ledger())
+        except:
+            self.record_dict[self.response_code_id] = 700
+            return
+        if self.resp is None:
+            self.record_dict[self.response_code_id] = QUOTA_EXHAUSTED_CODE
+            return
+        self.record_dict[self.response_code_id] = self.resp.status_code
+
+        if cache:
+            cache.put(self.endpoint, self.query, self.resp)
+        if self.record_dict[self.response_code_id] == 200:
+            self.transform()
 
 
 class TitleTransformer(FieldParser):
@@ -74,94 +93,118 @@ class TitleTransformer(FieldParser):
         self.record_dict.update(new_dict)
 
 
+DEGREE_RULES = [
+    ([re.compile(r'Post-doc|POSTDOC|Postdoc', re.IGNORECASE)], ("Post-doc",)),
+    ([re.compile(r'P[Hh]\.?D'), re.compile(r'M\.[SA]|Master|MASTER')], ("Ph.D.", "Masters")),
+    ([re.compile(r'Ph[.]?[ ]*D|DOCTOR|doctor|Doctor|J\.D')], ("Ph.D.",)),
+    ([re.compile(r'M\.[SA]|Master|MASTER'), re.compile(r'Bachelor|B\.[SA]')], ("Masters", "Bachelor")),
+    ([re.compile(r'M[.]A|M[.]S|Master|master|MASTER')], ("Masters",)),
+    ([re.compile(r'B[.]A|B[.]S|Bachelor|bachelor|BACHELOR')], ("Bachelor",)),
+    ([re.compile(r'scholar', re.IGNORECASE)], ("Scholar",)),
+    ([re.compile(r'BS|BA|B\.|Bsc')], ("Bachelor",)),
+    ([re.compile(r'MS|MA|MPH|M\.[A-Z]|Msc|MR')], ("Masters",)),
+]
+INSTITUTION_HIERARCHY = [re.compile(val) for val in
+                         [r'Universi|UNIVERSI', r'College|COLLEGE', r'Institut|INSTITUT', r'Center|CENTER', r'UC',
+                          r'School|SCHOOL', r'Polytech|polytech|POLYTECH', r'Academy|academy']]
+INSTITUTION_SPLIT = re.compile(r'[,.;:()]|(?:\s+\-\s+)')
+INSTITUTION_UC = re.compile(r'university of california$', re.IGNORECASE)
+INSTITUTION_CLEAN = re.compile(r'^[^a-zA-Z]*|[0-9]| *$')
+YEAR_NOW = re.compile(r'present|progress', re.IGNORECASE)
+YEAR_RANGE = re.compile(r'NOW|(?:19|20)[0-9]{2}.{,8}[-|to]{1,3}.{,8}NOW|'
+                        r'(?:19|20)[0-9]{2}.{,8}-{1,3}.{,8}(?:19|20)[0-9]{2}|(?:19|20)[0-9]{2}')
+YEAR = re.compile(r'(?:19|20)[0-9]{2}')
+
+
+def extract_degree(string):
+    for patterns, degrees in DEGREE_RULES:
+        if all(pattern.search(string) for pattern in patterns):
+            return degrees
+    return None
+
+
+def extract_institution(string):
+    for institution_type in INSTITUTION_HIERARCHY:
+        if institution_type.search(string):
+            text_list = INSTITUTION_SPLIT.split(string)
+            for pos, val in enumerate(text_list):
+                if len(val) >= 56:
+                    continue
+                if INSTITUTION_UC.search(val) and pos != len(text_list) - 1:
+                    val += ',' + text_list[pos + 1]
+                    return (INSTITUTION_CLEAN.sub('', val),)
+                if institution_type.search(val):
+                    return (INSTITUTION_CLEAN.sub('', val),)
+    return None
+
+
+def extract_year(string):
+    text_list = YEAR_RANGE.findall(YEAR_NOW.sub('NOW', string))
+    if not text_list:
+        return None
+    year_list = []
+    for val in text_list:
+        if 'NOW' in val:
+            year_list.append('NOW')
+        elif '-' in val:
+            year_list.append(YEAR.findall(val)[1])
+        elif YEAR.search(val):
+            year_list.append(val)
+    return tuple(year_list)
+
+
+@lru_cache(maxsize=65536)
+def education_fields(string):
+    """
+    Degrees, years and institutions found in an education string, each as a tuple or None.
+    The rules are those of EduFieldParser, with compiled patterns, and every string is only
+    scanned once however many times the sub parsers and EduFieldParser ask for it.
+    """
+    return extract_degree(string), extract_year(string), extract_institution(string)
+
+
 class EduFieldParser(FieldParser):
     def __init__(self, dic):
         FieldParser.__init__(self, dic, ['degree', 'year', 'institution'], 'string')
 
+    def transform_helper(self):
+        FieldParser.transform_helper(self)
+        if isinstance(self.record_dict, dict):
+            # Nothing to parse: no record rather than an empty one.
+            self.record_dict = []
+
     def transform(self):
-        result_mapping = {"degree": self.degree_parser,
-                          "year": self.year_parser,
-                          "institution": self.institution_parser}
-        check_id = "degree"
+        """
+        One record per degree found in the string, with the year and institution of the same
+        rank, or the first ones when there are fewer of them. Records with neither a year nor an
+        institution are left out.
+        """
         needed_id = ["year", "institution"]
-        string = self.record_dict['string']
-        val_dict = dict.fromkeys(result_mapping.keys())
+        fields = dict(zip(["degree", "year", "institution"], education_fields(self.record_dict['string'])))
+        check_result = fields["degree"]
         section_dict = []
-
-        check_result = result_mapping[check_id](string)
         if check_result:
             for i in range(len(check_result)):
-                for ke, func in result_mapping.items():
-                    if not func(string):
-                        val_dict[ke] = None
-                    else:
-                        if len(func(string)) >= len(check_result):
-                            val_dict[ke] = func(string)[i]
-                        else:
-                            val_dict[ke] = func(string)[0]
+                val_dict = dict((ke, None if not val else val[i] if len(val) >= len(check_result) else val[0])
+                                for ke, val in fields.items())
                 if any([val_dict[idx] for idx in needed_id]):
-                    section_dict.append(val_dict.copy())
+                    section_dict.append(val_dict)
         self.record_dict = [{**self.record_dict, **val} for val in section_dict]
 
     @staticmethod
     def degree_parser(string):
-        if re.findall(r'Post-doc|POSTDOC|Postdoc', string, re.IGNORECASE):
-            return ["Post-doc"]
-        elif re.findall(r'P[Hh]\.?D', string) and re.findall(r'M\.[SA]|Master|MASTER', string):
-            return ["Ph.D.", "Masters"]
-        elif re.findall(r'Ph[.]?[ ]*D|DOCTOR|doctor|Doctor|J\.D', string):
-            return ["Ph.D."]
-        elif re.findall(r'M\.[SA]|Master|MASTER', string) and re.findall(r'Bachelor|B\.[SA]', string):
-            return ["Masters", "Bachelor"]
-        elif re.findall(r'M[.]A|M[.]S|Master|master|MASTER', string):
-            return ["Masters"]
-        elif re.findall(r'B[.]A|B[.]S|Bachelor|bachelor|BACHELOR', string):
-            return ["Bachelor"]
-        elif re.findall(r'scholar', string, re.IGNORECASE):
-            return ["Scholar"]
-        elif re.findall(r'BS|BA|B\.|Bsc', string):
-            return ["Bachelor"]
-        elif re.findall(r'MS|MA|MPH|M\.[A-Z]|Msc|MR', string):
-            return ["Masters"]
-        return None
+        result = education_fields(string)[0]
+        return list(result) if result else None
 
     @staticmethod
     def institution_parser(string):
-        institution_hierarchy = [r'Universi|UNIVERSI', r'College|COLLEGE', r'Institut|INSTITUT', r'Center|CENTER',
-                                 r'UC', r'School|SCHOOL', r'Polytech|polytech|POLYTECH', r'Academy|academy']
-        for institution_type in institution_hierarchy:
-            if re.findall(institution_type, string):
-                text_list = re.split(r'[,.;:()]|(?:\s+\-\s+)', string)
-                for pos, val in enumerate(text_list):
-                    if len(val) >= 56:
-                        continue
-                    if re.findall(r'university of california$', val, re.IGNORECASE) \
-                            and pos != len(text_list) - 1:
-                        val += ',' + text_list[pos + 1]
-                        return [re.sub(r'^[^a-zA-Z]*|[0-9]| *$', '', val)]
-                    if re.findall(institution_type, val):
-                        return [re.sub(r'^[^a-zA-Z]*|[0-9]| *$', '', val)]
-        return None
+        result = education_fields(string)[2]
+        return list(result) if result else None
 
     @staticmethod
     def year_parser(string):
-        text = re.sub(r'present|progress', 'NOW', string, flags=re.IGNORECASE)
-        text_list = re.findall(r'NOW|(?:19|20)[0-9]{2}.{,8}[-|to]{1,3}.{,8}NOW|'
-                               r'(?:19|20)[0-9]{2}.{,8}-{1,3}.{,8}(?:19|20)[0-9]{2}|(?:19|20)[0-9]{2}', text)
-        if text_list:
-            year_list = []
-            for val in text_list:
-                if 'NOW' in val:
-                    year_list.append('NOW')
-                    continue
-                elif re.findall(r'-', val):
-                    year_list.append(re.findall(r'(?:19|20)[0-9]{2}', val)[1])
-                    continue
-                elif re.findall(r'(?:19|20)[0-9]{2}', val):
-                    year_list.append(val)
-            return year_list
-        else:
-            return None
+        result = education_fields(string)[1]
+        return list(result) if result is not None else None
 
 
 class PubTitleTransformer(FieldParser):
@@ -181,10 +224,12 @@ class PubTitleTransformer(FieldParser):
 
 
 class PubCrossrefTransformer(FieldNetworkParser):
+    endpoint = 'crossref'
+
     def __init__(self, dic):
         FieldNetworkParser.__init__(self, dic, {**crossref_first_mapping, **crossref_second_mapping}, 'string_refined',
                                     'http://search.labs.crossref.org/dois?q=%s' % dic['string_refined'], None,
-                                    'response_code_c')
+                                    'response_code_c', dic['string_refined'])
 
     def transform(self):
         direct_doi = re.findall(r'10[.][0-9]{4,}(?:[.][0-9]+)*/(?:(?!["&\'<>,])\S)+', self.record_dict['string'])
@@ -208,16 +253,19 @@ class PubCrossrefTransformer(FieldNetworkParser):
 
 
 class PubScopusTransformer(FieldNetworkParser):
+    endpoint = 'scopus_search'
+    search_url = "http://api.elsevier.com/content/search/scopus?query=%s&view=COMPLETE"
+
     def __init__(self, dic):
         if dic['first_doi']:
-            url = "http://api.elsevier.com/content/search/scopus?query=DOI(%s)&view=COMPLETE" % \
-                  '/'.join(re.split(r'/', dic['first_doi'])[3:])
+            doi = self.doi_of(dic['first_doi'])
+            url = self.search_url % ('DOI(%s)' % doi)
         else:
-            url = None
+            doi, url = None, None
         FieldNetworkParser.__init__(self, dic, {**scopus_mapping, **{'s_author_id': None, 's_affiliation_id': None,
                                                                      's_current_author_id': None}},
                                     'first_doi', url, {'Accept': 'application/json', 'X-ELS-APIKey': API_KEY_KIM},
-                                    'response_code_s')
+                                    'response_code_s', doi)
 
     def transform(self):
         data = self.resp.json()['search-results']['entry'][0]
@@ -243,12 +291,18 @@ class PubScopusTransformer(FieldNetworkParser):
             else:
                 author_name_list.append((re.sub(r'-', ' ', a['authname'].lower()), a['authid']))
         author_name = (self.record_dict['f_first_name'] + ' ' + self.record_dict['f_last_name']).lower()
-        author_name_list = sorted(author_name_list, key=lambda x: fuzz.token_set_ratio(author_name, x[0]), reverse=True)
-        author_id = author_name_list[0][1]
-        return author_id
+        # The first of the best scores, as the stable sort in decreasing order gave.
+        scores = get_similarity().token_set_ratio_many(author_name, [val[0] for val in author_name_list])
+        return author_name_list[scores.index(max(scores))][1]
+
+    @staticmethod
+    def doi_of(first_doi):
+        return '/'.join(re.split(r'/', first_doi)[3:])
 
 
 class PubDoiParser(FieldNetworkParser):
+    endpoint = 'doi'
+
     def __init__(self, dic):
         FieldNetworkParser.__init__(self, dic, doi_mapping, 'first_doi', dic['first_doi'],
                                     {'accept': 'application/x-research-info-systems'}, 'response_code_d')
@@ -277,18 +331,17 @@ class PubCompareRatioParser(FieldParser):
         FieldParser.__init__(self, dic, ['relative_compare_ratio', 'absolute_compare_ratio'], 'string')
 
     def transform(self):
-        self.record_dict['relative_compare_ratio'] = fuzz.token_set_ratio(
-            self.record_dict['string_refined'].lower(),
-            ' '.join(str(val) for val in self.record_dict.values() if val).lower())
+        similarity = get_similarity()
+        string = self.record_dict['string_refined'].lower()
+        self.record_dict['relative_compare_ratio'] = similarity.token_set_ratio(
+            string, ' '.join(str(val) for val in self.record_dict.values() if val).lower())
 
         if self.record_dict['TI']:
             if self.record_dict['title_flag']:
-                self.record_dict['absolute_compare_ratio'] = fuzz.ratio(
-                    self.record_dict['string_refined'].lower(),
-                    self.record_dict['TI'].lower())
+                self.record_dict['absolute_compare_ratio'] = similarity.ratio(string, self.record_dict['TI'].lower())
             else:
-                self.record_dict['absolute_compare_ratio'] = fuzz.ratio(
-                    self.record_dict['string_refined'].lower(),
+                self.record_dict['absolute_compare_ratio'] = similarity.ratio(
+                    string,
                     ' '.join(val for val in [self.record_dict['AU'], self.record_dict['TI'],
                                              self.record_dict['T2'], self.record_dict['DA']] if val).lower())
         else:
@@ -297,7 +350,7 @@ class PubCompareRatioParser(FieldParser):
 
 class PubJournalExtractor(FieldParser):
     def __init__(self, dic):
-        self.database = pd.read_csv('resources/journals/JCR_SCIE_2015.csv')
+        self.database = get_journal_index()
         FieldParser.__init__(self, dic, journal_mapping.keys(), 'SN')
 
     def transform(self):
@@ -307,19 +360,21 @@ class PubJournalExtractor(FieldParser):
             sn_list = [self.record_dict['SN']]
 
         for sn in sn_list:
-            row = self.database[self.database['ISSN'] == sn]
-            if len(row) == 1:
+            row = self.database.lookup(sn)
+            if row:
                 for key, val in journal_mapping.items():
-                    self.record_dict[key] = row.get(val).values[0]
+                    self.record_dict[key] = row[val]
                 return
 
 
 class PubAuthIDParser(FieldNetworkParser):
+    endpoint = 'scopus_author'
+
     def __init__(self, dic):
         FieldNetworkParser.__init__(self, dic, author_mapping, 'a_author_id',
                                     'http://api.elsevier.com/content/author?author_id=%s&view=METRICS' %
                                     dic.get('a_author_id'), {'Accept': 'application/json', 'X-ELS-APIKey': API_KEY_KIM},
-                                    'response_code_a')
+                                    'response_code_a', dic.get('a_author_id'))
 
     def transform(self):
         data = self.resp.json()["author-retrieval-response"][0]
@@ -331,15 +386,113 @@ class PubAuthIDParser(FieldNetworkParser):
                 self.record_dict[key] = data.get(val)
 
 
+class ScopusBatchResolver:
+    def __init__(self):
+        """
+        Resolve the DOIs of many records with OR-combined DOI() Scopus searches, "scopus_batch"
+        DOIs per request ("network" block of config.json), instead of one search per DOI.
+
+        One resolver is shared by the CVs a process parses at once (the "pipeline" of the
+        "scheduler" block): their DOIs are pooled, and a partial batch waits up to
+        "scopus_linger" seconds for the other CVs to fill it before it is sent.
+
+        The entries of each answer are matched back to their DOI and stored in the response
+        cache as the answer of the single-DOI search, so PubScopusTransformer then finds every
+        record it covers in the cache. A DOI the answer does not cover (not found, or cut off by
+        truncation or paging) is not cached and is left for the single search.
+        Batching needs the response cache and does nothing offline.
+        """
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.resolving = set()
+        self.resolved = 0
+        self.requests = 0
+
+    def submit(self, first_doi_list):
+        """
+        Resolve the DOIs of the records of a CV, along with those of the other CVs, and return
+        once they are all in the cache or left for the single search.
+
+        :param first_doi_list: first_doi values of the records (None values are skipped).
+        """
+        batch_size = network_option('scopus_batch') or 1
+        cache = get_response_cache()
+        if not cache or cache.offline or batch_size <= 1:
+            return
+
+        dois = []
+        for first_doi in first_doi_list:
+            doi = PubScopusTransformer.doi_of(first_doi) if first_doi else None
+            if not doi or re.findall(r'[()"\s]', doi) or doi in dois:
+                continue
+            if not cache.contains(PubScopusTransformer.endpoint, doi):
+                dois.append(doi)
+        deadline = time.monotonic() + (network_option('scopus_linger') or 0)
+        with self.condition:
+            self.waiting += [val for val in dois if val not in self.resolving and val not in self.waiting]
+            dois = set(dois)
+            while not dois.isdisjoint(self.waiting) or not dois.isdisjoint(self.resolving):
+                remaining = deadline - time.monotonic()
+                if len(self.waiting) < batch_size and (remaining > 0 or dois.isdisjoint(self.waiting)):
+                    self.condition.wait(remaining if remaining > 0 else None)
+                    continue
+                batch = self.waiting[:batch_size]
+                del self.waiting[:batch_size]
+                self.resolving.update(batch)
+                self.condition.release()
+                try:
+                    self.resolve(cache, batch)
+                finally:
+                    self.condition.acquire()
+                    self.resolving.difference_update(batch)
+                    self.condition.notify_all()
+
+    def resolve(self, cache, dois):
+        headers = {'Accept': 'application/json', 'X-ELS-APIKey': API_KEY_KIM}
+        url = PubScopusTransformer.search_url % quote(' OR '.join('DOI(%s)' % doi for doi in dois)) + \
+            '&count=%d' % len(dois)
+        try:
+            resp = request(PubScopusTransformer.endpoint, url, headers, ledger=get_quota_ledger())
+            if resp is None:
+                return
+            with self.condition:
+                self.requests += 1
+            if resp.status_code != 200:
+                return
+            results = resp.json()['search-results']
+        except:
+            return
+
+        entries = [val for val in results.get('entry', []) if 'error' not in val]
+        entry_map = {}
+        for entry in entries:
+            if entry.get('prism:doi'):
+                entry_map.setdefault(entry['prism:doi'].lower(), entry)
+        for doi in dois:
+            entry = entry_map.get(doi.lower())
+            if entry is None:
+                continue
+            cache.put(PubScopusTransformer.endpoint, doi,
+                      CachedResponse(200, json.dumps({'search-results': {'entry': [entry]}})))
+            with self.condition:
+                self.resolved += 1
+
+
+_scopus_batch_resolver = ScopusBatchResolver()
+
+
+def get_scopus_batch_resolver():
+    return _scopus_batch_resolver
+
+
 class GrantFieldParser(FieldParser):
     def __init__(self, dic):
-        FieldParser.__init__(self, dic, grant_mapping.keys(), 'string')
+        FieldParser.__init__(self, dic, get_agency_matcher().keys, 'string')
 
     def transform(self):
-        for key, val in grant_mapping.items():
-            if re.findall(val, self.record_dict['string']):
-                self.record_dict[key] = self.record_dict['string']
-                return
+        key = get_agency_matcher().first(self.record_dict['string'])
+        if key:
+            self.record_dict[key] = self.record_dict['string']
 
 
 class FieldFilter(FieldParser):
@@ -349,6 +502,7 @@ class FieldFilter(FieldParser):
 
 class PubFieldFilter(FieldFilter):
     def transform(self):
+        similarity = get_similarity()
         string = self.record_dict['string_refined']
         self.record_dict['filter_flag'] = False
         if len(re.split(r' +', self.record_dict['string'])) <= 2:
@@ -358,14 +512,15 @@ class PubFieldFilter(FieldFilter):
             return
         if not self.record_dict['second_title'] or self.record_dict['first_normalized_score'] < 45:
             return
+        lowered = string.lower()
         if self.record_dict['first_normalized_score'] > 80 \
             or self.record_dict['first_title'] and \
-            fuzz.partial_ratio(self.record_dict['first_title'].lower(), string.lower()) > 75 \
+            similarity.partial_ratio(self.record_dict['first_title'].lower(), lowered) > 75 \
             or self.record_dict['first_full_citation'] and \
-            fuzz.partial_ratio(self.record_dict['first_full_citation'], string.lower()) > 80 \
+            similarity.partial_ratio(self.record_dict['first_full_citation'], lowered) > 80 \
             or self.record_dict['second_title'] and \
-            fuzz.partial_ratio(self.record_dict['first_title'], string.lower()) > \
-                2.5 * fuzz.partial_ratio(self.record_dict['second_title'], string):
+            similarity.partial_ratio(self.record_dict['first_title'], lowered) > \
+                2.5 * similarity.partial_ratio(self.record_dict['second_title'], string):
             if self.record_dict['relative_compare_ratio'] > 50 and self.record_dict['first_score'] > 1.8 \
                 and (not self.record_dict['AU'] 
                      or self.record_dict['f_last_name'].lower() in self.record_dict['AU'].lower()):
@@ -376,7 +531,7 @@ class PubFieldFilter(FieldFilter):
 
 class GrantFieldFilter(FieldFilter):
     def transform(self):
-        if any([self.record_dict[val] for val in grant_mapping.keys() if self.record_dict[val]]):
+        if any(self.record_dict.get(val) for val in get_agency_matcher().keys):
             self.record_dict['filter_flag'] = True
             return
         else:
@@ -394,7 +549,9 @@ class FieldParserHelper:
         for field_parser in self.field_parser_list:
             field_transformer = field_parser(self.record_dict)
             self.record_dict = field_transformer.record_dict
-            self.column_list = list(self.record_dict.keys())
+            # EduFieldParser gives a list, one record per degree.
+            records = self.record_dict if isinstance(self.record_dict, list) else [self.record_dict]
+            self.column_list = list(records[0].keys()) if records else field_transformer.field_list
 
 
 if __name__ == '__main__':
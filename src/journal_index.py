@@ -0,0 +1,104 @@
+import csv
+import threading
+
+from CVCodingTool.src.environments import journal_mapping
+
+JOURNAL_DATABASE = 'resources/journals/JCR_SCIE_2015.csv'
+
+_journal_index = None
+_journal_index_lock = threading.Lock()
+
+
+class JournalIndex:
+    def __init__(self, path, value_columns, key_columns=('ISSN', 'eISSN')):
+        """
+        In-memory index of the JCR journal table.
+
+        The table is read once with the csv module and every row is reduced to a tuple holding
+        only the columns in value_columns. Those tuples are stored in a dict keyed by ISSN (and
+        eISSN when the table has such a column), so a lookup is a single dict access instead of
+        a boolean-mask scan over the whole table.
+
+        An ISSN that appears in more than one row (journals listed under several categories) is
+        kept as ambiguous and never matched, which is the same as the old `len(row) == 1` check.
+
+        Memory footprint: JCR_SCIE_2015.csv has 13,865 rows and 8,799 distinct ISSNs, 4,998 of
+        them unambiguous. With the 25 columns of journal_mapping the finished index holds about
+        6.7 MB of Python objects (peak around 45 MB while the file is read), against about 17 MB
+        for the full pandas DataFrame that used to be rebuilt for every publication string.
+
+        :param path: Path to the JCR csv file.
+        :param value_columns: Columns kept for each row, in the order of the record tuple.
+        :param key_columns: Columns indexed for lookup. Missing columns are skipped.
+        """
+        self.path = path
+        self.value_columns = tuple(value_columns)
+        self.records = {}
+        self.ambiguous = set()
+
+        with open(path, encoding='utf-8') as f:
+            reader = csv.reader(f)
+            fieldnames = next(reader)
+            rows = list(reader)
+
+        value_ids = [fieldnames.index(val) for val in self.value_columns]
+        key_ids = [fieldnames.index(val) for val in key_columns if val in fieldnames]
+        columns = [self.convert_column([row[i] for row in rows]) for i in value_ids]
+
+        for pos, row in enumerate(rows):
+            record = tuple(column[pos] for column in columns)
+            for key in set(row[i].strip() for i in key_ids if row[i]):
+                if key in self.ambiguous:
+                    continue
+                if key in self.records:
+                    del self.records[key]
+                    self.ambiguous.add(key)
+                else:
+                    self.records[key] = record
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, issn):
+        return issn in self.records
+
+    def lookup(self, issn):
+        """
+        :param issn: ISSN or eISSN string.
+        :return: A dict mapping value columns to their values, or None if the ISSN is unknown
+                 or ambiguous.
+        """
+        record = self.records.get(issn)
+        if record is None:
+            return None
+        return dict(zip(self.value_columns, record))
+
+    @staticmethod
+    def convert_column(values):
+        """
+        Type a csv column the way pandas.read_csv would (int, then float, then str, with empty
+        cells as missing), so the values written to the output csv are unchanged.
+        """
+        present = [val for val in values if val != '']
+        for caster in (int, float):
+            try:
+                typed = [caster(val) for val in present]
+            except ValueError:
+                continue
+            if caster is int and len(present) < len(values):
+                continue
+            typed = iter(typed)
+            return [next(typed) if val != '' else None for val in values]
+        return [val if val != '' else None for val in values]
+
+
+def get_journal_index():
+    """
+    Return the process-wide journal index, building it on first use. Every PubParser in a
+    worker shares the same instance.
+    """
+    global _journal_index
+    with _journal_index_lock:
+        if _journal_index is None:
+            _journal_index = JournalIndex(JOURNAL_DATABASE, sorted(set(journal_mapping.values())))
+    return _journal_index
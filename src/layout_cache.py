@@ -0,0 +1,81 @@
+import hashlib
+import marshal
+import os
+import zlib
+
+from CVCodingTool.src.manifest import file_digest
+from CVCodingTool.src.text_store import TextStore
+
+# Bump whenever conversion, text_preprocess or get_partition change what they produce, so that
+# stale layouts are not reused.
+PARSER_VERSION = 2
+
+_layout_cache = None
+
+
+class LayoutCache:
+    def __init__(self, directory):
+        """
+        On-disk cache of the CVParser layout: the columns of the preprocessed TextStore (text,
+        top, left, width, height, font) and the detected partition of a PDF, so the education, publication and
+        grant runs convert and preprocess each PDF only once.
+
+        Entries are keyed by the sha1 of the PDF content (file_digest), the converter and
+        PARSER_VERSION, and stored as zlib-compressed marshal data, one file per PDF.
+
+        :param directory: Root directory of the cache, created if missing.
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, file_pdf, converter, digest=None):
+        """
+        :param digest: file_digest of the PDF when the caller already has it, so the file is
+                       not read and hashed again.
+        """
+        digest = digest or file_digest(file_pdf)
+        return hashlib.sha1(('%s:%s:%d' % (digest, converter.__class__.__name__, PARSER_VERSION)).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], '%s.layout' % key)
+
+    def load(self, key):
+        """
+        :return: (texts, partition) or None on a miss.
+        """
+        try:
+            with open(self.path(key), 'rb') as f:
+                version, columns, partition = marshal.loads(zlib.decompress(f.read()))
+        except (OSError, ValueError, EOFError, TypeError, zlib.error):
+            return None
+        if version != PARSER_VERSION:
+            return None
+        partition = [tuple(val) for val in partition] if partition is not None else None
+        return TextStore.from_columns(columns), partition
+
+    def save(self, key, texts, partition):
+        data = zlib.compress(marshal.dumps((PARSER_VERSION, texts.to_columns(), partition)))
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write aside and rename, so a concurrent reader never sees a partial file.
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+def configure_layout_cache(layout_config):
+    """
+    Set up the process-wide layout cache from the "layout_cache" block of config.json.
+    A missing or empty block (false, {}) or an empty "dir" disables it.
+    """
+    global _layout_cache
+    if not layout_config or not layout_config.get('dir'):
+        _layout_cache = None
+    else:
+        _layout_cache = LayoutCache(layout_config['dir'])
+    return _layout_cache
+
+
+def get_layout_cache():
+    return _layout_cache
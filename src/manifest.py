@@ -0,0 +1,145 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DONE = 'done'
+FAILED = 'failed'
+
+_manifest = None
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_shard(shard):
+    """
+    :param shard: "i/n", the i-th (0-based) of n shards.
+    :return: (i, n)
+    """
+    index, count = (int(val) for val in shard.split('/'))
+    if not 0 <= index < count:
+        raise ValueError('shard %s: expected i/n with 0 <= i < n' % shard)
+    return index, count
+
+
+def in_shard(digest, index, count):
+    """
+    Shards split the space of content hashes into count equal ranges, so a PDF always lands in
+    the same shard whatever machine, directory or file name it is found under.
+    """
+    return int(digest[:8], 16) * count >> 32 == index
+
+
+class RunManifest:
+    def __init__(self, path, run):
+        """
+        Record of a named, resumable batch run, kept in a SQLite file.
+
+        There is one entry per (file, partition) with the content hash of the PDF, its status
+        (done or failed), the csv it was written to and the byte range of its rows there. A
+        restarted run skips the entries that are done for the same content, parses again the
+        failed and missing ones, and cuts off whatever an interrupted write left past the last
+        recorded row of each csv.
+
+        :param path: SQLite file, created if missing.
+        :param run: Name of the run. Runs sharing a file are kept apart.
+        """
+        self.path = path
+        self.run = run
+        self.local = threading.local()
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        connection = self.connect()
+        connection.execute('CREATE TABLE IF NOT EXISTS files (run TEXT, path TEXT, partition TEXT, hash TEXT, '
+                           'status TEXT, output TEXT, start INTEGER, end INTEGER, error TEXT, attempts INTEGER, '
+                           'updated REAL, PRIMARY KEY (run, path, partition))')
+        connection.execute('CREATE TABLE IF NOT EXISTS digests (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                           'hash TEXT)')
+        connection.commit()
+
+    def connect(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.path, timeout=60)
+            self.local.connection.execute('PRAGMA journal_mode=WAL')
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def digests(self, paths):
+        """
+        Content hashes of files, from the digest table when a file still has the size and
+        modification time it had when it was hashed, otherwise computed and stored. The table is
+        shared by all the runs of the manifest, so the shards of a run and its restarts hash
+        every file only once.
+
+        :return: The file_digest of each path, in order.
+        """
+        connection = self.connect()
+        known = dict((row[0], row[1:]) for row in connection.execute('SELECT path, size, mtime, hash FROM digests'))
+        digests, new = [], []
+        for path in paths:
+            stat = os.stat(path)
+            key = os.path.abspath(path)
+            size, mtime, digest = known.get(key, (None, None, None))
+            if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+                digest = file_digest(path)
+                new.append((key, stat.st_size, stat.st_mtime_ns, digest))
+            digests.append(digest)
+        if new:
+            connection.executemany('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)', new)
+            connection.commit()
+        return digests
+
+    def pending(self, path, digest, partitions):
+        """
+        :return: The partitions of the file still to be parsed.
+        """
+        done = set(row[0] for row in self.connect().execute(
+            'SELECT partition FROM files WHERE run = ? AND path = ? AND hash = ? AND status = ?',
+            (self.run, path, digest, DONE)))
+        return [val for val in partitions if val not in done]
+
+    def committed(self, output):
+        """
+        :return: The byte offset right after the last recorded row of output, 0 if none.
+        """
+        return self.connect().execute('SELECT COALESCE(MAX(end), 0) FROM files WHERE run = ? AND output = ? '
+                                      'AND status = ?', (self.run, output, DONE)).fetchone()[0]
+
+    def record(self, path, partition, digest, status, output=None, start=None, end=None, error=None):
+        connection = self.connect()
+        row = connection.execute('SELECT attempts FROM files WHERE run = ? AND path = ? AND partition = ?',
+                                 (self.run, path, partition)).fetchone()
+        connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (self.run, path, partition, digest, status, output, start, end, error,
+                            (row[0] if row else 0) + 1, time.time()))
+        connection.commit()
+
+    def summary(self):
+        return dict(self.connect().execute('SELECT status, COUNT(*) FROM files WHERE run = ? GROUP BY status',
+                                           (self.run,)).fetchall())
+
+
+def configure_manifest(manifest_config, run):
+    """
+    Set up the process-wide run manifest from the "manifest" block of config.json. Only named
+    runs (--run) are recorded; an empty "path" disables the manifest.
+    """
+    global _manifest
+    if not run or not manifest_config or not manifest_config.get('path'):
+        _manifest = None
+    else:
+        _manifest = RunManifest(manifest_config['path'], run)
+    return _manifest
+
+
+def get_manifest():
+    return _manifest
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Crossref search, doi.org and Elsevier (Scopus search and author
+retrieval) APIs, to run the publication pipeline on a machine without network access or API
+keys, and to measure its throughput and retry behaviour reproducibly.
+
+Answers are replayed from a fixtures file when it has them, and otherwise made up from the
+request (the same request always gets the same answer). Latency, server errors and throttling
+(429 with Retry-After) are injected as set in the "mock_server" block of config.json. With
+--record, requests missing from the fixtures are forwarded to the real APIs and their answers
+saved to the fixtures file.
+
+Usage, from the repository root:
+    python src/mock_server.py [--port 8765] [--latency 0.05] [--error-rate 0.01] [--record]
+    python main.py -p publication -d development --dir data/test --mock
+"""
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import signal
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, unquote, urlsplit
+from urllib.request import Request, urlopen
+
+# Real URL prefix of each API, by the path prefix it is served under.
+UPSTREAMS = {'crossref': 'http://search.labs.crossref.org',
+             'doi': 'http://dx.doi.org',
+             'elsevier': 'http://api.elsevier.com'}
+MOCK_DEFAULTS = {"host": "127.0.0.1", "port": 8765, "fixtures": "", "latency": 0.0, "jitter": 0.0,
+                 "error_rate": 0.0, "throttle_rate": 0.0, "rate": {}, "retry_after": 1, "seed": 0, "cache": ""}
+SCOPUS_DOI = re.compile(r'DOI\(([^()]+)\)', re.IGNORECASE)
+WORD = re.compile(r'\w+')
+JOURNALS = [('Nature', '0028-0836'), ('Science', '0036-8075'), ('Cell', '0092-8674'),
+            ('PLoS ONE', '1932-6203'), ('Journal of Biological Chemistry', '0021-9258')]
+NAMES = [('Smith', 'John'), ('Zhang', 'Wei'), ('Garcia', 'Maria'), ('Kim', 'Min'), ('Müller', 'Anna'),
+         ('Chen', 'Li'), ('Patel', 'Ravi'), ('Rossi', 'Marco')]
+
+
+def normalize(query):
+    """
+    The same normalization as the response cache, so fixtures can be keyed like its entries.
+    """
+    return re.sub(r'\s+', ' ', str(query)).strip().lower()
+
+
+def digest(*parts):
+    return hashlib.sha1('\n'.join(str(val) for val in parts).encode()).hexdigest()
+
+
+def fraction(*parts):
+    """
+    A number in [0, 1) that only depends on parts.
+    """
+    return int(digest(*parts)[:8], 16) / 2 ** 32
+
+
+def mock_base_urls(host, port):
+    return dict((upstream, 'http://%s:%d/%s' % (host, port, prefix)) for prefix, upstream in UPSTREAMS.items())
+
+
+def mock_profile(config):
+    """
+    A copy of config running against the mock server of its "mock_server" block: the base URLs
+    of the APIs point at the server, the API quota is not accounted, and responses go to a
+    cache of their own (none if the block has no "cache") rather than to the real one.
+    """
+    config = copy.deepcopy(config)
+    mock_config = {**MOCK_DEFAULTS, **config.get('mock_server', {})}
+    network_config = config.setdefault('network', {})
+    network_config['base_urls'] = {**network_config.get('base_urls', {}),
+                                   **mock_base_urls(mock_config['host'], mock_config['port'])}
+    config['quota'] = None
+    if config.get('cache'):
+        config['cache'] = {**config['cache'], 'path': mock_config['cache']}
+    return config
+
+
+class TokenBucket:
+    def __init__(self, rate):
+        """
+        Non-blocking rate limit of the server: take() fails rather than waits.
+        """
+        self.rate = rate
+        self.tokens = float(max(rate, 1))
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(float(max(self.rate, 1)), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class MockServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, mock_config, record=False):
+        """
+        :param mock_config: The "mock_server" block of config.json. "latency" (seconds) is added
+                            to every answer, give or take "jitter" (a fraction of it).
+                            "error_rate" and "throttle_rate" are the shares of requests answered
+                            with a 500/503 and with a 429, "rate" caps the requests per second of
+                            an endpoint (crossref, doi, scopus_search, scopus_author) beyond which
+                            they get a 429 too, with a Retry-After of "retry_after" seconds.
+                            Faults depend on "seed", the request and the number of times it was
+                            made, so runs against a freshly started server get the same faults
+                            and a retried request eventually gets through.
+        :param record: Forward requests missing from the fixtures to the real APIs and keep
+                       their answers, saved to the fixtures file by save().
+        """
+        self.mock_config = {**MOCK_DEFAULTS, **(mock_config or {})}
+        self.record = record
+        self.fixtures = {}
+        fixtures_path = self.mock_config['fixtures']
+        if fixtures_path and os.path.exists(fixtures_path):
+            with open(fixtures_path, encoding='utf-8') as f:
+                self.fixtures = json.load(f)
+        self.buckets = dict((endpoint, TokenBucket(rate)) for endpoint, rate in self.mock_config['rate'].items())
+        self.attempts = {}
+        self.titles = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        HTTPServer.__init__(self, (self.mock_config['host'], self.mock_config['port']), MockHandler)
+
+    def count(self, endpoint, status):
+        with self.lock:
+            self.stats.setdefault(endpoint, {}).setdefault(str(status), 0)
+            self.stats[endpoint][str(status)] += 1
+
+    def fault(self, endpoint, key):
+        """
+        :return: (status, headers) of the injected fault of this request, None if it is to be
+                 answered.
+        """
+        with self.lock:
+            attempt = self.attempts[endpoint, key] = self.attempts.get((endpoint, key), 0) + 1
+        bucket = self.buckets.get(endpoint)
+        if bucket and not bucket.take():
+            return 429, {'Retry-After': str(self.mock_config['retry_after'])}
+        draw = fraction(self.mock_config['seed'], endpoint, key, attempt)
+        if draw < self.mock_config['throttle_rate']:
+            return 429, {'Retry-After': str(self.mock_config['retry_after'])}
+        if draw < self.mock_config['throttle_rate'] + self.mock_config['error_rate']:
+            return 503 if attempt % 2 else 500, {}
+        return None
+
+    def delay(self, endpoint, key):
+        latency, jitter = self.mock_config['latency'], self.mock_config['jitter']
+        if latency > 0:
+            time.sleep(max(0.0, latency * (1 + jitter * (2 * fraction('latency', endpoint, key) - 1))))
+
+    def fixture(self, endpoint, key):
+        with self.lock:
+            return self.fixtures.get(endpoint, {}).get(normalize(key))
+
+    def keep(self, endpoint, key, status, body):
+        with self.lock:
+            self.fixtures.setdefault(endpoint, {})[normalize(key)] = [status, body]
+
+    def save(self):
+        fixtures_path = self.mock_config['fixtures']
+        if not fixtures_path or not self.record:
+            return
+        with self.lock:
+            fixtures = json.dumps(self.fixtures, indent=1, sort_keys=True, ensure_ascii=False)
+        os.makedirs(os.path.dirname(os.path.abspath(fixtures_path)), exist_ok=True)
+        with open(fixtures_path, 'w', encoding='utf-8') as f:
+            f.write(fixtures)
+
+    def title_of(self, doi):
+        with self.lock:
+            return self.titles.get(doi.lower()) or 'Mock article %s' % doi
+
+    def crossref(self, query):
+        """
+        Two results whose titles are made of the words of the query, so the publication filters
+        keep some of them, with the DOIs of their mock articles.
+        """
+        words = WORD.findall(query)
+        results = []
+        for rank, title_words in enumerate([words[:14], list(reversed(words[:8]))]):
+            title = ' '.join(title_words) or 'Untitled'
+            doi = '10.5555/mock.%s' % digest('crossref', query, rank)[:12]
+            with self.lock:
+                self.titles[doi] = title
+            journal = JOURNALS[int(digest(doi)[:4], 16) % len(JOURNALS)][0]
+            year = 1990 + int(digest(doi)[4:8], 16) % 30
+            results.append({'doi': 'http://dx.doi.org/' + doi, 'title': title,
+                            'score': round(4 - 2 * rank - fraction('score', query, rank), 3),
+                            'normalizedScore': int(100 - 40 * rank - 30 * fraction('normalized', query, rank)),
+                            'fullCitation': "%s, %d, '%s', <i>%s</i>" % (self.authors(doi)[0][0], year, title,
+                                                                         journal),
+                            'coins': '', 'year': str(year)})
+        return 200, json.dumps(results)
+
+    @staticmethod
+    def authors(doi):
+        first = int(digest('authors', doi)[:4], 16)
+        return [NAMES[(first + pos) % len(NAMES)] for pos in range(2 + first % 3)]
+
+    def doi(self, doi):
+        journal, issn = JOURNALS[int(digest(doi)[:4], 16) % len(JOURNALS)]
+        year = 1990 + int(digest(doi)[4:8], 16) % 30
+        lines = ['TY  - JOUR'] + ['AU  - %s, %s' % val for val in self.authors(doi)] + \
+                ['TI  - %s' % self.title_of(doi), 'T2  - %s' % journal, 'DA  - %d/01/01' % year, 'DO  - %s' % doi,
+                 'SN  - %s' % issn, 'VL  - %d' % (1 + int(digest(doi)[8:10], 16)),
+                 'IS  - %d' % (1 + int(digest(doi)[10:11], 16)), 'SP  - %d' % (1 + int(digest(doi)[11:14], 16)),
+                 'PB  - Mock Publishing', 'ER  - ', '']
+        return 200, '\n'.join(lines)
+
+    def scopus_entry(self, doi):
+        journal, issn = JOURNALS[int(digest(doi)[:4], 16) % len(JOURNALS)]
+        year = 1990 + int(digest(doi)[4:8], 16) % 30
+        number = int(digest('scopus', doi)[:9], 16)
+        authors = [{'authid': str(57000000000 + int(digest('author', surname, given)[:6], 16)),
+                    'authname': '%s %s.' % (surname, given[0]), 'surname': surname, 'given-name': given}
+                   for surname, given in self.authors(doi)]
+        return {'prism:url': 'http://api.elsevier.com/content/abstract/scopus_id/%d' % number,
+                'dc:identifier': 'SCOPUS_ID:%d' % number, 'eid': '2-s2.0-%d' % number,
+                'dc:title': self.title_of(doi), 'dc:creator': authors[0]['authname'],
+                'prism:publicationName': journal, 'prism:issn': issn.replace('-', ''),
+                'prism:coverDate': '%d-01-01' % year, 'prism:doi': doi,
+                'citedby-count': str(number % 500), 'author': authors,
+                'affiliation': [{'afid': str(60000000 + number % 10000)}]}
+
+    def scopus_search(self, query, count):
+        """
+        The entries of the DOIs of an OR-combined DOI() search, from the fixtures of the single
+        searches when they have them.
+        """
+        dois = SCOPUS_DOI.findall(query)
+        entries = []
+        for doi in dois:
+            fixture = self.fixture('scopus_search', 'DOI(%s)' % doi) if len(dois) > 1 else None
+            if fixture and fixture[0] == 200:
+                entries += [val for val in json.loads(fixture[1])['search-results'].get('entry', [])
+                            if 'error' not in val]
+            else:
+                entries.append(self.scopus_entry(doi))
+        entries = entries[:count or 25]
+        results = {'opensearch:totalResults': str(len(entries)),
+                   'entry': entries or [{'@_fa': 'true', 'error': 'Result set was empty'}]}
+        return 200, json.dumps({'search-results': results})
+
+    @staticmethod
+    def scopus_author(author_id):
+        number = int(digest('metrics', author_id)[:8], 16)
+        coredata = {'cited-by-count': str(number % 5000), 'citation-count': str(number % 5000 + number % 97)}
+        return 200, json.dumps({'author-retrieval-response': [
+            {'coredata': coredata, 'h-index': str(number % 60), 'coauthor-count': str(number % 150)}]})
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = dict((key, val[0]) for key, val in parse_qs(parts.query).items())
+        prefix, _, rest = parts.path.lstrip('/').partition('/')
+        if prefix == 'crossref' and rest == 'dois':
+            endpoint, key, answer = 'crossref', query.get('q', ''), lambda: self.server.crossref(query.get('q', ''))
+        elif prefix == 'doi' and rest:
+            doi = unquote(rest)
+            endpoint, key, answer = 'doi', doi, lambda: self.server.doi(doi)
+        elif prefix == 'elsevier' and rest == 'content/search/scopus':
+            count = int(query['count']) if query.get('count', '').isdigit() else 0
+            endpoint, key = 'scopus_search', query.get('query', '')
+            answer = lambda: self.server.scopus_search(key, count)
+        elif prefix == 'elsevier' and rest == 'content/author':
+            endpoint, key = 'scopus_author', query.get('author_id', '')
+            answer = lambda: self.server.scopus_author(key)
+        elif prefix == 'stats':
+            return self.reply('stats', 200, json.dumps(self.server.stats))
+        else:
+            return self.reply('unknown', 404, json.dumps({'error': 'unknown path %s' % parts.path}))
+
+        self.server.delay(endpoint, key)
+        fault = self.server.fault(endpoint, key)
+        if fault:
+            status, headers = fault
+            return self.reply(endpoint, status, json.dumps({'error': 'mock fault'}), headers)
+        fixture = self.server.fixture(endpoint, key)
+        if fixture is None and self.server.record:
+            fixture = self.upstream(UPSTREAMS[prefix] + self.path[len(prefix) + 1:])
+            if fixture[0] in (200, 404):
+                self.server.keep(endpoint, key, *fixture)
+        status, body = fixture or answer()
+        self.reply(endpoint, status, body)
+
+    def upstream(self, url):
+        headers = dict((key, self.headers[key]) for key in ('Accept', 'X-ELS-APIKey') if self.headers.get(key))
+        try:
+            with urlopen(Request(url, headers=headers), timeout=20) as resp:
+                return resp.status, resp.read().decode('utf-8', 'replace')
+        except HTTPError as e:
+            return e.code, e.read().decode('utf-8', 'replace')
+        except URLError as e:
+            return 502, json.dumps({'error': str(e.reason)})
+
+    def reply(self, endpoint, status, body, headers=None):
+        self.server.count(endpoint, status)
+        data = body.encode('utf-8')
+        self.send_response(status)
+        is_json = body[:1] in '{['
+        self.send_header('Content-Type', 'application/json' if is_json else 'application/x-research-info-systems')
+        self.send_header('Content-Length', str(len(data)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug('mock server: ' + format % args)
+
+
+def start_mock_server(mock_config, record=False):
+    """
+    Serve in a background thread, for scripts that run the pipeline against the server in the
+    same process. Stop with server.shutdown().
+    """
+    server = MockServer(mock_config, record)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', action='store', dest='config', default='config.json')
+    parser.add_argument('--host', action='store', dest='host')
+    parser.add_argument('--port', action='store', dest='port', type=int)
+    parser.add_argument('--fixtures', action='store', dest='fixtures')
+    parser.add_argument('--latency', action='store', dest='latency', type=float)
+    parser.add_argument('--jitter', action='store', dest='jitter', type=float)
+    parser.add_argument('--error-rate', action='store', dest='error_rate', type=float)
+    parser.add_argument('--throttle-rate', action='store', dest='throttle_rate', type=float)
+    parser.add_argument('--seed', action='store', dest='seed', type=int)
+    parser.add_argument('--record', action='store_true', dest='record',
+                        help='forward requests missing from the fixtures to the real APIs and save their answers')
+    parser.set_defaults(record=False)
+    parsed = parser.parse_args()
+
+    with open(parsed.config, 'r') as f:
+        mock_config = json.load(f).get('mock_server', {})
+    for name in ('host', 'port', 'fixtures', 'latency', 'jitter', 'error_rate', 'throttle_rate', 'seed'):
+        if getattr(parsed, name) is not None:
+            mock_config[name] = getattr(parsed, name)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    server = MockServer(mock_config, parsed.record)
+    # Stopped by kill as by Ctrl-C, so the recorded fixtures are saved either way.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logging.info('mock server on http://%s:%d' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.save()
+        logging.info('mock server: %s' % json.dumps(server.stats, sort_keys=True))
@@ -0,0 +1,329 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Status codes worth another try: throttling and transient server errors.
+RETRY_CODES = (429, 500, 502, 503, 504)
+
+_network = {"workers": 1, "concurrency": {}, "rate": {}, "retries": 5, "backoff": 0.5, "max_backoff": 60,
+            "base_urls": {}, "scopus_batch": 1, "scopus_linger": 0, "limiter": "", "processes": 1}
+_executor = None
+_executor_pid = None
+_semaphores = {}
+_buckets = {}
+_sessions = {}
+_metrics = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """
+        Token bucket limiting an API to rate requests per second, with bursts of up to
+        capacity requests.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    def __init__(self, path, endpoint, rate, capacity=None):
+        """
+        TokenBucket whose tokens are kept in a SQLite file, so that all the processes using the
+        file (pool workers, shards started side by side) draw from one rate together. Each
+        acquisition is one short write transaction, taken with BEGIN IMMEDIATE.
+        """
+        self.path = path
+        self.endpoint = endpoint
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.local = threading.local()
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def connection(self):
+        """
+        SQLite connections cannot cross threads or forks, so each thread of each process
+        opens its own.
+        """
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets (endpoint TEXT PRIMARY KEY, tokens REAL, '
+                               'updated REAL)')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def acquire(self):
+        connection = self.connection()
+        while True:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = connection.execute('SELECT tokens, updated FROM buckets WHERE endpoint = ?',
+                                         (self.endpoint,)).fetchone()
+                tokens = self.capacity if row is None else \
+                    min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                if not wait:
+                    tokens -= 1
+                connection.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)', (self.endpoint, tokens, now))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests, self.retries, self.throttled, self.errors = 0, 0, 0, 0
+        self.latency_total, self.latency_max = 0.0, 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.requests += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def increment(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __str__(self):
+        mean = self.latency_total / self.requests if self.requests else 0.0
+        return '%d requests, %d retries, %d throttled, %d errors, latency mean %.3fs max %.3fs' % \
+               (self.requests, self.retries, self.throttled, self.errors, mean, self.latency_max)
+
+
+def configure_network(network_config, processes=1):
+    """
+    Set up the process-wide network layer from the "network" block of config.json.
+
+    "workers" bounds the number of publication records enriched at the same time in a process,
+    "concurrency" bounds the number of requests in flight per endpoint (crossref, doi,
+    scopus_search, scopus_author), and "rate" caps the requests per second of each endpoint.
+    "retries", "backoff" and "max_backoff" drive the exponential backoff. "base_urls" maps URL
+    prefixes to replacements (for instance a local stub server), "scopus_batch" is the number
+    of DOIs per batched Scopus search and "scopus_linger" the seconds a partial batch waits for
+    the DOIs of other CVs. A missing block keeps the serial, unthrottled
+    behaviour.
+
+    The limits hold for all the processes of a run together. The rates are drawn from token
+    buckets in the SQLite file "limiter", shared by every process that uses it; without one,
+    each process gets its share of the rate. The concurrency is split between the processes.
+
+    :param processes: Number of processes running with this configuration at the same time
+                      (pool workers times shards).
+    """
+    global _executor
+    with _lock:
+        if _executor and _executor_pid == os.getpid():
+            _executor.shutdown(wait=True)
+        _executor = None
+        _network.update({"workers": 1, "concurrency": {}, "rate": {}, "retries": 5, "backoff": 0.5,
+                         "max_backoff": 60, "base_urls": {}, "scopus_batch": 1, "scopus_linger": 0, "limiter": ""})
+        _network.update(network_config or {})
+        _network['processes'] = max(1, processes)
+        _semaphores.clear()
+        _buckets.clear()
+        _metrics.clear()
+
+
+def network_option(name):
+    return _network.get(name)
+
+
+def rewrite_url(url):
+    for prefix, replacement in _network['base_urls'].items():
+        if url.startswith(prefix):
+            return replacement + url[len(prefix):]
+    return url
+
+
+def get_executor():
+    """
+    The executor threads do not survive a fork, so a forked child starts its own executor.
+    """
+    global _executor, _executor_pid
+    with _lock:
+        if _network['workers'] > 1 and (_executor is None or _executor_pid != os.getpid()):
+            _executor = ThreadPoolExecutor(max_workers=_network['workers'])
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def map_concurrent(func, iterable):
+    """
+    Apply func to every item over the shared executor, keeping the input order in the result.
+    Each item is handled by one task, so the steps done by func for an item stay in order.
+    """
+    executor = get_executor()
+    if executor is None:
+        return list(map(func, iterable))
+    return list(executor.map(func, iterable))
+
+
+@contextmanager
+def endpoint_slot(endpoint):
+    """
+    Hold one of the request slots of an endpoint for the duration of the block.
+    """
+    limit = _network['concurrency'].get(endpoint)
+    if not limit:
+        yield
+        return
+    with _lock:
+        semaphore = _semaphores.setdefault(endpoint,
+                                           threading.BoundedSemaphore(max(1, limit // _network['processes'])))
+    with semaphore:
+        yield
+
+
+def get_session(url):
+    """
+    One keep-alive session per host and process, with a connection pool large enough for all
+    enrichment workers.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    host = urlsplit(url).netloc
+    with _lock:
+        session = _sessions.get((os.getpid(), host))
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(_network['workers'], 10))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[(os.getpid(), host)] = session
+        return session
+
+
+def get_bucket(endpoint):
+    """
+    :return: The rate limiter of an endpoint, None if its rate is not limited.
+    """
+    rate = _network['rate'].get(endpoint)
+    if not rate:
+        return None
+    with _lock:
+        bucket = _buckets.get(endpoint)
+        if bucket is None:
+            if _network['limiter']:
+                bucket = SharedTokenBucket(_network['limiter'], endpoint, rate)
+            else:
+                bucket = TokenBucket(float(rate) / _network['processes'])
+            _buckets[endpoint] = bucket
+        return bucket
+
+
+def get_metrics(endpoint):
+    with _lock:
+        return _metrics.setdefault(endpoint, EndpointMetrics())
+
+
+def retry_delay(attempt, resp=None):
+    """
+    Exponential backoff with full jitter. A Retry-After header (seconds or HTTP date) takes
+    precedence.
+    """
+    retry_after = resp.headers.get('Retry-After') if resp is not None else None
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(_network['max_backoff'], _network['backoff'] * 2 ** attempt))
+
+
+def request(endpoint, url, headers=None, timeout=20, ledger=None):
+    """
+    GET url through the pooled session of its host, under the concurrency slot and rate limit
+    of the endpoint. Connection errors, throttling and server errors are retried with backoff.
+
+    :param ledger: QuotaLedger that every attempt, retries included, is charged to when it counts
+                   the endpoint. Each attempt is sent with the key it hands out (X-ELS-APIKey).
+    :return: The last response, None if the ledger refused the first attempt. Raises the last
+             exception if no response was ever received.
+    """
+    import requests
+
+    url = rewrite_url(url)
+    metrics = get_metrics(endpoint)
+    bucket = get_bucket(endpoint)
+    if ledger is not None and endpoint not in ledger.quota:
+        ledger = None
+
+    attempt = 0
+    resp, error = None, None
+    while True:
+        if ledger:
+            api_key = ledger.acquire(endpoint)
+            if not api_key:
+                if error:
+                    metrics.increment('errors')
+                    raise error
+                return resp
+            headers = {**(headers or {}), 'X-ELS-APIKey': api_key}
+        if bucket:
+            bucket.acquire()
+        resp, error = None, None
+        begin = time.monotonic()
+        try:
+            with endpoint_slot(endpoint):
+                resp = get_session(url).get(url, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            error = e
+        metrics.record(time.monotonic() - begin)
+
+        if resp is not None and resp.status_code not in RETRY_CODES:
+            return resp
+        if resp is not None and resp.status_code == 429:
+            metrics.increment('throttled')
+        if attempt >= _network['retries']:
+            if error:
+                metrics.increment('errors')
+                raise error
+            return resp
+        time.sleep(retry_delay(attempt, resp))
+        attempt += 1
+        metrics.increment('retries')
+
+
+def log_network_stats():
+    with _lock:
+        metrics = dict(_metrics)
+    for endpoint, val in sorted(metrics.items()):
+        logging.info('network %s: %s' % (endpoint, val))
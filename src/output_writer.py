@@ -0,0 +1,304 @@
+import codecs
+import csv
+import glob
+import hashlib
+import logging
+import os
+import queue
+import sys
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+import numpy as np
+
+from CVCodingTool.src.manifest import DONE
+
+_STOP = object()
+
+
+def cell(value):
+    """
+    Text of one csv cell as DataFrame.to_csv writes it: missing values are empty, everything
+    else is str(value).
+    """
+    if value is None or (isinstance(value, (float, np.floating)) and np.isnan(value)):
+        return None
+    return str(value)
+
+
+def is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_))
+
+
+def column_kinds(records, columns):
+    """
+    Columns that DataFrame.from_dict would turn into floats: numbers only (bools are not
+    numbers), with at least one float or one missing value. Their integers are written as
+    floats (2011.0), as pandas did. Any other column is an object column, written as is
+    (True, 1, text).
+    """
+    floats = set()
+    for column in columns:
+        values = [record.get(column) for record in records]
+        numbers = [val for val in values if cell(val) is not None]
+        if numbers and all(is_number(val) for val in numbers) and \
+                (len(numbers) < len(values) or any(isinstance(val, (float, np.floating)) for val in numbers)):
+            floats.add(column)
+    return floats
+
+
+def partition_rows(records, columns):
+    """
+    Rows of a partition, without building a DataFrame: each record dict becomes a tuple of cell
+    texts ordered by columns (the config.json header), and repeated records are dropped keeping
+    the first, as DataFrame.drop_duplicates did over all the keys of the records.
+
+    :param records: List of record dicts, the section_dict of a section parser.
+    :param columns: Header of the partition.
+    """
+    keys = sorted(set(chain.from_iterable(records)))
+    floats = column_kinds(records, keys)
+    rows, seen = [], set()
+    for record in records:
+        texts = dict((key, cell(float(record[key]) if key in floats and record.get(key) is not None
+                                else record.get(key))) for key in keys)
+        identity = tuple(texts[key] for key in keys)
+        if identity in seen:
+            continue
+        seen.add(identity)
+        rows.append(tuple(texts.get(column) for column in columns))
+    return rows
+
+
+class DedupFilter:
+    def __init__(self, max_keys):
+        """
+        Streaming duplicate filter on one column. It keeps a 64-bit digest of the last max_keys
+        distinct values seen, dropping the oldest first, so memory stays bounded (about 100 bytes
+        per key) and duplicates further apart than max_keys rows can get through.
+        """
+        self.max_keys = max_keys
+        self.keys = OrderedDict()
+        self.dropped = 0
+
+    def seen(self, value):
+        if value is None:
+            return False
+        key = hashlib.sha1(value.encode()).digest()[:8]
+        if key in self.keys:
+            self.dropped += 1
+            return True
+        self.keys[key] = None
+        if len(self.keys) > self.max_keys:
+            self.keys.popitem(last=False)
+        return False
+
+    def seed(self, path, index):
+        """
+        Remember the values of one column of an existing csv, the rows written before a resume,
+        without counting them as dropped.
+        """
+        with codecs.open(path, 'r', 'utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) > index:
+                    self.seen(row[index] or None)
+        self.dropped = 0
+
+
+class CsvSink:
+    def __init__(self, path, columns, resume=None):
+        """
+        :param path: csv file, or None for sys.stdout.
+        :param resume: Byte offset to cut the file back to before appending to it, None to start
+                       a new file.
+        """
+        self.path = path
+        if path is None:
+            self.stream = sys.stdout
+        else:
+            if resume is not None and os.path.exists(path):
+                os.truncate(path, resume)
+            self.stream = codecs.open(path, 'a' if resume is not None else 'w+', 'utf-8')
+        self.writer = csv.writer(self.stream, lineterminator='\n')
+        if self.stream is sys.stdout or self.stream.tell() == 0:
+            self.writer.writerow(columns)
+            self.stream.flush()
+
+    def write(self, rows):
+        """
+        :return: The byte range of the rows in the file, (None, None) on stdout.
+        """
+        start = self.stream.tell() if self.path else None
+        self.writer.writerows(rows)
+        self.stream.flush()
+        return start, self.stream.tell() if self.path else None
+
+    def close(self):
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+class ParquetSink:
+    def __init__(self, path, columns, row_group_size=10000):
+        """
+        Parquet file with one nullable string column per header column, holding the same text as
+        the csv. Rows are buffered into row groups. The file is written aside and only moved to
+        path once closed, so an interrupted run never leaves a truncated Parquet file behind, and
+        it is not created at all when there are no rows. The files left aside by an interrupted
+        run are deleted. Needs pyarrow (optional dependency).
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([(val, pyarrow.string()) for val in columns])
+        for val in glob.glob(glob.escape(path) + '.*.tmp'):
+            os.remove(val)
+        self.temp_path = '%s.%d.tmp' % (path, os.getpid())
+        self.writer = None
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            if self.writer is None:
+                self.writer = self.pyarrow.parquet.ParquetWriter(self.temp_path, self.schema)
+            self.writer.write_table(self.pyarrow.Table.from_arrays(
+                [self.pyarrow.array(list(val), type=self.pyarrow.string()) for val in zip(*self.rows)],
+                schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.temp_path, self.path)
+
+    def copy_csv(self, path):
+        """
+        Write all the rows of a csv with the same header, empty cells as missing values.
+        """
+        with codecs.open(path, 'r', 'utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                self.write([tuple(val or None for val in row)])
+
+
+class OutputWriter(threading.Thread):
+    def __init__(self, partitions, outputs, manifest=None, formats=('parquet', 'csv'), dedup='hashcode',
+                 max_keys=1000000, row_group_size=10000):
+        """
+        Single writer of the parsed rows. Workers' results are queued to it from the main process
+        and it writes them, one dataset per partition with the config.json header as schema, to
+        a csv and a Parquet file, drops duplicate rows and records each file in the run manifest.
+
+        With a manifest, a file is recorded as done once its rows are in the csv, and the Parquet
+        file is rebuilt from the whole csv on close. Nothing recorded is then only buffered for
+        Parquet, and a run interrupted before close gets its Parquet file from the next session.
+        On resume, the duplicate filter is seeded from the rows already in the csv.
+
+        :param partitions: Partition blocks of config.json.
+        :param outputs: Partition name to (csv path or None for stdout, csv byte offset to resume
+                        from or None, Parquet path or None). Only one partition can go to stdout.
+        :param manifest: RunManifest to record the files in.
+        :param formats: "csv" and/or "parquet". Parquet falls back to csv without pyarrow, and the
+                        csv is always written for a named run, as its byte offsets make it resumable.
+        :param dedup: Column to drop duplicate rows on, for the partitions that have it.
+                      "string_refined" drops repeated publications across CVs.
+        :param max_keys: Number of distinct values the duplicate filter remembers.
+        :param row_group_size: Rows per Parquet row group.
+        """
+        threading.Thread.__init__(self, name='output-writer', daemon=True)
+        self.manifest = manifest
+        self.queue = queue.Queue(maxsize=1000)
+        self.error = None
+        self.columns, self.csv_sinks, self.parquet_sinks, self.dedup_index, self.filters = {}, {}, {}, {}, {}
+        self.rebuilds = {}
+
+        stdout = [val['name'] for val in partitions if outputs[val['name']][0] is None]
+        if len(stdout) > 1:
+            raise ValueError('output: only one partition can be written to stdout, not %s' % ', '.join(stdout))
+        if 'parquet' in formats:
+            try:
+                import pyarrow.parquet
+            except ImportError:
+                logging.warning('output: pyarrow is not installed, writing csv only')
+                formats = ('csv',)
+        for partition in partitions:
+            name = partition['name']
+            columns = partition['header'].split(',')
+            csv_path, resume, parquet_path = outputs[name]
+            self.columns[name] = columns
+            if 'csv' in formats or csv_path is None or manifest:
+                self.csv_sinks[name] = CsvSink(csv_path, columns, resume)
+            if 'parquet' in formats and parquet_path:
+                if manifest and csv_path:
+                    self.rebuilds[name] = (csv_path, parquet_path, columns, row_group_size)
+                else:
+                    self.parquet_sinks[name] = ParquetSink(parquet_path, columns, row_group_size)
+            if dedup and dedup in columns:
+                self.dedup_index[name] = columns.index(dedup)
+                self.filters[name] = DedupFilter(max_keys)
+                if resume is not None and csv_path and os.path.exists(csv_path):
+                    self.filters[name].seed(csv_path, self.dedup_index[name])
+
+    def put(self, path, digest, name, rows):
+        if self.error:
+            raise self.error
+        self.queue.put((path, digest, name, rows))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            if self.error:
+                continue
+            try:
+                self.write(*item)
+            except Exception as e:
+                logging.error('output: %s' % e)
+                self.error = e
+
+    def write(self, path, digest, name, rows):
+        if name in self.filters:
+            index, dedup_filter = self.dedup_index[name], self.filters[name]
+            rows = [row for row in rows if not dedup_filter.seen(row[index])]
+        start, end = None, None
+        if name in self.csv_sinks:
+            start, end = self.csv_sinks[name].write(rows)
+        if name in self.parquet_sinks:
+            self.parquet_sinks[name].write(rows)
+        if self.manifest:
+            csv_sink = self.csv_sinks.get(name)
+            self.manifest.record(path, name, digest, DONE, csv_sink.path if csv_sink else None, start, end)
+
+    def close(self):
+        """
+        Write what is still queued, close the files, rebuild the Parquet files of a manifest run
+        and report any write error.
+        """
+        self.queue.put(_STOP)
+        self.join()
+        for sink in list(self.csv_sinks.values()) + list(self.parquet_sinks.values()):
+            sink.close()
+        if not self.error:
+            for name, (csv_path, parquet_path, columns, row_group_size) in sorted(self.rebuilds.items()):
+                sink = ParquetSink(parquet_path, columns, row_group_size)
+                sink.copy_csv(csv_path)
+                sink.close()
+        for name, dedup_filter in sorted(self.filters.items()):
+            logging.info('output %s: %d duplicate rows dropped' % (name, dedup_filter.dropped))
+        if self.error:
+            raise self.error
@@ -1,86 +1,116 @@
-import codecs
+import logging
 import os
 import re
+import zlib
+from collections import defaultdict
+from functools import lru_cache
 from itertools import chain
 from operator import itemgetter
 
-import nltk
 import numpy as np
-import pandas as pd
-from lxml import etree
 from unidecode import unidecode
 
+from CVCodingTool.src.converters import configure_converter, get_converter
+from CVCodingTool.src.layout_cache import configure_layout_cache, get_layout_cache
+from CVCodingTool.src.output_writer import partition_rows
 from CVCodingTool.src.section_parser import EduParser, PubParser, GrantParser
+from CVCodingTool.src.text_store import TextStore
+
+HEADER_LIST = r'education|publication|fellowship|reference|presentation|profession|' \
+              r'languages|experience|position|research|conference|service|journal|' \
+              r'peer|award|activity|activities|review|skill|academic|article|paper|grant|' \
+              r'training|bibliography|book|lecture'
+HEADER_PATTERN = re.compile(HEADER_LIST, re.IGNORECASE)
+SPACED_PATTERN = re.compile(r'(?:[A-Za-z] ){4,}')
+WORD_PATTERN = re.compile(r'\s+')
+SPECIAL_PATTERN = re.compile(r"[#*()$]")
+GROUP_ATTRS = ('width', 'font', 'left', 'height')
+
+
+@lru_cache(maxsize=65536)
+def is_header(header):
+    """
+    CVParser.header_checker on the compiled patterns. The cheap checks (leading capital, word
+    count) run before the vocabulary search, and results are memoized per text, since the same
+    lines are checked again by text_preprocess, refine_extractor and get_partition.
+    """
+    if SPACED_PATTERN.search(header):
+        header = header.replace(' ', '')
+    return 'A' <= header[:1] <= 'Z' \
+        and len(WORD_PATTERN.split(header)) <= 8 \
+        and HEADER_PATTERN.search(header.replace(' ', '')) is not None
 
 
 class CVParser:
-    def __init__(self, filepath, filename):
+    def __init__(self, filepath, filename, converter=None, layout_cache=None, digest=None, layout=None):
         """
         This function initializes the file structure, based on the given filename, filepath and
         header list.
 
         The procedure is:
         file_preprocess: PDF file --> XML file parsed tree
-        getroot: XML file parsed tree --> XML file parsed root
-        text_preprocess: XML file parsed root --> Preprocessed Texts
-        nltk.Index: Preprocessed Texts --> Grouped fonts
+        text_preprocess: XML file parsed tree --> Preprocessed Texts (a TextStore)
+        build_groups: Preprocessed Texts --> Grouped fonts, lefts, heights and widths
         get_partition: Preprocessed Texts and Grouped fonts --> File partition structure
 
-        It also provides API for getting partition text of a particular partition: get_partition_contents
+        It also provides API for getting partition text of a particular partition: get_partition_records
+        (rows) and get_partition_contents (DataFrame)
+
+        When a layout cache is set, the texts and partition of a PDF already seen are loaded from
+        it and all the steps above are skipped.
 
         :param filepath:
         :param filename:
+        :param converter: PdfConverter used by file_preprocess, the configured one by default.
+        :param layout_cache: LayoutCache to use, the configured one by default, False for none.
+        :param digest: file_digest of the PDF if already computed, for the layout cache key.
+        :param layout: Texts and partition already computed by parse_layout, e.g. in a supervised
+                       child; all the steps above are skipped.
         """
         self.filepath = filepath
         self.filename = filename
-        self.header_list = r'education|publication|fellowship|reference|presentation|profession|' \
-                           r'languages|experience|position|research|conference|service|journal|' \
-                           r'peer|award|activity|activities|review|skill|academic|article|paper|grant|' \
-                           r'training|bibliography|book|lecture'
+        self.converter = converter or get_converter()
+        self.layout_cache = get_layout_cache() if layout_cache is None else layout_cache
+
+        if layout is not None:
+            columns, self.partition = layout
+            if columns is not None:
+                self.texts = TextStore.from_columns(columns)
+            return
 
         try:
+            layout_key = None
+            if self.layout_cache:
+                layout_key = self.layout_cache.key(os.path.join(self.filepath, self.filename), self.converter,
+                                                   digest)
+                layout = self.layout_cache.load(layout_key)
+                if layout:
+                    self.texts, self.partition = layout
+                    return
             self.tree = self.file_preprocess()
             self.texts = self.text_preprocess()
-            self.width_groups = nltk.Index((text.get('width'), text.text) for text in self.texts)
-            self.font_groups = nltk.Index((text.get('font'), text.text) for text in self.texts
-                                          if text.text
-                                          # if int(text.get('width')) < 420 or len(re.split(r'\s+', text.text)) <= 3
-                                          if len(text.text) < 100
-                                          if not re.findall(r"[#*()$]", text.text))
-            self.left_groups = nltk.Index((text.get('left'), text.text) for text in self.texts
-                                          if text.text
-                                          if len(text.text) < 100
-                                          if not re.findall(r"[#*()$]", text.text))
-            self.height_groups = nltk.Index((text.get('height'), text.text) for text in self.texts
-                                            if text.text
-                                            if len(text.text) < 100
-                                            if not re.findall(r"[#*()$]", text.text))
+            self.build_groups()
             self.partition = self.get_partition()
         except:
             self.partition = None
+            return
+        if layout_key:
+            # A layout that could not be cached is still a good one.
+            try:
+                self.layout_cache.save(layout_key, self.texts, self.partition)
+            except (OSError, ValueError, zlib.error) as e:
+                logging.warning('layout cache: %s not saved, %s' % (self.filename, e))
 
     def file_preprocess(self):
         """
         Do some file preprocessing. This includes transform pdf to xml, remove <b> and
-        <i> and other special tokens, remove unnecessary files.
+        <i> and other special tokens. The conversion runs in memory through the converter,
+        so no files are written next to the pdf.
 
         :return: Parsed xml tree.
         """
         file_pdf = os.path.join(self.filepath, self.filename)
-        os.system('pdftohtml -xml %s >& /dev/null' % file_pdf)
-        file_xml = re.sub(r'(.*)(?:\.pdf)$', r'\1.xml', file_pdf)
-        os.system("sed -ie 's/\xa0//g;s/\&amp\;//g;' %s >& /dev/null" % file_xml)
-        os.system('rm -rf %s/*.{png,jpg}' % self.filepath)
-        parser = etree.XMLParser(ns_clean=True, recover=True)
-
-        try:
-            tree = etree.parse(codecs.open(file_xml, encoding='utf-8'), parser=parser)
-        except:
-            tree = etree.parse(codecs.open(file_xml, encoding='ISO-8859-1'), parser=parser)
-
-        etree.strip_tags(tree, *['b', 'i', 'a'])
-        os.system('rm -rf %s/*.{xmle,xml}' % self.filepath)
-        return tree
+        return self.converter.convert(file_pdf)
 
     def text_preprocess(self):
         """
@@ -99,77 +129,102 @@ class CVParser:
                   Scenario III: Normal case. Set pre_pos.
         STEP IV: remove extra spaces.
 
-        :return: Preprocessed Text.
+        :return: Preprocessed Texts, as a TextStore.
         """
-        if not self.tree:
+        if self.tree is None:
             return None
+        store = TextStore.from_tree(self.tree)
+        text, top, left, width, font = store.text[:], store.top.tolist(), store.left.tolist(), \
+            store.width.tolist(), store.font.tolist()
+
         # STEP I
-        texts_initial = [text for text in self.tree.getroot().xpath('.//text | .//page')
-                         if text.text if re.sub(r'[ .]+', '', text.text) != '']
         texts_list = []
-        for text in texts_initial:
-            if text.get('top') == '0':
+        for pos, val in enumerate(text):
+            if not val or re.sub(r'[ .]+', '', val) == '':
+                continue
+            if top[pos] == 0:
                 texts_list.append([])
             else:
-                texts_list[-1].append(text)
-        texts_list = [sorted(i, key=lambda x: int(x.get('top'))) for i in texts_list]
+                texts_list[-1].append(pos)
+        texts_list = [sorted(i, key=lambda x: top[x]) for i in texts_list]
 
         # STEP II
         for texts in texts_list:
             pre_pos = 0
-            for pos, text in enumerate(texts[1:]):
-                if text.get('top') == '0':
-                    continue
-                pos += 1
-                top_diff = int(texts[pos].get('top')) - int(texts[pre_pos].get('top'))
-                texts[pos].text = text.text.strip()
-                if re.findall(r'_{10,}', text.text):
-                    texts[pos].text = re.sub(r'[_]', '', text.text)
-                    texts[pos].set('width', '100')
-                if re.findall(r'(?:[A-Za-z] ){4,}', text.text):
-                    texts[pos].set('width', '1')
+            for pos in range(1, len(texts)):
+                cur, pre, prev = texts[pos], texts[pre_pos], texts[pos - 1]
+                top_diff = top[cur] - top[pre]
+                text[cur] = text[cur].strip()
+                if '__________' in text[cur]:
+                    text[cur] = text[cur].replace('_', '')
+                    width[cur] = 100
+                if SPACED_PATTERN.search(text[cur]):
+                    width[cur] = 1
                 # STEP III
-                if -15 < int(texts[pos].get('top')) - int(texts[pre_pos].get('top')) < 12:
-                    if abs(int(texts[pos - 1].get('left')) - int(text.get('left'))) < 120:
-                        if texts[pos - 1].get('width') == '-1' or texts[pos - 1].get('width') == '0':
-                            texts[pre_pos].text += text.text
-                            text.set('width', '-1')
-                            texts[pos].text = ''
-                        elif not self.header_checker(texts[pre_pos].text) and not self.header_checker(text.text):
-                            texts[pre_pos].text += ' ' + text.text
-                            texts[pos].text = ''
+                if -15 < top_diff < 12:
+                    if abs(left[prev] - left[cur]) < 120:
+                        if width[prev] == -1 or width[prev] == 0:
+                            text[pre] += text[cur]
+                            width[cur] = -1
+                            text[cur] = ''
+                        elif not self.header_checker(text[pre]) and not self.header_checker(text[cur]):
+                            text[pre] += ' ' + text[cur]
+                            text[cur] = ''
                         else:
                             pre_pos = pos
                     else:
                         pre_pos = pos
                 elif -600 <= top_diff <= -15:
-                    texts[pre_pos - 1].text += ' ' + texts[pre_pos].text
-                    texts[pre_pos].text = ''
+                    text[texts[pre_pos - 1]] += ' ' + text[pre]
+                    text[pre] = ''
                     pre_pos = pos
                 else:
-                    if len(text.text) == 1 and text.text.isupper():
-                        text.set('width', '0')
+                    if len(text[cur]) == 1 and text[cur].isupper():
+                        width[cur] = 0
                         pre_pos = pos
-                    elif abs(int(texts[pre_pos].get('left')) - int(text.get('left'))) < 3 \
-                            and len(re.split('\s+', text.text)) <= 3 \
-                            and int(texts[pre_pos].get('left')) <= 80 \
-                            and len(re.split('\s+', texts[pre_pos].text)) <= 3 \
-                            and re.sub(r'\W+', '', texts[pre_pos].text) != '' \
-                            and texts[pre_pos].get('font') == text.get('font') \
-                            and abs(int(texts[pre_pos].get('top')) - int(text.get('top'))) < 150:
-                        texts[pre_pos].text += ' ' + text.text
-                        texts[pos].text = ''
+                    elif abs(left[pre] - left[cur]) < 3 \
+                            and len(WORD_PATTERN.split(text[cur])) <= 3 \
+                            and left[pre] <= 80 \
+                            and len(WORD_PATTERN.split(text[pre])) <= 3 \
+                            and re.sub(r'\W+', '', text[pre]) != '' \
+                            and font[pre] == font[cur] \
+                            and abs(top[pre] - top[cur]) < 150:
+                        text[pre] += ' ' + text[cur]
+                        text[cur] = ''
                     else:
                         pre_pos = pos
 
         # STEP IV
         for pos, texts in enumerate(texts_list):
-            for text in texts:
-                text.text = re.sub(r'\s{2,}', r' ', text.text)
-                text.text = unidecode(text.text)
-            texts_list[pos] = [text for text in texts if text.text != '']
+            for val in texts:
+                text[val] = unidecode(re.sub(r'\s{2,}', r' ', text[val]))
+            texts_list[pos] = [val for val in texts if text[val] != '']
 
-        return list(chain.from_iterable(texts_list))
+        return store.take(list(chain.from_iterable(texts_list)), text, width)
+
+    def build_groups(self):
+        """
+        One pass over the texts builds, for width, font, left and height:
+        - self.positions: attribute value --> positions of all the texts with that value, the
+          inverted index used to fetch the texts of a winning group.
+        - the *_groups: attribute value --> texts. The width groups hold every text; the font,
+          left and height groups only the header candidates (shorter than 100 characters and
+          without any of #*()$).
+        Groups are keyed by the integer columns of the TextStore (font ids for fonts).
+        """
+        self.positions = dict((attr, defaultdict(list)) for attr in GROUP_ATTRS)
+        groups = dict((attr, defaultdict(list)) for attr in GROUP_ATTRS)
+        columns = [(self.positions[attr], groups[attr], self.texts.column(attr).tolist(), attr == 'width')
+                   for attr in GROUP_ATTRS]
+        for pos, text in enumerate(self.texts.text):
+            # if width < 420 or len(re.split(r'\s+', text)) <= 3
+            candidate = text and len(text) < 100 and not SPECIAL_PATTERN.search(text)
+            for positions, group, column, every_text in columns:
+                positions[column[pos]].append(pos)
+                if candidate or every_text:
+                    group[column[pos]].append(text)
+        self.width_groups, self.font_groups, self.left_groups, self.height_groups = \
+            (groups[attr] for attr in GROUP_ATTRS)
 
     def refine_extractor(self, attr_group, attr, refine_function, threshold, findall_exp, ratio=False):
         """
@@ -216,8 +271,7 @@ class CVParser:
         if criterion_max > threshold:
             criterion_max_index = max(criterion.items(), key=itemgetter(1))[0]
             result = [(pos, ''.join(re.findall(findall_exp, val))) for pos, val in
-                      [(pos, text.text) for pos, text in enumerate(self.texts)
-                       if text.get(attr) == criterion_max_index]
+                      [(pos, self.texts.text[pos]) for pos in self.positions[attr][criterion_max_index]]
                       if refine_function(val)]
 
             if not result or len(result) >= 20:
@@ -243,27 +297,20 @@ class CVParser:
         :return: If found this string in the Text, return the corresponding font group; else
                  return None.
         """
-        special_token = [(pos, ''.join(re.findall(r'[A-Za-z*,()\-&]+', text.text)))
-                         for pos, text in enumerate(self.texts)
-                         if re.findall(r'^%s|%s\s+\(.+\)' % (string, string), text.text, re.IGNORECASE)
-                         if self.header_checker(text.text)]
+        special_token = [(pos, ''.join(re.findall(r'[A-Za-z*,()\-&]+', text)))
+                         for pos, text in enumerate(self.texts.text)
+                         if re.findall(r'^%s|%s\s+\(.+\)' % (string, string), text, re.IGNORECASE)
+                         if self.header_checker(text)]
         return special_token or None
 
     def header_checker(self, header):
         """
-        Checker whether the string should be a header. Use a manually-maintained header list.
+        Checker whether the string should be a header. Use a manually-maintained header list (HEADER_LIST).
 
         :param header: a string tentative to be a header.
         :return: boolean indicating whether it is a header.
         """
-        if re.findall(r'(?:[A-Za-z] ){4,}', header):
-            header = re.sub(r' ', '', header)
-        if re.findall(self.header_list, re.sub(r' ', '', header), re.IGNORECASE) \
-                and len(re.split(r'\s+', header)) <= 8 \
-                and len(re.findall(r"^[A-Z]", header)) > 0:
-            return True
-        else:
-            return False
+        return is_header(header)
 
     def get_partition(self):
         """
@@ -309,13 +356,13 @@ class CVParser:
                               "findall_exp": r'[A-Za-z\*,\-\(\)&]+',
                               "ratio": True}
 
-        special_width = ['0']
+        special_width = [0]
         for width in special_width:
             if self.width_groups[width] and 20 >= len(self.width_groups[width]) >= 4 \
                     and np.sum([self.header_checker(val) for val
                                 in self.width_groups[width]]) / len(self.width_groups[width]) > 0.5:
-                return [(pos, re.sub(r'\s', '', val.text)) for pos, val in enumerate(self.texts)
-                        if val.get('width') == width]
+                return [(pos, re.sub(r'\s', '', self.texts.text[pos]))
+                        for pos in self.positions['width'][width]]
 
         partition_refine_methods = [capitalize_paras, capitalize_ratio_paras, font_ratio_paras,
                                     left_ratio_paras, height_ratio_paras]
@@ -334,7 +381,7 @@ class CVParser:
         part.
 
         :param partition_name: The partition name you are looking for.
-        :return: Partition Texts.
+        :return: Partition Texts, as a TextStore.
         """
         if not self.partition:
             return None
@@ -349,12 +396,24 @@ class CVParser:
                     end_index = len(self.texts)
                 else:
                     end_index = self.partition[part[0] + 1][0]
-                contents += self.texts[begin_index:end_index]
-            return contents
+                contents += range(begin_index, end_index)
+            return self.texts.take(contents)
         else:
             return None
 
     def get_partition_contents(self, partition_obj):
+        """
+        :return: The rows of get_partition_records as a DataFrame with the header as columns.
+        """
+        import pandas as pd
+
+        return pd.DataFrame.from_records(self.get_partition_records(partition_obj),
+                                         columns=re.split(r',', partition_obj['header']))
+
+    def get_partition_records(self, partition_obj):
+        """
+        :return: The distinct rows of the partition, as tuples of csv cell text ordered by the header.
+        """
         partition_map = {"education": EduParser,
                          "publication": PubParser,
                          "grant": GrantParser}
@@ -375,8 +434,27 @@ class CVParser:
                                "filename": self.filename,
                                "header": partition_header}
             partition_dict = partition_parser(**partition_paras).section_dict
-            partition_df = pd.DataFrame.from_dict(partition_dict)
 
-            return partition_df.drop_duplicates()
+            return partition_rows(partition_dict, partition_header)
         else:
             raise Exception("No API for partition. %s" % partition)
+
+
+def init_layout_worker(conversion_config, layout_config):
+    """
+    Configure a supervised child for parse_layout, like the process that supervises it.
+    """
+    configure_converter(conversion_config)
+    configure_layout_cache(layout_config)
+
+
+def parse_layout(filepath, filename, digest=None):
+    """
+    Convert and partition a PDF: the part of CVParser run under the supervisor. The field
+    parsers and the network enrichment run afterwards on the result, in the calling process.
+
+    :return: (columns of the texts, partition) for the layout parameter of CVParser.
+    """
+    cv_parser = CVParser(filepath, filename, digest=digest)
+    texts = getattr(cv_parser, 'texts', None)
+    return texts.to_columns() if texts is not None else None, cv_parser.partition
@@ -0,0 +1,132 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from CVCodingTool.src.API import API_KEYS, API_QUOTA
+
+# Response code recorded when every key is out of budget and the ledger degrades to cache-only.
+QUOTA_EXHAUSTED_CODE = 601
+WINDOW = 7 * 24 * 3600
+BUCKET = 3600
+
+_quota_ledger = None
+
+
+class QuotaLedger:
+    def __init__(self, path, keys, quota, reserve=0.02, policy='cache_only', pause_interval=600):
+        """
+        Persistent usage ledger for the Elsevier APIs, whose quotas are counted per key over a
+        rolling seven days.
+
+        Every call is counted in an hourly bucket of (key, endpoint) in a SQLite file shared by
+        all workers, and the usage of a key is the sum of its buckets over the last seven days.
+        Keys are used round-robin while they have budget left. A key is considered spent when
+        less than reserve (a fraction of the quota) remains. Once all keys are spent, the
+        "pause" policy waits for budget to come back and "cache_only" refuses the call.
+
+        :param path: SQLite file, created if missing.
+        :param keys: Names of the API keys in API.API_KEYS to rotate over.
+        :param quota: Mapping of endpoint to the weekly number of calls allowed per key.
+        :param reserve: Fraction of the quota kept unused as a safety margin.
+        :param policy: "pause" or "cache_only".
+        :param pause_interval: Seconds between two budget checks while paused.
+        """
+        self.path = path
+        self.keys = list(keys)
+        self.quota = quota
+        self.reserve = reserve
+        self.policy = policy
+        self.pause_interval = pause_interval
+        self.turn = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        connection = self.connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS usage (key TEXT, endpoint TEXT, bucket INTEGER, '
+                           'calls INTEGER, PRIMARY KEY (key, endpoint, bucket))')
+        connection.commit()
+
+    def connection(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def usage(self, key, endpoint, now=None):
+        now = now or time.time()
+        return self.connection().execute(
+            'SELECT COALESCE(SUM(calls), 0) FROM usage WHERE key = ? AND endpoint = ? AND bucket > ?',
+            (key, endpoint, int((now - WINDOW) // BUCKET))).fetchone()[0]
+
+    def remaining(self, key, endpoint):
+        return self.quota[endpoint] * (1 - self.reserve) - self.usage(key, endpoint)
+
+    def try_acquire(self, endpoint):
+        """
+        Count one call against the next key that has budget left.
+
+        :return: The name of the key, or None if all keys are spent.
+        """
+        with self.lock:
+            order = self.keys[self.turn:] + self.keys[:self.turn]
+            self.turn = (self.turn + 1) % len(self.keys)
+        connection = self.connection()
+        now = time.time()
+        bucket = int(now // BUCKET)
+        for key in order:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if self.usage(key, endpoint, now) >= self.quota[endpoint] * (1 - self.reserve):
+                    continue
+                connection.execute('INSERT OR IGNORE INTO usage VALUES (?, ?, ?, 0)', (key, endpoint, bucket))
+                connection.execute('UPDATE usage SET calls = calls + 1 WHERE key = ? AND endpoint = ? '
+                                   'AND bucket = ?', (key, endpoint, bucket))
+                return key
+            finally:
+                connection.execute('COMMIT')
+        return None
+
+    def acquire(self, endpoint):
+        """
+        :return: The value of the API key to use for one call, or None if the call must not be
+                 made (budget spent under the cache_only policy).
+        """
+        if endpoint not in self.quota:
+            return None
+        while True:
+            key = self.try_acquire(endpoint)
+            if key:
+                return API_KEYS[key]
+            if self.policy != 'pause':
+                return None
+            logging.warning('quota: all keys spent for %s, pausing %ds' % (endpoint, self.pause_interval))
+            time.sleep(self.pause_interval)
+
+    def log_stats(self):
+        for endpoint in sorted(self.quota):
+            logging.info('quota %s: %s' % (endpoint, ', '.join('%s %d/%d' % (key, self.usage(key, endpoint),
+                                                                              self.quota[endpoint])
+                                                                for key in self.keys)))
+
+
+def configure_quota_ledger(quota_config):
+    """
+    Set up the process-wide quota ledger from the "quota" block of config.json.
+    An empty "path" disables quota accounting.
+    """
+    global _quota_ledger
+    if not quota_config or not quota_config.get('path'):
+        _quota_ledger = None
+    else:
+        _quota_ledger = QuotaLedger(quota_config['path'], quota_config['keys'], API_QUOTA,
+                                    quota_config.get('reserve', 0.02), quota_config.get('policy', 'cache_only'))
+    return _quota_ledger
+
+
+def get_quota_ledger():
+    return _quota_ledger
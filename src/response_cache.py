@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Response code recorded when running offline and the query is not in the cache.
+CACHE_MISS_CODE = 600
+# Only deterministic answers are kept; network errors and throttling are always retried.
+CACHEABLE_CODES = (200, 404)
+
+_response_cache = None
+
+
+class CachedResponse:
+    """
+    The part of a requests.Response that the field parsers read: status_code, text and json().
+    """
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    def __init__(self, path, ttl, max_size, offline=False, evict_interval=500):
+        """
+        Content-addressed cache of API responses, stored in a SQLite file so it survives
+        reruns and is shared by every worker process on the machine.
+
+        Entries are keyed by sha1(endpoint + normalized query). An entry older than ttl seconds
+        is treated as a miss, and once the stored bodies exceed max_size MB the least recently
+        used entries are dropped. In offline mode a miss is never sent to the network.
+
+        Hits stay reads: their access times are kept in memory and written in one transaction
+        every evict_interval hits, before an eviction pass and when the stats are logged, so
+        the workers sharing the file do not queue up on a write for every hit.
+
+        :param path: SQLite file, created if missing.
+        :param ttl: Time to live of an entry, in seconds.
+        :param max_size: Maximum total size of the stored bodies, in MB.
+        :param offline: Serve only from the cache.
+        :param evict_interval: Number of writes between two eviction passes.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size * 1024 * 1024
+        self.offline = offline
+        self.evict_interval = evict_interval
+        self.hits, self.misses, self.writes = 0, 0, 0
+        self.accessed = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        connection = self.connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, '
+                           'status INTEGER, body TEXT, size INTEGER, created REAL, accessed REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        connection.commit()
+
+    def connection(self):
+        """
+        SQLite connections cannot cross threads or forks, so each thread of each process
+        opens its own.
+        """
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.path, timeout=60)
+            self.local.connection.execute('PRAGMA journal_mode=WAL')
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    @staticmethod
+    def normalize(query):
+        return re.sub(r'\s+', ' ', str(query)).strip().lower()
+
+    def key(self, endpoint, query):
+        return hashlib.sha1(('%s\n%s' % (endpoint, self.normalize(query))).encode()).hexdigest()
+
+    def get(self, endpoint, query):
+        """
+        :return: A CachedResponse, or None on a miss.
+        """
+        key = self.key(endpoint, query)
+        connection = self.connection()
+        row = connection.execute('SELECT status, body, created FROM responses WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row and now - row[2] <= self.ttl:
+            with self.lock:
+                self.hits += 1
+                self.accessed[key] = now
+                flush = len(self.accessed) >= self.evict_interval
+            if flush:
+                self.flush()
+            return CachedResponse(row[0], row[1])
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def contains(self, endpoint, query):
+        """
+        Check for a live entry without touching the hit/miss counters.
+        """
+        row = self.connection().execute('SELECT created FROM responses WHERE key = ?',
+                                        (self.key(endpoint, query),)).fetchone()
+        return bool(row) and time.time() - row[0] <= self.ttl
+
+    def put(self, endpoint, query, resp):
+        if resp.status_code not in CACHEABLE_CODES:
+            return
+        now = time.time()
+        connection = self.connection()
+        connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (self.key(endpoint, query), endpoint, resp.status_code, resp.text,
+                            len(resp.text), now, now))
+        connection.commit()
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % self.evict_interval == 0
+        if evict:
+            self.evict()
+
+    def flush(self):
+        """
+        Write the access times of the hits since the last flush.
+        """
+        with self.lock:
+            accessed, self.accessed = self.accessed, {}
+        if accessed:
+            connection = self.connection()
+            connection.executemany('UPDATE responses SET accessed = ? WHERE key = ?',
+                                   [(val, key) for key, val in accessed.items()])
+            connection.commit()
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones until the cache fits max_size.
+        """
+        self.flush()
+        connection = self.connection()
+        connection.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total > self.max_size:
+            excess = total - self.max_size
+            freed = 0
+            keys = []
+            for key, size in connection.execute('SELECT key, size FROM responses ORDER BY accessed'):
+                if freed >= excess:
+                    break
+                keys.append((key,))
+                freed += size
+            connection.executemany('DELETE FROM responses WHERE key = ?', keys)
+        connection.commit()
+
+    def log_stats(self):
+        self.flush()
+        total = self.hits + self.misses
+        logging.info('response cache: %d hits, %d misses (%.1f%% hit rate), %d writes%s' %
+                     (self.hits, self.misses, 100.0 * self.hits / total if total else 0.0, self.writes,
+                      ', offline' if self.offline else ''))
+
+
+def configure_response_cache(cache_config, offline=False):
+    """
+    Set up the process-wide response cache from the "cache" block of config.json.
+    An empty "path" disables the cache, which offline mode cannot do without.
+    """
+    global _response_cache
+    offline = offline or bool(cache_config and cache_config.get('offline'))
+    if not cache_config or not cache_config.get('path'):
+        if offline:
+            raise ValueError('offline mode needs a response cache, set "path" in the "cache" block of config.json')
+        _response_cache = None
+    else:
+        _response_cache = ResponseCache(cache_config['path'], cache_config['ttl'], cache_config['max_size'],
+                                        offline=offline)
+    return _response_cache
+
+
+def get_response_cache():
+    return _response_cache
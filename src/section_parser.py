@@ -2,6 +2,7 @@ from itertools import chain
 from operator import itemgetter
 
 from CVCodingTool.src.field_parser import *
+from CVCodingTool.src.network import map_concurrent, network_option
 from CVCodingTool.src.section_sub_parser import section_paragraph_parser, education_identifier_parser, \
     section_left_parser
 
@@ -65,7 +66,7 @@ class EduParser(SectionParser):
     def section_analyzer(self, sections, texts):
         section_dict = []
         for val in sections:
-            string = ', '.join(text.text for text in texts[val[0]:val[1]])
+            string = ', '.join(texts.text[val[0]:val[1]])
             field_parser_helper = FieldParserHelper({**{'string': string}, **self.metadata}, self.field_parsers)
             section_dict += field_parser_helper.record_dict
         if len(section_dict) > 7:
@@ -73,6 +74,8 @@ class EduParser(SectionParser):
         return section_dict
 
     def section_checker(self, section_dict):
+        if not section_dict:
+            return False
         check_list = chain.from_iterable((itemgetter(idx)(val) for idx in self.needed_id) for val in section_dict)
         return len(section_dict) > 1 and all(check_list)
 
@@ -85,7 +88,7 @@ class EduParser(SectionParser):
                 if not val[idx]:
                     change_flag = False
                     for other_dicts in self.section_each_dict[1:]:
-                        for small_dict in other_dicts:
+                        for small_dict in other_dicts or []:
                             if small_dict[self.check_id] == val[self.check_id] and small_dict[idx]:
                                 section_sub_dict_final[pos][idx] = small_dict[idx]
                                 change_flag = True
@@ -109,14 +112,12 @@ class PubParser(SectionParser):
                                 PubScopusTransformer, PubCompareRatioParser, PubJournalExtractor, PubFieldFilter])
 
     def section_analyzer(self, sections, texts):
-        section_dict = []
-        for val in sections:
-            string = ', '.join(text.text for text in texts[val[0]:val[1]])
-            field_parser_helper = FieldParserHelper({**{'string': string}, **self.metadata}, self.field_parsers)
-            if field_parser_helper.record_dict:
-                section_dict.append(field_parser_helper.record_dict)
-        self.no_parsed += len([val for val in section_dict if val['filter_flag']])
-        self.no_received += len(section_dict)
+        """
+        CPU stage only: cut the publication strings. The network enrichment of every record of
+        the CV is done at once in enrich_sections.
+        """
+        section_dict = [{**{'string': ', '.join(texts.text[val[0]:val[1]])}, **self.metadata}
+                        for val in sections]
         if len(section_dict) == 0:
             return None
         return section_dict
@@ -127,7 +128,35 @@ class PubParser(SectionParser):
     def section_resolver(self):
         return self.section_each_dict[1]
 
+    def enrich_sections(self):
+        """
+        Network stage: run the field parsers of all records over the shared executor. Every
+        record keeps its own parser order (Crossref before DOI and Scopus), and the output
+        keeps the record order.
+
+        With batching enabled, the records stop before Scopus, the DOIs of the whole CV are
+        resolved by the ScopusBatchResolver shared with the other CVs parsed at the same time,
+        and the remaining parsers run on the cached answers.
+        """
+        batch_size = network_option('scopus_batch') or 1
+        if batch_size > 1:
+            split = self.field_parsers.index(PubScopusTransformer)
+            stages = [self.field_parsers[:split], self.field_parsers[split:]]
+        else:
+            stages = [self.field_parsers]
+
+        section_dict = self.section_dict
+        for pos, field_parsers in enumerate(stages):
+            if pos > 0:
+                get_scopus_batch_resolver().submit([val['first_doi'] for val in section_dict])
+            section_dict = map_concurrent(lambda dic: FieldParserHelper(dic, field_parsers).record_dict,
+                                          section_dict)
+        self.section_dict = [val for val in section_dict if val]
+        self.no_parsed += len([val for val in self.section_dict if val['filter_flag']])
+        self.no_received += len(self.section_dict)
+
     def multiple_resolver(self):
+        self.enrich_sections()
         if len(self.section_dict) == 0:
             self.section_dict = [dict.fromkeys(self.header)]
             if self.no_received == 0:
@@ -154,7 +183,7 @@ class GrantParser(SectionParser):
     def section_analyzer(self, sections, texts):
         section_dict = []
         for val in sections:
-            string = ', '.join(text.text for text in texts[val[0]:val[1]])
+            string = ', '.join(texts.text[val[0]:val[1]])
             field_parser_helper = FieldParserHelper({**{'string': string}, **self.metadata}, self.field_parsers)
             if field_parser_helper.record_dict:
                 section_dict.append(field_parser_helper.record_dict)
@@ -1,9 +1,16 @@
-import nltk
-from itertools import chain
 from functools import wraps
-from CVCodingTool.src.field_parser import EduFieldParser
+from itertools import chain
 import re
 
+import numpy as np
+
+from CVCodingTool.src.field_parser import EduFieldParser
+
+STAR_PATTERN = re.compile(r'\* |[0-9]+[.\)] |\"[A-Za-z]|\([0-9]+\)')
+# Below this many texts in all, paragraph_sections loops in plain Python: the set-up of its NumPy
+# operations costs more than they save (benchmarks/bench_section_parsers.py).
+PARAGRAPH_VECTOR_MIN = 256
+
 
 def education_identifier_parser(texts):
     """
@@ -18,25 +25,24 @@ def education_identifier_parser(texts):
     Since it is using the beginning as the identifier, when expanding it to the partition,
     it will be structured as the begin index of the section partitioner.
 
-    :param texts: text object in xml.
+    :param texts: TextStore of the section.
     :return: return section partitioner. Each partitioner should be two integers indicating
              the beginning and end of the index of text object. It should be lists nested in
              a big list.
     """
     # STEP I:
-    edu_parser = EduFieldParser({})
-    field_parsers = [edu_parser.year_parser, edu_parser.degree_parser, edu_parser.institution_parser]
+    field_parsers = [EduFieldParser.year_parser, EduFieldParser.degree_parser, EduFieldParser.institution_parser]
     partition = []
     parser = None
     for parser_test in field_parsers:
         if len(texts) > 1:
-            if parser_test(' '.join([texts[0].text, texts[1].text])):
+            if parser_test(' '.join(texts.text[:2])):
                 parser = parser_test
                 break
     if not parser:
         parser = field_parsers[0]
-    for pos, text in enumerate(texts):
-        if parser(text.text):
+    for pos, text in enumerate(texts.text):
+        if parser(text):
             partition.append(pos)
     # STEP II:
     if not partition:
@@ -58,20 +64,27 @@ def education_identifier_parser(texts):
 
 
 def section_reducer(f):
+    """
+    Split once more every section longer than five texts with the same parser, in a single pass
+    over the sections (one level deep: the sub-sections are not split again).
+
+    The decorated parser is called as f(texts, begin, end) on a range of the whole TextStore
+    and returns absolute positions, so no sub-store is built for the sections.
+    """
     @wraps(f)
     def inner_func(texts):
-        sections = f(texts)
+        sections = f(texts, 0, len(texts))
         if not sections:
             return sections
         new_sections = []
         for section in sections:
             if section[1] - section[0] > 5:
-                new_section = f(texts[section[0]:section[1]])
+                new_section = f(texts, section[0], section[1])
                 # if not new_section or len(new_section) == section[1] - section[0]:
                 if not new_section:
                     new_sections.append(section)
                 else:
-                    new_sections += [[va + section[0] for va in val] for val in new_section]
+                    new_sections += new_section
             else:
                 new_sections.append(section)
         return new_sections
@@ -79,7 +92,6 @@ def section_reducer(f):
     return inner_func
 
 
-@section_reducer
 def section_paragraph_parser(texts):
     """
     Compared to the second sub-section parser, this one is complicated.
@@ -102,7 +114,10 @@ def section_paragraph_parser(texts):
     ATTENTION:
     24, 48 are empirical figures. In other words, they are hard coded.
 
-    :param texts: text object in xml.
+    The sections longer than five texts are split once more by the same rule. Both levels are
+    computed for all their sections at once by paragraph_sections.
+
+    :param texts: TextStore of the section.
     :return: return section partitioner. Each partitioner should be two integers indicating
              the beginning and end of the index of text object. It should be lists nested in
              a big list.
@@ -110,77 +125,138 @@ def section_paragraph_parser(texts):
     # STEP I:
     if len(texts) == 1:
         return [[0, 1]]
+    sections = paragraph_sections(texts, [0], [len(texts)])[0]
 
-    top_attrs = [int(text.get('top')) for text in texts]
-    top_diff = [x[0] - x[1] for x in zip(top_attrs[1:], top_attrs[:-1])]
-    page_break_ids = [pos + 1 for pos, val in enumerate(top_diff) if val < -100 if int(texts[pos].get('width')) < 500]
-    top_most_list = nltk.FreqDist(x for x in chain(top_diff, [x - 1 for x in top_diff],
-                                                   [x + 1 for x in top_diff])).most_common()
-    counter = 0
-    top_most = top_most_list[counter][0]
-    while counter < len(top_most_list) - 1 and (top_most <= 5 or top_most >= 55):
-        counter += 1
-        top_most = top_most_list[counter][0]
+    # Second level, as section_reducer does for the other parsers.
+    long_sections = [section for section in sections if section[1] - section[0] > 5]
+    if not long_sections:
+        return sections
+    splits = iter(paragraph_sections(texts, [val[0] for val in long_sections], [val[1] for val in long_sections]))
+    new_sections = []
+    for section in sections:
+        if section[1] - section[0] > 5:
+            new_sections += next(splits)
+        else:
+            new_sections.append(section)
+    return new_sections
 
-    partition = []
-    for pos, diff in enumerate(top_diff):
-        if 55 >= diff > top_most + 4:
-            partition.append(pos + 1)
-    if not partition:
-        for pos, diff in enumerate(top_diff):
-            if 6 <= diff:
-                partition.append(pos + 1)
+
+def paragraph_sections(texts, begins, ends):
+    """
+    STEP I and STEP II of section_paragraph_parser for several ranges of texts at once, each of
+    at least two texts, with NumPy operations over all their gaps together. Short inputs go
+    through paragraph_range instead, range by range.
+
+    The paragraph spacing of a range is the most frequent value of its gaps widened by one
+    either way, skipping values outside (5, 55). Ties are broken by the first occurrence in
+    (gaps, gaps - 1, gaps + 1), the order FreqDist.most_common gave; if no value qualifies,
+    the last one in that order is taken.
+
+    :return: The sections of each range, with absolute positions.
+    """
+    if sum(ends) - sum(begins) < PARAGRAPH_VECTOR_MIN:
+        return [paragraph_range(texts, begin, end) for begin, end in zip(begins, ends)]
+    begins = np.asarray(begins, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    count = len(begins)
+    gaps = ends - begins - 1
+    offsets = np.concatenate([[0], np.cumsum(gaps)[:-1]])
+    segment = np.repeat(np.arange(count), gaps)
+    rank = np.arange(len(segment)) - offsets[segment]
+    pos = begins[segment] + rank
+    top = texts.top.astype(np.int64)
+    top_diff = top[pos + 1] - top[pos]
+
+    # Count every (range, value) and note its first occurrence in the widened gaps.
+    values = np.concatenate([top_diff, top_diff - 1, top_diff + 1])
+    segments = np.tile(segment, 3)
+    order = np.concatenate([rank, rank + gaps[segment], rank + 2 * gaps[segment]])
+    grouped = np.lexsort((order, values, segments))
+    segments, values, order = segments[grouped], values[grouped], order[grouped]
+    starts = np.flatnonzero(np.concatenate([[True], (segments[1:] != segments[:-1]) | (values[1:] != values[:-1])]))
+    group_segment, group_value, group_first = segments[starts], values[starts], order[starts]
+    group_count = np.diff(np.concatenate([starts, [len(values)]]))
+
+    # Rank the values of each range by count, then first occurrence.
+    ranked = np.lexsort((group_first, -group_count, group_segment))
+    ranked_segment, ranked_value = group_segment[ranked], group_value[ranked]
+    top_most = np.empty(count, dtype=np.int64)
+    last = np.flatnonzero(np.concatenate([ranked_segment[1:] != ranked_segment[:-1], [True]]))
+    top_most[ranked_segment[last]] = ranked_value[last]
+    good = np.flatnonzero((ranked_value > 5) & (ranked_value < 55))
+    good_segment, first_good = np.unique(ranked_segment[good], return_index=True)
+    top_most[good_segment] = ranked_value[good[first_good]]
+
+    hit = (top_diff <= 55) & (top_diff > top_most[segment] + 4)
+    has_hit = np.bincount(segment[hit], minlength=count) > 0
+    cut = np.where(has_hit[segment], hit, top_diff >= 6)
+    page_break = (top_diff < -100) & (texts.width[pos] < 500)
     # partition = [pos+1 for pos, text in enumerate(texts) if int(text.get('width')) < 500]
-    partition.append(len(texts))
-    partition += page_break_ids
-    partition = sorted(partition)
 
-    # STEP II:
-    sections = []
-    for pos, val in enumerate(partition):
-        if pos == 0:
-            begin_index = 0
-        else:
-            begin_index = partition[pos - 1]
-        end_index = val
-        sections.append([begin_index, end_index])
+    # STEP II: every cut ends a section, and the range end closes the last one.
+    cut_pos = np.concatenate([pos[cut] + 1, pos[page_break] + 1, ends])
+    cut_segment = np.concatenate([segment[cut], segment[page_break], np.arange(count)])
+    cut_order = np.lexsort((cut_pos, cut_segment))
+    cut_pos, cut_segment = cut_pos[cut_order].tolist(), cut_segment[cut_order].tolist()
+    sections = [[] for _ in range(count)]
+    previous = None
+    for seg, val in zip(cut_segment, cut_pos):
+        if seg != previous:
+            begin_index, previous = int(begins[seg]), seg
+        sections[seg].append([begin_index, val])
+        begin_index = val
+    return sections
+
+
+def paragraph_range(texts, begin, end):
+    """
+    paragraph_sections for a single range, in plain Python, with the same rules.
+
+    :return: The sections of the range, with absolute positions.
+    """
+    top = texts.top[begin:end].tolist()
+    width = texts.width[begin:end].tolist()
+    top_diff = [y - x for x, y in zip(top, top[1:])]
+    counts, first = {}, {}
+    for pos, val in enumerate(chain(top_diff, [x - 1 for x in top_diff], [x + 1 for x in top_diff])):
+        counts[val] = counts.get(val, 0) + 1
+        first.setdefault(val, pos)
+    ranked = sorted(counts, key=lambda val: (-counts[val], first[val]))
+    top_most = next((val for val in ranked if 5 < val < 55), ranked[-1])
 
+    partition = [pos + 1 for pos, diff in enumerate(top_diff) if 55 >= diff > top_most + 4]
+    if not partition:
+        partition = [pos + 1 for pos, diff in enumerate(top_diff) if diff >= 6]
+    partition += [pos + 1 for pos, diff in enumerate(top_diff) if diff < -100 and width[pos] < 500]
+    sections = []
+    begin_index = begin
+    for val in sorted(partition) + [end - begin]:
+        sections.append([begin_index, begin + val])
+        begin_index = begin + val
     return sections
 
 
 @section_reducer
-def section_left_parser(texts):
-    star_indicator = [pos for pos, val in enumerate(texts) if
-                      re.findall(r'^\* |^[0-9]+[.\)] |^\"[A-Za-z]|^\([0-9]+\)', val.text)]
-    if len(star_indicator) / len(texts) > 0.25:
+def section_left_parser(texts, begin, end):
+    star_indicator = [pos for pos in range(begin, end) if STAR_PATTERN.match(texts.text[pos])]
+    if len(star_indicator) / (end - begin) > 0.25:
         partition = star_indicator
     else:
-        left_attrs = [int(text.get('left')) for text in texts]
-        left_freq = nltk.FreqDist(left_attrs)
-        partition = []
-        if len(left_freq) > 1:
-            left_most = dict(left_freq.most_common(2))
-            left_identifier = min(left_most.keys())
-            right_identifier = max(left_most.keys())
-            if sum(left_most.values()) / len(texts) > 0.65 \
-                    and 0.2 < left_most[left_identifier] / left_most[right_identifier] < 2.4 \
-                    and not [val for val in left_freq.keys()
-                             if left_freq[val] > left_freq[left_identifier] if val < left_identifier]:
-                for pos, val in enumerate(texts):
-                    if int(val.get('left')) == left_identifier:
-                        partition.append(pos)
-            else:
-                return None
-        else:
+        left = texts.left[begin:end]
+        lefts, first, counts = np.unique(left, return_index=True, return_counts=True)
+        if len(lefts) <= 1:
             return None
-    sections = []
-    for pos, val in enumerate(partition):
-        begin_index = val
-        if pos == len(partition) - 1:
-            end_index = len(texts)
+        # The two most frequent left positions, ties broken by first occurrence as in FreqDist.
+        top_two = np.lexsort((first, -counts))[:2]
+        left_identifier, right_identifier = sorted(lefts[top_two].tolist())
+        left_count = int(counts[lefts == left_identifier][0])
+        right_count = int(counts[lefts == right_identifier][0])
+        if (left_count + right_count) / (end - begin) > 0.65 \
+                and 0.2 < left_count / right_count < 2.4 \
+                and not np.any((counts > left_count) & (lefts < left_identifier)):
+            partition = (np.flatnonzero(left == left_identifier) + begin).tolist()
         else:
-            end_index = partition[pos + 1]
-        sections.append([begin_index, end_index])
-    if len(sections) == 1:
+            return None
+    if len(partition) == 1:
         return None
-    return sections
+    return [[begin_index, end_index] for begin_index, end_index in zip(partition, partition[1:] + [end])]
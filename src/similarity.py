@@ -0,0 +1,196 @@
+import re
+from functools import lru_cache
+
+NON_WORD = re.compile(r'(?ui)\W')
+# fuzzywuzzy's force_ascii drops the characters 128 to 255 and keeps the others.
+LATIN1 = dict.fromkeys(range(128, 256))
+
+_similarity = None
+
+
+def intr(value):
+    return int(round(value))
+
+
+@lru_cache(maxsize=65536)
+def full_process(string):
+    """
+    fuzzywuzzy.utils.full_process(string, force_ascii=True): letters and digits only, lower
+    case, stripped. Memoized, as the same titles and names are scored against many candidates.
+    """
+    return NON_WORD.sub(' ', string.translate(LATIN1)).lower().strip()
+
+
+@lru_cache(maxsize=65536)
+def tokens(string):
+    return frozenset(full_process(string).split())
+
+
+def token_set_pairs(s1, s2):
+    """
+    The three pairs of strings fuzzywuzzy's token_set_ratio takes the best ratio of: sorted
+    common tokens against common plus remaining tokens of either string, and both of those
+    against each other. None if either string has no token.
+    """
+    tokens1, tokens2 = tokens(s1), tokens(s2)
+    if not tokens1 or not tokens2:
+        return None
+    sorted_sect = ' '.join(sorted(tokens1 & tokens2))
+    combined_1to2 = (sorted_sect + ' ' + ' '.join(sorted(tokens1 - tokens2))).strip()
+    combined_2to1 = (sorted_sect + ' ' + ' '.join(sorted(tokens2 - tokens1))).strip()
+    return [(sorted_sect, combined_1to2), (sorted_sect, combined_2to1), (combined_1to2, combined_2to1)]
+
+
+class SimilarityBackend:
+    """
+    String similarity on the scale of fuzzywuzzy (integers from 0 to 100, 0 when a string is
+    None or empty, 100 when both are equal). The *_many methods score one string against a
+    list of candidates, in the order of the candidates.
+    """
+    name = None
+
+    def ratio(self, s1, s2):
+        raise NotImplementedError
+
+    def partial_ratio(self, s1, s2):
+        raise NotImplementedError
+
+    def token_set_ratio(self, s1, s2):
+        raise NotImplementedError
+
+    def ratio_many(self, query, choices):
+        return [self.ratio(query, val) for val in choices]
+
+    def partial_ratio_many(self, query, choices):
+        return [self.partial_ratio(query, val) for val in choices]
+
+    def token_set_ratio_many(self, query, choices):
+        return [self.token_set_ratio(query, val) for val in choices]
+
+
+class FuzzyWuzzyBackend(SimilarityBackend):
+    """
+    fuzzywuzzy itself, the reference the other backends are checked against.
+    """
+    name = 'fuzzywuzzy'
+
+    def __init__(self):
+        from fuzzywuzzy import fuzz
+
+        self.fuzz = fuzz
+
+    def ratio(self, s1, s2):
+        return self.fuzz.ratio(s1, s2)
+
+    def partial_ratio(self, s1, s2):
+        return self.fuzz.partial_ratio(s1, s2)
+
+    def token_set_ratio(self, s1, s2):
+        return self.fuzz.token_set_ratio(s1, s2)
+
+
+class RapidFuzzBackend(SimilarityBackend):
+    """
+    The algorithms of fuzzywuzzy on the C++ edit distances of rapidfuzz (optional dependency):
+    the ratio is the normalized Indel similarity python-Levenshtein computes, partial_ratio
+    aligns the shorter string on the matching blocks of the Levenshtein edit operations, and
+    token_set_ratio compares the same sorted token strings. rapidfuzz's own partial_ratio and
+    token_set_ratio are not used, as they search alignments differently. The batch methods
+    compute all their ratios in one call.
+    """
+    name = 'rapidfuzz'
+
+    def __init__(self):
+        try:
+            from rapidfuzz import process
+            from rapidfuzz.distance import Indel, Levenshtein
+        except ImportError:
+            raise ImportError('The rapidfuzz similarity backend needs rapidfuzz: pip install rapidfuzz')
+        self.process = process
+        self.similarity = Indel.normalized_similarity
+        self.editops = Levenshtein.editops
+
+    def ratio(self, s1, s2):
+        if s1 is None or s2 is None:
+            return 0
+        if s1 == s2:
+            return 100
+        if not s1 or not s2:
+            return 0
+        return intr(100 * self.similarity(s1, s2))
+
+    def ratios(self, pairs):
+        """
+        ratio of every pair of strings, computed in one call when rapidfuzz has cpdist (3.6+).
+        """
+        # A missing string scores 0, as an empty one.
+        pairs = [('', 'x') if first is None or second is None else (first, second) for first, second in pairs]
+        cpdist = getattr(self.process, 'cpdist', None)
+        if cpdist is None or not pairs:
+            return [self.ratio(first, second) for first, second in pairs]
+        import numpy as np
+
+        similarities = cpdist([val[0] for val in pairs], [val[1] for val in pairs], scorer=self.similarity,
+                              dtype=np.float64).tolist()
+        return [100 if first == second else 0 if not first or not second else intr(100 * val)
+                for (first, second), val in zip(pairs, similarities)]
+
+    def ratio_many(self, query, choices):
+        return self.ratios([(query, val) for val in choices])
+
+    def partial_ratio(self, s1, s2):
+        if s1 is None or s2 is None:
+            return 0
+        if s1 == s2:
+            return 100
+        if not s1 or not s2:
+            return 0
+        shorter, longer = (s1, s2) if len(s1) <= len(s2) else (s2, s1)
+        best = 0.0
+        for block in self.editops(shorter, longer).as_matching_blocks():
+            long_start = max(block.b - block.a, 0)
+            score = self.similarity(shorter, longer[long_start:long_start + len(shorter)])
+            if score > .995:
+                return 100
+            best = max(best, score)
+        return intr(100 * best)
+
+    def token_set_ratio(self, s1, s2):
+        if s1 is None or s2 is None:
+            return 0
+        pairs = token_set_pairs(s1, s2)
+        if not pairs:
+            return 0
+        return max(self.ratio(first, second) for first, second in pairs)
+
+    def token_set_ratio_many(self, query, choices):
+        pairs = [token_set_pairs(query, val) if query is not None and val is not None else None for val in choices]
+        scores = iter(self.ratios([pair for val in pairs if val for pair in val]))
+        return [max(next(scores), next(scores), next(scores)) if val else 0 for val in pairs]
+
+
+backend_map = {"fuzzywuzzy": FuzzyWuzzyBackend,
+               "rapidfuzz": RapidFuzzBackend}
+
+
+def configure_similarity(similarity_config):
+    """
+    Select the process-wide similarity backend from the "similarity" block of config.json:
+    "backend" is rapidfuzz or fuzzywuzzy, empty for rapidfuzz when it is installed.
+    """
+    global _similarity
+    backend = (similarity_config or {}).get('backend')
+    if backend:
+        _similarity = backend_map[backend]()
+    else:
+        try:
+            _similarity = RapidFuzzBackend()
+        except ImportError:
+            _similarity = FuzzyWuzzyBackend()
+    return _similarity
+
+
+def get_similarity():
+    if _similarity is None:
+        configure_similarity(None)
+    return _similarity
@@ -0,0 +1,194 @@
+import os
+import pickle
+import select
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+# Length prefix of the pickled calls and results exchanged with the child.
+HEADER = struct.Struct('!Q')
+# Directory holding the CVCodingTool package, for the imports of the child.
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_supervisor = None
+
+
+def group_rss(pgid):
+    """
+    :return: Resident memory of all the processes of a process group, in bytes (Linux /proc).
+    """
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % pid, 'rb') as f:
+                fields = f.read().rsplit(b')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        # After the command name: state, ppid, pgrp, ... and rss (in pages) as the 22nd field.
+        if int(fields[2]) == pgid:
+            total += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    return total
+
+
+def write_message(stream, obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def read_message(stream):
+    """
+    :return: The next object written by write_message, None at the end of the stream.
+    """
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    return pickle.loads(stream.read(HEADER.unpack(header)[0]))
+
+
+def serve():
+    """
+    Main loop of the supervised child: run the (func, args) calls read from stdin one after
+    the other and write back (ok, value) for each, until stdin is closed.
+    """
+    results = os.fdopen(os.dup(1), 'wb')
+    # Anything else printed by the calls goes to stderr, not into the results.
+    os.dup2(2, 1)
+    while True:
+        message = read_message(sys.stdin.buffer)
+        if message is None:
+            break
+        func, args = message
+        try:
+            result = (True, func(*args))
+        except BaseException as e:
+            result = (False, '%s: %s' % (e.__class__.__name__, e))
+        try:
+            write_message(results, result)
+        except pickle.PicklingError as e:
+            write_message(results, (False, 'PicklingError: %s' % e))
+
+
+class Supervisor:
+    def __init__(self, timeout, max_rss, poll_interval=0.2, initializer=None, initargs=()):
+        """
+        Run functions in a child process under a wall-clock timeout and a resident memory limit.
+
+        The child is a fresh interpreter started with subprocess (not a fork of this process,
+        which may hold locks of its threads) and is reused from one call to the next, until it
+        is killed; the next call then starts a new one. It leads its own process group, so the
+        limits cover the subprocesses it starts (pdftohtml) as well, and an offender is killed
+        with the whole group. Calls and results are pickled over its stdin and stdout, so func
+        must be a module-level function of the package. Calls from several threads take turns.
+
+        :param timeout: Seconds a call may take, 0 for no limit.
+        :param max_rss: Resident memory the process group may use, in MB, 0 for no limit.
+        :param poll_interval: Seconds between two checks of the limits.
+        :param initializer: Function called in every new child before the first call, e.g. to
+                            configure the services it uses.
+        :param initargs: Arguments of initializer.
+        """
+        self.timeout = timeout
+        self.max_rss = max_rss * 1024 * 1024
+        self.poll_interval = poll_interval
+        self.initializer = initializer
+        self.initargs = initargs
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([PACKAGE_ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        command = [sys.executable, '-c', 'from CVCodingTool.src.supervisor import serve; serve()']
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+                                        start_new_session=True)
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process = None
+
+    def run(self, func, *args):
+        """
+        :return: (ok, value, elapsed seconds, peak rss in bytes). On success value is the return
+                 value of func, otherwise a message saying why the call failed or was killed.
+        """
+        with self.lock:
+            if self.process is None:
+                self.start()
+                if self.initializer:
+                    ok, value, elapsed, peak = self.call(self.initializer, self.initargs)
+                    if not ok:
+                        self.stop()
+                        return ok, 'initializer failed, %s' % value, elapsed, peak
+            return self.call(func, args)
+
+    def call(self, func, args):
+        start = time.time()
+        try:
+            write_message(self.process.stdin, (func, args))
+        except OSError:
+            self.stop()
+            return False, 'child exited without a result', time.time() - start, 0
+
+        fd = self.process.stdout.fileno()
+        data, size, peak, reason = bytearray(), None, 0, None
+        while size is None or len(data) < HEADER.size + size:
+            ready, _, _ = select.select([fd], [], [], self.poll_interval)
+            if ready:
+                chunk = os.read(fd, 1 << 16)
+                if not chunk:
+                    reason = 'child exited without a result'
+                    break
+                data += chunk
+                if size is None and len(data) >= HEADER.size:
+                    size = HEADER.unpack_from(data)[0]
+            elapsed = time.time() - start
+            rss = group_rss(self.process.pid)
+            peak = max(peak, rss)
+            if self.timeout and elapsed > self.timeout:
+                reason = 'killed after %.1fs: timeout of %ds' % (elapsed, self.timeout)
+            elif self.max_rss and rss > self.max_rss:
+                reason = 'killed after %.1fs: %dMB resident, limit %dMB' % (elapsed, rss >> 20, self.max_rss >> 20)
+            if reason:
+                break
+        elapsed = time.time() - start
+        if reason:
+            self.stop()
+            return False, reason, elapsed, peak
+        ok, value = pickle.loads(bytes(data[HEADER.size:]))
+        return ok, value, elapsed, peak
+
+
+def configure_supervisor(supervisor_config, enabled, initializer=None, initargs=()):
+    """
+    Set up supervised execution from the "supervisor" block of config.json when enabled
+    (--supervised): "timeout" in seconds, "max_rss" in MB and "poll_interval" in seconds.
+    initializer and initargs are passed to the Supervisor.
+    """
+    global _supervisor
+    if _supervisor:
+        _supervisor.stop()
+    if not enabled:
+        _supervisor = None
+    else:
+        supervisor_config = supervisor_config or {}
+        _supervisor = Supervisor(supervisor_config.get('timeout', 300), supervisor_config.get('max_rss', 2048),
+                                 supervisor_config.get('poll_interval', 0.2), initializer, initargs)
+    return _supervisor
+
+
+def get_supervisor():
+    return _supervisor
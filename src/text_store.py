@@ -0,0 +1,119 @@
+import numpy as np
+
+COLUMNS = ('top', 'left', 'width', 'height', 'font')
+
+
+def int_attribute(element, attr):
+    val = element.get(attr)
+    return int(val) if val else 0
+
+
+class TextView:
+    """
+    One text of a TextStore, answering .text and .get(attr) like the lxml element it replaces.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def text(self):
+        return self.store.text[self.index]
+
+    def get(self, attr):
+        return self.store.get(self.index, attr)
+
+
+class TextStore:
+    def __init__(self, text, top, left, width, height, font, fonts):
+        """
+        Columnar layout of the texts of a CV: the strings in a list, and top, left, width, height
+        and font id in int32 NumPy arrays, converted from the XML attributes once. fonts maps a
+        font id back to the font attribute of pdftohtml.
+
+        Integer indexing gives a TextView, slicing and take give a TextStore sharing fonts, so
+        the store can stand in for the list of text elements, while the parsers read the
+        columns directly.
+        """
+        self.text = text
+        self.top = np.asarray(top, dtype=np.int32)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.width = np.asarray(width, dtype=np.int32)
+        self.height = np.asarray(height, dtype=np.int32)
+        self.font = np.asarray(font, dtype=np.int32)
+        self.fonts = fonts
+
+    @classmethod
+    def from_tree(cls, tree):
+        """
+        Read every <page> and <text> element of a pdftohtml tree, in document order. Pages have
+        top 0 and font -1. Missing texts are kept as None.
+        """
+        elements = tree.getroot().xpath('.//text | .//page')
+        font_ids = {}
+        fonts = []
+        font = []
+        for element in elements:
+            name = element.get('font')
+            if name is None:
+                font.append(-1)
+                continue
+            if name not in font_ids:
+                font_ids[name] = len(fonts)
+                fonts.append(name)
+            font.append(font_ids[name])
+        return cls([element.text for element in elements],
+                   [int_attribute(element, 'top') for element in elements],
+                   [int_attribute(element, 'left') for element in elements],
+                   [int_attribute(element, 'width') for element in elements],
+                   [int_attribute(element, 'height') for element in elements],
+                   font, fonts)
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TextStore(self.text[index], self.top[index], self.left[index], self.width[index],
+                             self.height[index], self.font[index], self.fonts)
+        return TextView(self, range(len(self.text))[index])
+
+    def __iter__(self):
+        return (TextView(self, pos) for pos in range(len(self.text)))
+
+    def take(self, indices, text=None, width=None):
+        """
+        :param indices: Positions of the texts to keep, in the order wanted.
+        :param text: Replacement for the text column, indexed like this store.
+        :param width: Replacement for the width column, indexed like this store.
+        :return: A new store of the texts at indices.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        text = self.text if text is None else text
+        width = self.width if width is None else np.asarray(width, dtype=np.int32)
+        return TextStore([text[pos] for pos in indices.tolist()], self.top[indices], self.left[indices],
+                         width[indices], self.height[indices], self.font[indices], self.fonts)
+
+    def column(self, attr):
+        return getattr(self, attr)
+
+    def get(self, index, attr):
+        """
+        :return: The attribute as the string pdftohtml wrote, as lxml's get did.
+        """
+        val = int(getattr(self, attr)[index])
+        if attr == 'font':
+            return self.fonts[val] if val >= 0 else None
+        return str(val)
+
+    def to_columns(self):
+        """
+        :return: The columns as plain lists, for marshal.
+        """
+        return [self.text] + [getattr(self, attr).tolist() for attr in COLUMNS] + [self.fonts]
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(*columns)
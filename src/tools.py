@@ -1,4 +1,6 @@
-from collections import Mapping, Iterable
+import os
+import tempfile
+from collections.abc import Mapping, Iterable
 
 from unidecode import unidecode
 
@@ -14,3 +16,12 @@ def unicode_wrapper(obj):
         return type(obj)(map(unicode_wrapper, obj))
     else:
         return obj
+
+
+def temp_workspace(root=None):
+    """
+    Private scratch directory for one file, removed with everything in it when the with block
+    exits, even on errors. Parallel workers never share a workspace, so they cannot delete each
+    other's files. root can point to a tmpfs such as /dev/shm; None uses the system default.
+    """
+    return tempfile.TemporaryDirectory(prefix='cvparser_%d_' % os.getpid(), dir=root or None)